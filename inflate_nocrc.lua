@@ -718,4 +718,15 @@ M.b64dec_inflate_zlib_ascii = function(b64)
 	return table.concat(chars_gunzipped)
 end
 
+M.b64dec_inflate_zlib_bytes = function(b64)
+	-- returns table of byte values (0..255) for binary payloads
+	local bytes_gzipped=standard_b64decode(b64)
+	local bytes_gunzipped={}
+	local bytestream_gunzipped=function(b)
+		table.insert(bytes_gunzipped,b)
+	end
+	M.inflate_zlib_nocrc{input=bytes_gzipped, output=bytestream_gunzipped}
+	return bytes_gunzipped
+end
+
 return M
@@ -2,7 +2,9 @@ dofile(minetest.get_modpath(minetest.get_current_modname()) .. "/chatcmdbuilder.
 local inflate = dofile(minetest.get_modpath(minetest.get_current_modname()) .. "/inflate_nocrc.lua")
 
 irc_builder = {
-	version = "0.0.8",
+	version = "0.0.10",
+	-- set_node_list payload versions understood by this mod
+	node_list_versions = {1, 2},
 }
 
 irc_builder.get_ground_level = function(x, z)
@@ -34,6 +36,19 @@ minetest.register_privilege("irc_builder", {
     give_to_singleplayer = true
 })
 
+ChatCmdBuilder.new("irc_builder_version", function(cmd)
+	cmd:sub("", function(name)
+		local response = irc_builder.version
+		for _,v in ipairs(irc_builder.node_list_versions) do
+			response = response.." set_node_list"..v
+		end
+		return true, response
+	end)
+end, {
+	description = 'Returns mod version followed by supported set_node_list payload versions, eg "0.0.10 set_node_list1 set_node_list2"',
+	privs = {}
+})
+
 ChatCmdBuilder.new("get_node", function(cmd)
 	cmd:sub(":pos1:pos", function(name, pos)
 		local item = minetest.get_node_or_nil(pos)
@@ -75,6 +90,96 @@ end, {
 	privs = {}
 })
 
+-- Replies longer than one IRC line are compressed, base64 encoded and split into chunks.
+-- The first chunk is returned by the command and the rest are fetched with get_chunk
+irc_builder.chunk_size = 380
+irc_builder.chunks = {}
+irc_builder.next_chunk_id = 0
+
+irc_builder.reply_chunked = function(name, data)
+	local b64 = minetest.encode_base64(minetest.compress(data, "deflate"))
+	local chunks = {}
+	for i = 1, #b64, irc_builder.chunk_size do
+		table.insert(chunks, b64:sub(i, i + irc_builder.chunk_size - 1))
+	end
+	irc_builder.next_chunk_id = irc_builder.next_chunk_id + 1
+	local id = irc_builder.next_chunk_id
+	-- only the latest chunked reply is kept for each player
+	irc_builder.chunks[name] = {id=id, chunks=chunks}
+	return true, "chunk "..id.." 1 "..#chunks.." "..chunks[1]
+end
+
+ChatCmdBuilder.new("get_chunk", function(cmd)
+	cmd:sub(":id:int :n:int", function(name, id, n)
+		local reply = irc_builder.chunks[name]
+		if not reply or reply.id ~= id or not reply.chunks[n] then
+			return false, "no chunk "..id.." "..n
+		end
+		return true, "chunk "..id.." "..n.." "..#reply.chunks.." "..reply.chunks[n]
+	end)
+end, {
+	description = 'id n, eg: "/get_chunk 3 2". Returns chunk n of chunked reply id',
+	privs = {}
+})
+
+irc_builder.max_ground_levels = 16384
+
+ChatCmdBuilder.new("get_ground_levels", function(cmd)
+	cmd:sub(":x1:int :z1:int :x2:int :z2:int", function(name, x1, z1, x2, z2)
+		local xmin, xmax = math.min(x1, x2), math.max(x1, x2)
+		local zmin, zmax = math.min(z1, z2), math.max(z1, z2)
+		if (xmax - xmin + 1) * (zmax - zmin + 1) > irc_builder.max_ground_levels then
+			return false, "too many columns, maximum "..irc_builder.max_ground_levels
+		end
+		local levels = {}
+		for x = xmin, xmax do
+			for z = zmin, zmax do
+				table.insert(levels, irc_builder.get_ground_level(x, z))
+			end
+		end
+		return irc_builder.reply_chunked(name, table.concat(levels, ","))
+	end)
+end, {
+	description = 'x1 z1 x2 z2, eg: "/get_ground_levels 1 5 64 68". Returns chunked comma separated ground levels, x outer loop, z inner loop',
+	privs = {}
+})
+
+irc_builder.max_nodes_compressed = 32768
+
+ChatCmdBuilder.new("get_nodes_compressed", function(cmd)
+	cmd:sub(":pos1:pos :pos2:pos", function(name, pos1, pos2)
+		local pmin = {x=math.min(pos1.x, pos2.x), y=math.min(pos1.y, pos2.y), z=math.min(pos1.z, pos2.z)}
+		local pmax = {x=math.max(pos1.x, pos2.x), y=math.max(pos1.y, pos2.y), z=math.max(pos1.z, pos2.z)}
+		if (pmax.x - pmin.x + 1) * (pmax.y - pmin.y + 1) * (pmax.z - pmin.z + 1) > irc_builder.max_nodes_compressed then
+			return false, "too many nodes, maximum "..irc_builder.max_nodes_compressed
+		end
+		minetest.get_voxel_manip():read_from_map(pmin, pmax)
+		local palette = {}
+		local palette_index = {}
+		local indices = {}
+		for x = pmin.x, pmax.x do
+			for y = pmin.y, pmax.y do
+				for z = pmin.z, pmax.z do
+					local node_name = minetest.get_node({x=x, y=y, z=z}).name
+					local idx = palette_index[node_name]
+					if not idx then
+						table.insert(palette, node_name)
+						idx = #palette
+						palette_index[node_name] = idx
+					end
+					table.insert(indices, idx)
+				end
+			end
+		end
+		return irc_builder.reply_chunked(name, table.concat(palette, " ").."\n"..table.concat(indices, ","))
+	end)
+end, {
+	description = [[pos1 pos2, eg: "/get_nodes_compressed (1,8,1) (16,24,16)"
+	Returns chunked reply of node names separated by spaces, newline,
+	then comma separated 1 based indices into names, x outer loop, y, z inner loop]],
+	privs = {}
+})
+
 ChatCmdBuilder.new("get_connected_players", function(cmd)
 	cmd:sub("", function(name, x, z)
 		local response = ""
@@ -111,7 +216,7 @@ end, {
 	privs = {}
 })
 
--- function get_nodes is no longer used as response too long for irc
+-- function get_nodes is no longer used as response too long for irc. See get_nodes_compressed
 local get_nodes = function(name, pos1, pos2)
 	local stepx = (pos1.x > pos2.x) and -1 or 1
 	local stepy = (pos1.y > pos2.y) and -1 or 1
@@ -278,12 +383,27 @@ local pos_from_str=function(s, pmin, pmax)
 	return pos, pmin, pmax
 end
 
+irc_builder.set_pos_list = function(name, pos_list, pmin, pmax, item)
+	--print('set_node_list pmin='..minetest.write_json(pmin)..', pmax='..minetest.write_json(pmax))
+	local count = 0
+	local buildable = true
+	if pmin then
+		minetest.get_voxel_manip():read_from_map(pmin, pmax)
+	end
+	for _,pos_pair in ipairs(pos_list) do
+		local bld, cnt = irc_builder.set_nodes(name, pos_pair.pos1, pos_pair.pos2, item)
+		if not bld then
+			buildable = false
+		end
+		count = count + cnt
+	end
+	return buildable, count
+end
+
 ChatCmdBuilder.new("set_node_list", function(cmd)
 	cmd:sub(":b64:word :item:text", function(name, b64, itemtext)
-		local count = 0
 		local item = item_from_itemtext(itemtext)
 		local strposs = inflate.b64dec_inflate_zlib_ascii(b64)
-		local buildable = true
 		local pos, pos1, pos2, pmin, pmax
 		local pos_list = {}
 		for strpos in strposs:gmatch("([^%|]+)") do
@@ -296,17 +416,8 @@ ChatCmdBuilder.new("set_node_list", function(cmd)
 				pos, pmin, pmax = pos_from_str(strpos, pmin, pmax)
 				table.insert(pos_list, {pos1=pos, pos2=pos})
 			end
-			local str_x, str_y, str_z = strpos:match("(%-?[%d.]+),(%-?[%d.]+),(%-?[%d.]+)")
 		end
-		--print('set_node_list pmin='..minetest.write_json(pmin)..', pmax='..minetest.write_json(pmax))
-		minetest.get_voxel_manip():read_from_map(pmin, pmax)
-		for _,pos_pair in ipairs(pos_list) do
-			local bld, cnt = irc_builder.set_nodes(name, pos_pair.pos1, pos_pair.pos2, item)
-			if not bld then
-				buildable = false
-			end
-			count = count + cnt
-		end	
+		local buildable, count = irc_builder.set_pos_list(name, pos_list, pmin, pmax, item)
 		return buildable, itemtext.." "..count
 	end)
 end, {
@@ -314,6 +425,97 @@ end, {
 	privs = {irc_builder = true}
 })
 
+-- set_node_list2 payload is binary made of unsigned LEB128 varints, see ircbuilder/payload.py encode_node_list2_raw
+local read_varint = function(bytes, i)
+	local n = 0
+	local mult = 1
+	local b
+	repeat
+		b = bytes[i]
+		if not b then
+			return nil, i
+		end
+		i = i + 1
+		n = n + (b % 128) * mult
+		mult = mult * 128
+	until b < 128
+	return n, i
+end
+
+local unzigzag = function(n)
+	if n % 2 == 0 then
+		return n / 2
+	else
+		return -(n + 1) / 2
+	end
+end
+
+irc_builder.decode_node_list2 = function(bytes)
+	if bytes[1] ~= 2 then
+		return nil, "payload version "..tostring(bytes[1]).." not supported"
+	end
+	local pos_list = {}
+	if #bytes == 1 then
+		return pos_list
+	end
+	local i = 2
+	local ox, oy, oz
+	ox, i = read_varint(bytes, i)
+	oy, i = read_varint(bytes, i)
+	oz, i = read_varint(bytes, i)
+	if not oz then
+		return nil, "truncated payload"
+	end
+	local prev = {x=unzigzag(ox), y=unzigzag(oy), z=unzigzag(oz)}
+	local pmin = {x=prev.x, y=prev.y, z=prev.z}
+	local pmax = {x=prev.x, y=prev.y, z=prev.z}
+	while i <= #bytes do
+		local head, dy, dz
+		head, i = read_varint(bytes, i)
+		dy, i = read_varint(bytes, i)
+		dz, i = read_varint(bytes, i)
+		if not dz then
+			return nil, "truncated payload"
+		end
+		local is_cuboid = head % 2
+		local pos1 = {x=prev.x + unzigzag((head - is_cuboid) / 2), y=prev.y + unzigzag(dy), z=prev.z + unzigzag(dz)}
+		local pos2 = pos1
+		if is_cuboid == 1 then
+			local ex, ey, ez
+			ex, i = read_varint(bytes, i)
+			ey, i = read_varint(bytes, i)
+			ez, i = read_varint(bytes, i)
+			if not ez then
+				return nil, "truncated payload"
+			end
+			pos2 = {x=pos1.x + ex, y=pos1.y + ey, z=pos1.z + ez}
+		end
+		-- pos1 is the minimum corner and pmin starts at the origin which is the minimum of all corners
+		if pmax.x < pos2.x then pmax.x = pos2.x end
+		if pmax.y < pos2.y then pmax.y = pos2.y end
+		if pmax.z < pos2.z then pmax.z = pos2.z end
+		table.insert(pos_list, {pos1=pos1, pos2=pos2})
+		prev = pos1
+	end
+	return pos_list, pmin, pmax
+end
+
+ChatCmdBuilder.new("set_node_list2", function(cmd)
+	cmd:sub(":b64:word :item:text", function(name, b64, itemtext)
+		local item = item_from_itemtext(itemtext)
+		local pos_list, pmin, pmax = irc_builder.decode_node_list2(inflate.b64dec_inflate_zlib_bytes(b64))
+		if not pos_list then
+			-- no trailing count so the error can't be mistaken for "item count"
+			return false, "set_node_list2 failed: "..pmin
+		end
+		local buildable, count = irc_builder.set_pos_list(name, pos_list, pmin, pmax, item)
+		return buildable, itemtext.." "..count
+	end)
+end, {
+	description = "zipb64 item, eg: /set_node_list2 eNpjAgAAAwAD wool:orange. Payload is delta and varint encoded binary",
+	privs = {irc_builder = true}
+})
+
 irc_builder.set_sign = function(pos, direction, itemname, text)
 	local reg=minetest.registered_nodes[itemname]
 	if not reg then
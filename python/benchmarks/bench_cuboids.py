@@ -0,0 +1,104 @@
+"""Benchmark cuboid merging in nodebuilder.node_lists_with_cuboids against the original list based merger
+
+Run from the python directory:
+
+    python -m benchmarks.bench_cuboids
+"""
+import random
+import time
+
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+
+def legacy_node_lists_with_cuboids(node_lists_flat):
+    """Original merger kept for comparison. Uses list membership and list.remove so is O(n^2) or worse"""
+    node_lists = {}
+    for item, v in node_lists_flat.items():
+        node_lists[item] = []
+        vs = sorted(v)
+        while len(vs) > 0:
+            start_x, start_y, start_z = vs[0]
+            dx, dy, dz = 0, 0, 0
+            tfx, tfy, tfz = True, True, True
+            while tfx or tfy or tfz:
+                if tfx:
+                    x = start_x+dx+1
+                    for y in range(start_y, start_y+dy+1):
+                        for z in range(start_z, start_z+dz+1):
+                            if not (x, y, z) in vs:
+                                tfx = False
+                    if tfx:
+                        dx += 1
+                if tfy:
+                    y = start_y+dy+1
+                    for x in range(start_x, start_x+dx+1):
+                        for z in range(start_z, start_z+dz+1):
+                            if not (x, y, z) in vs:
+                                tfy = False
+                    if tfy:
+                        dy += 1
+                if tfz:
+                    z = start_z+dz+1
+                    for x in range(start_x, start_x+dx+1):
+                        for y in range(start_y, start_y+dy+1):
+                            if not (x, y, z) in vs:
+                                tfz = False
+                    if tfz:
+                        dz += 1
+            if dx == 0 and dy == 0 and dz == 0:
+                node_lists[item].append((start_x, start_y, start_z))
+            else:
+                node_lists[item].append(((start_x, start_y, start_z), (start_x+dx, start_y+dy, start_z+dz)))
+            for x in range(start_x, start_x+dx+1):
+                for y in range(start_y, start_y+dy+1):
+                    for z in range(start_z, start_z+dz+1):
+                        vs.remove((x, y, z))
+    return node_lists
+
+
+def hollow_shell(size):
+    return [(x, y, z) for x in range(size) for y in range(size) for z in range(size)
+            if x in (0, size - 1) or y in (0, size - 1) or z in (0, size - 1)]
+
+
+def solid_block(size):
+    return [(x, y, z) for x in range(size) for y in range(size) for z in range(size)]
+
+
+def random_scatter(size, fill=0.3, seed=1):
+    rnd = random.Random(seed)
+    return [(x, y, z) for x in range(size) for y in range(size) for z in range(size) if rnd.random() < fill]
+
+
+def time_merge(merge, points, *args):
+    start = time.perf_counter()
+    node_lists = merge({"default:stone": points}, *args)
+    elapsed = time.perf_counter() - start
+    assert payload.node_count(node_lists["default:stone"]) == len(points)
+    return elapsed, len(node_lists["default:stone"])
+
+
+def main():
+    shapes = (
+        ("hollow shell 16", hollow_shell(16)),
+        ("solid block 16", solid_block(16)),
+        ("random scatter 12", random_scatter(12)),
+        ("hollow shell 40", hollow_shell(40)),
+        ("solid block 40", solid_block(40)),
+        ("random scatter 30", random_scatter(30)),
+    )
+    print(f"{'shape':20} {'nodes':>7} {'merger':10} {'seconds':>9} {'cuboids':>8}")
+    for name, points in shapes:
+        runs = [("fast", nodebuilder.node_lists_with_cuboids, ("fast",)),
+                ("fewest", nodebuilder.node_lists_with_cuboids, ("fewest",))]
+        # the legacy merger takes minutes on the larger shapes
+        if len(points) <= 5000:
+            runs.insert(0, ("legacy", legacy_node_lists_with_cuboids, ()))
+        for label, merge, args in runs:
+            elapsed, cuboids = time_merge(merge, points, *args)
+            print(f"{name:20} {len(points):7} {label:10} {elapsed:9.4f} {cuboids:8}")
+
+
+if __name__ == "__main__":
+    main()
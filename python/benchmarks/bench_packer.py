@@ -0,0 +1,69 @@
+"""Benchmark packing of set_node_list commands by payload.node_list_commands against the original retry loop
+
+Run from the python directory:
+
+    python -m benchmarks.bench_packer
+"""
+import base64
+import random
+import time
+import zlib
+
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+
+def legacy_node_list_commands(list_pos, item, max_len=payload.MAX_CMD_LEN):
+    """Original packer kept for comparison. Tries 1, 2, 3, ... equal batches recompressing the whole list each time"""
+    batches = 0
+    max_per_batch = 0
+    commands = None
+    while batches == 0 or max_per_batch > max_len:
+        max_per_batch = 0
+        batches += 1
+        batch_size = len(list_pos) // batches + 1
+        commands = []
+        for batch in range(batches):
+            beg = batch * batch_size
+            end = beg + batch_size
+            s = '|' + ''.join(payload.node_list_text(pos) for pos in list_pos[beg:end])
+            b64 = base64.standard_b64encode(zlib.compress(s.encode('utf-8'))).decode('utf-8')
+            commands.append("set_node_list " + b64 + " " + item)
+            max_per_batch = max(len(commands[batch]), max_per_batch)
+    return commands
+
+
+def sphere_shell(radius):
+    node_dict = {}
+    for x in range(-radius, radius + 1):
+        for y in range(-radius, radius + 1):
+            for z in range(-radius, radius + 1):
+                if radius - 1 < (x * x + y * y + z * z) ** 0.5 <= radius:
+                    node_dict[(x + 1000, y + 20, z - 2000)] = "default:stone"
+    return nodebuilder.node_lists_from_node_dict(node_dict)["default:stone"]
+
+
+def random_scatter(count, seed=1):
+    rnd = random.Random(seed)
+    return [(rnd.randint(-3000, 3000), rnd.randint(0, 60), rnd.randint(-3000, 3000)) for _ in range(count)]
+
+
+def main():
+    shapes = (
+        ("sphere shell 20", sphere_shell(20)),
+        ("sphere shell 40", sphere_shell(40)),
+        ("random scatter 2000", random_scatter(2000)),
+        ("random scatter 8000", random_scatter(8000)),
+    )
+    print(f"{'shape':22} {'entries':>8} {'nodes':>8} {'packer':8} {'seconds':>9} {'commands':>9} {'per 1000 nodes':>15}")
+    for name, list_pos in shapes:
+        nodes = payload.node_count(list_pos)
+        for label, pack in (("legacy", legacy_node_list_commands), ("greedy", payload.node_list_commands)):
+            start = time.perf_counter()
+            commands = pack(list_pos, "default:stone")
+            elapsed = time.perf_counter() - start
+            print(f"{name:22} {len(list_pos):8} {nodes:8} {label:8} {elapsed:9.4f} {len(commands):9} {1000 * len(commands) / nodes:15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Benchmark ircparser.IrcLineParser against the original string buffer of receive_irc on recorded IRC traffic
+
+Traffic is recorded from a local fakeserver.FakeIrcServer answering a mix of short replies, replies with multi-byte
+utf-8 item names and long chunked bulk read replies. It is replayed in pieces the size of each recv, so some
+multi-byte characters are split between pieces, as happens on a real socket.
+
+Run from the python directory:
+
+    python -m benchmarks.bench_parser
+    python -m benchmarks.bench_parser --save traffic.bin
+    python -m benchmarks.bench_parser --load traffic.bin --chunk 1000
+"""
+import argparse
+import collections
+import socket
+import threading
+import time
+
+from ircbuilder import CHAR_SET, RECV_SIZE
+from ircbuilder import fakeserver
+from ircbuilder import ircparser
+
+# Items with multi-byte characters set in the world so get_node replies contain them
+UNICODE_ITEMS = ("wool:grün", "signs:café", "deco:日本", "deco:🙂")
+
+
+def record_traffic(commands=2000, nick="pybench"):
+    """Return all bytes received by a client sending commands to a fake server, with the size of each recv"""
+    with fakeserver.FakeIrcServer() as server, socket.create_connection((server.host, server.port)) as sock:
+        mtbotnick = server.mtbotnick
+
+        def send(line):
+            sock.sendall((line + "\r\n").encode('utf-8'))
+
+        def command(text):
+            send(f"PRIVMSG {mtbotnick} :{text}")
+
+        pieces = []
+        received = bytearray()
+        expected = len(UNICODE_ITEMS) + 2 + commands
+
+        def receive():
+            # read while sending so neither side blocks on a full socket buffer
+            marker = f" PRIVMSG {nick} :".encode('utf-8')
+            replies = 0
+            while replies < expected:
+                data = sock.recv(RECV_SIZE)
+                if not data:
+                    break
+                pieces.append(len(data))
+                # count markers ending in data, including any started in the previous piece
+                start = max(0, len(received) - len(marker) + 1)
+                received.extend(data)
+                replies += received.count(marker, start)
+
+        receiver = threading.Thread(target=receive)
+        receiver.start()
+        send(f"NICK {nick}")
+        send(f"USER {nick} 0 * :{nick}")
+        send("JOIN #bench")
+        command("login bench bench")
+        for i, item in enumerate(UNICODE_ITEMS):
+            command(f"cmd set_node ({i},5,0) {item}")
+        command("cmd set_nodes (0,0,0) (40,3,40) default:dirt")
+        for i in range(commands):
+            kind = i % 8
+            if kind < 4:
+                command(f"cmd get_node ({kind},5,0)")
+            elif kind < 6:
+                command(f"cmd get_ground_level {i % 40} {i % 37}")
+            elif kind == 6:
+                command(f"cmd get_nodes_compressed ({i % 20},0,0) ({i % 20 + 15},7,15)")
+            else:
+                command(f"cmd compare_nodes (0,0,0) ({i % 30},3,{i % 30}) default:dirt")
+        receiver.join()
+        send("QUIT")
+    return bytes(received), pieces
+
+
+def split(data, sizes):
+    """data split into pieces of the given sizes, repeating the sizes as required"""
+    pieces = []
+    i = 0
+    start = 0
+    while start < len(data):
+        size = sizes[i % len(sizes)]
+        pieces.append(data[start:start + size])
+        start += size
+        i += 1
+    return pieces
+
+
+def legacy_receive(pieces):
+    """Original receive_irc buffering and splitting. Returns (list of (sender, command, recipient, text), decode errors)"""
+    messages = []
+    errors = 0
+    buffer = ''
+    for data in pieces:
+        try:
+            buffer += data.decode(CHAR_SET)
+        except UnicodeDecodeError:
+            # receive_irc would have stopped with this exception. Carry on to compare the rest
+            errors += 1
+            buffer += data.decode(CHAR_SET, errors='replace')
+        last_line_complete = len(buffer) > 0 and buffer[-1:] in '\r\n'
+        lines = buffer.split('\r\n')
+        if not last_line_complete:
+            buffer = lines[-1]
+            del lines[-1]
+        else:
+            buffer = ''
+        for line in lines:
+            if line.startswith(':'):
+                parts = line[1:].split(' ', maxsplit=3)
+                if len(parts) == 4 and parts[1] == "PRIVMSG":
+                    messages.append((parts[0].split('!', 1)[0], parts[1], parts[2], parts[3].split(':', 1)[1]))
+    return messages, errors
+
+
+def parser_receive(pieces):
+    """IrcLineParser. Returns list of (sender, command, recipient, text)"""
+    parser = ircparser.IrcLineParser(CHAR_SET)
+    messages = []
+    for data in pieces:
+        for message in parser.feed(data):
+            if message.command == "PRIVMSG" and message.prefix is not None and len(message.params) >= 2:
+                messages.append((message.nick, message.command, message.params[0], message.trailing))
+    return messages
+
+
+def best_time(func, repeat):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark IRC line parsing on recorded traffic")
+    parser.add_argument("--commands", type=int, default=4000, help="commands sent when recording traffic")
+    parser.add_argument("--chunk", type=int, default=None,
+                        help="replay in pieces of this many bytes rather than the sizes recorded")
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each parser, best time reported")
+    parser.add_argument("--save", help="save recorded traffic to this file")
+    parser.add_argument("--load", help="replay traffic saved with --save rather than recording")
+    args = parser.parse_args()
+
+    if args.load:
+        with open(args.load, "rb") as f:
+            data = f.read()
+        sizes = [RECV_SIZE]
+    else:
+        data, sizes = record_traffic(args.commands)
+    if args.save:
+        with open(args.save, "wb") as f:
+            f.write(data)
+    pieces = split(data, [args.chunk] if args.chunk else sizes)
+    reference = [(m.nick, m.command, m.params[0], m.trailing)
+                 for m in map(ircparser.parse_line, data.decode(CHAR_SET).split('\r\n'))
+                 if m is not None and m.command == "PRIVMSG" and m.prefix is not None and len(m.params) >= 2]
+
+    (legacy, errors), legacy_seconds = best_time(lambda: legacy_receive(pieces), args.repeat)
+    messages, parser_seconds = best_time(lambda: parser_receive(pieces), args.repeat)
+    print(f"{len(data)} bytes in {len(pieces)} pieces, {len(reference)} PRIVMSG messages")
+    for name, result, seconds in (("legacy", legacy, legacy_seconds), ("IrcLineParser", messages, parser_seconds)):
+        # messages of reference which were lost or garbled
+        wrong = sum((collections.Counter(reference) - collections.Counter(result)).values())
+        print(f"{name:14} {seconds:8.4f}s {len(data) / seconds / 1e6:8.1f} MB/s {len(result) / seconds:10.0f} messages/s "
+              f"{wrong} lost or garbled")
+    print(f"legacy decode errors which would have stopped receive_irc: {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Benchmark each stage of sending a building on standard shapes
+
+Stages:
+  build   Building.build calls which create the node dict
+  merge   nodebuilder.node_lists_from_node_dict grouping node ids by item and merging them into cuboids
+  encode  payload.node_list_commands compressing and packing cuboids into set_node_list commands
+  send    nodebuilder.send_node_dict, or parallel.send_node_dict with --workers, of the node ids through a MinetestConnection to a local fakeserver.FakeIrcServer
+
+Reports nodes per second, IRC lines per 1000 nodes, bytes on the wire and peak memory allocated by python.
+The send stage also reports mapblock loads, the mapblocks each command changed summed over commands.
+Results can be saved as JSON and compared with a previous run to spot regressions.
+
+Run from the python directory:
+
+    python -m benchmarks.bench_pipeline --output results.json
+    python -m benchmarks.bench_pipeline --compare results.json
+    python -m benchmarks.bench_pipeline --quick --latency 0.05 --rate 10
+
+Peak memory of the send stage includes the fake server because it runs in the same process.
+"""
+import argparse
+import json
+import platform
+import time
+import tracemalloc
+
+import ircbuilder
+from ircbuilder import fakeserver
+from ircbuilder import floodcontrol
+from ircbuilder import nodebuilder
+from ircbuilder import parallel
+from ircbuilder import payload
+from ircbuilder.building import Building
+from ircbuilder.cache import item_name
+from ircbuilder.version import VERSION
+
+from benchmarks import shapes
+
+STAGES = ("build", "merge", "encode", "send")
+
+
+def build_stage(calls):
+    b = Building()
+    for call in calls:
+        b.build(*call)
+    return b
+
+
+def encode_stage(node_lists, version):
+    return [command for item, list_pos in node_lists.items()
+            for command in payload.node_list_commands(list_pos, item, version=version)]
+
+
+def measure(func, repeat=1, memory=True):
+    """Return (result, best seconds of repeat runs, peak bytes allocated during an extra traced run or None)"""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    peak = None
+    if memory:
+        tracemalloc.start()
+        func()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result, best, peak
+
+
+def record(shape, stage, nodes, seconds, peak, lines=None, nbytes=None, **extra):
+    result = {
+        'shape': shape,
+        'stage': stage,
+        'nodes': nodes,
+        'seconds': seconds,
+        'nodes_per_second': nodes / seconds if seconds > 0 else None,
+        'lines': lines,
+        'lines_per_1000_nodes': 1000 * lines / nodes if lines is not None and nodes else None,
+        'bytes': nbytes,
+        'peak_memory_bytes': peak,
+    }
+    result.update(extra)
+    return result
+
+
+def run(args):
+    results = []
+    server = fakeserver.FakeIrcServer(latency=args.latency).start()
+    flood_control = floodcontrol.FloodControl(burst=args.burst, rate=args.rate)
+    mc = ircbuilder.MinetestConnection.create(server.host, "bench", "bench", port=server.port, flood_control=flood_control)
+    mc.pipeline_window = args.window
+    version = mc.negotiate_node_list_version() if args.version is None else args.version
+    mc.node_list_version = version
+    try:
+        for name, calls, end_list in shapes.standard_shapes(args.quick):
+            b, seconds, peak = measure(lambda: build_stage(calls), args.repeat, args.memory)
+            node_dict = b.building
+            nodes = len(node_dict)
+            results.append(record(name, "build", nodes, seconds, peak, calls=len(calls)))
+
+            node_lists, seconds, peak = measure(
+                lambda: nodebuilder.node_lists_from_node_dict(b.nodes, args.strategy, b.palette), args.repeat, args.memory)
+            cuboids = sum(len(list_pos) for list_pos in node_lists.values())
+            results.append(record(name, "merge", nodes, seconds, peak, cuboids=cuboids, strategy=args.strategy))
+
+            commands, seconds, peak = measure(lambda: encode_stage(node_lists, version), args.repeat, args.memory)
+            results.append(record(name, "encode", nodes, seconds, peak, len(commands), sum(len(c) + 1 for c in commands),
+                                  payload_version=version))
+
+            def send():
+                server.world.nodes.clear()
+                lines, nbytes = mc.sender.lines_sent, mc.sender.bytes_sent
+                loads = server.world.mapblock_loads
+                if args.workers:
+                    parallel.send_node_dict(mc, b.nodes, end_list, args.strategy, b.palette, args.workers)
+                else:
+                    nodebuilder.send_node_dict(mc, b.nodes, end_list, args.strategy, b.palette, args.region_size or None)
+                return mc.sender.lines_sent - lines, mc.sender.bytes_sent - nbytes, server.world.mapblock_loads - loads
+
+            (lines, nbytes, loads), seconds, peak = measure(send, 1, args.memory)
+            verified = all(server.world.get_node(pos) == item_name(item) for pos, item in node_dict.items())
+            results.append(record(name, "send", nodes, seconds, peak, lines, nbytes, verified=verified,
+                                  latency=args.latency, rate=args.rate, window=args.window, mapblock_loads=loads,
+                                  region_size=args.region_size, workers=args.workers))
+    finally:
+        mc.part_channel()
+        server.stop()
+    return results
+
+
+def print_results(results, previous=None):
+    old = {(r['shape'], r['stage']): r for r in previous or ()}
+    header = f"{'shape':22} {'stage':7} {'nodes':>7} {'seconds':>9} {'nodes/s':>11} {'lines/1000':>10} {'bytes':>9} {'peak KiB':>9}"
+    if previous is not None:
+        header += f" {'vs old':>7}"
+    print(header)
+    for r in results:
+        line = (f"{r['shape']:22} {r['stage']:7} {r['nodes']:7} {r['seconds']:9.4f} {r['nodes_per_second'] or 0:11.0f} "
+                f"{'' if r['lines_per_1000_nodes'] is None else format(r['lines_per_1000_nodes'], '.2f'):>10} "
+                f"{'' if r['bytes'] is None else r['bytes']:>9} "
+                f"{'' if r['peak_memory_bytes'] is None else r['peak_memory_bytes'] // 1024:>9}")
+        if previous is not None:
+            before = old.get((r['shape'], r['stage']))
+            # ratio of time taken, so below 1.00 is faster than the previous run
+            line += f" {r['seconds'] / before['seconds']:7.2f}" if before and before['seconds'] > 0 else f" {'':>7}"
+        if r.get('mapblock_loads') is not None:
+            line += f" mapblock loads {r['mapblock_loads']}"
+        if r.get('verified') is False:
+            line += " NOT VERIFIED"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark build, merge, encode and send stages on standard shapes")
+    parser.add_argument("--quick", action="store_true", help="smaller shapes for a fast check")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each cpu stage, best time reported")
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="skip traced runs measuring peak memory")
+    parser.add_argument("--strategy", default="fast", choices=nodebuilder.CUBOID_STRATEGIES)
+    parser.add_argument("--version", type=int, default=None, choices=(payload.NODE_LIST_VERSION_1, payload.NODE_LIST_VERSION_2),
+                        help="set_node_list payload version. Default negotiated with the fake server")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every reply by the fake server")
+    parser.add_argument("--rate", type=float, default=1000.0, help="client flood control lines per second. 10 is the default of MinetestConnection")
+    parser.add_argument("--burst", type=int, default=10, help="client flood control burst")
+    parser.add_argument("--window", type=int, default=1, help="set_node_list batches in flight before waiting for replies")
+    parser.add_argument("--region-size", type=int, default=nodebuilder.MAPBLOCK_SIZE,
+                        help="edge length of regions sent one at a time. 0 sends each item in one go")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="merge and encode in a pool of this many processes while sending. 0 uses no pool")
+    parser.add_argument("--output", help="save results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from a previous run to compare times with")
+    args = parser.parse_args()
+
+    results = run(args)
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)['results']
+    print_results(results, previous)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({
+                'ircbuilder_version': VERSION,
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'time': time.strftime("%Y-%m-%dT%H:%M:%S"),
+                'arguments': vars(args),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
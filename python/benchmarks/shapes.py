@@ -0,0 +1,96 @@
+"""Standard shapes for benchmarks
+
+Each shape is a list of build calls (x, y, z, item) which produce the shape when passed to Building.build, so that
+benchmarks can time the build stage as well as merging, encoding and sending the resulting node dict.
+"""
+import math
+import random
+
+WOOL = ("wool:white", "wool:red", "wool:orange", "wool:yellow", "wool:green", "wool:blue", "wool:violet", "wool:black")
+
+
+def sphere_shell(radius, item="default:stone"):
+    """Hollow sphere one node thick built one node at a time"""
+    calls = []
+    for x in range(-radius, radius + 1):
+        for y in range(-radius, radius + 1):
+            for z in range(-radius, radius + 1):
+                if radius - 1 < math.sqrt(x * x + y * y + z * z) <= radius:
+                    calls.append((x + 1000, y + 20, z - 2000, item))
+    return calls
+
+
+def solid_cube(size, item="default:stone"):
+    """Solid cube built with a single call of ranges"""
+    return [(range(size), range(10, 10 + size), range(size), item)]
+
+
+def random_scatter(count, spread=200, item="default:glass", seed=1):
+    """Isolated nodes scattered through a large box so few can be merged into cuboids"""
+    rnd = random.Random(seed)
+    return [(rnd.randint(-spread, spread), rnd.randint(0, 60), rnd.randint(-spread, spread), item) for _ in range(count)]
+
+
+def pixel_art_wall(width, height, seed=1):
+    """Vertical wall of coloured wool pixels, one build call per pixel, with runs of colour like a real picture"""
+    rnd = random.Random(seed)
+    calls = []
+    for y in range(height):
+        colour = rnd.randrange(len(WOOL))
+        for x in range(width):
+            # mostly continue the previous colour with concentric rings through the middle
+            if rnd.random() < 0.15:
+                colour = rnd.randrange(len(WOOL))
+            ring = int(math.hypot(x - width / 2, y - height / 2)) // 6
+            calls.append((x + 50, y + 10, 30, WOOL[(colour + ring) % len(WOOL)]))
+    return calls
+
+
+def house(width, depth, storeys, x0=300, y0=10, z0=-300):
+    """Multi storey house with floors, walls, glass windows, doors, torches, stair roof and an air interior
+
+    Mixes ranges, single nodes and json items. Send with end_list=("air",) so the interior is cleared last.
+    """
+    calls = []
+    wall_height = 4
+    top = y0 + storeys * wall_height
+    x1, z1 = x0 + width - 1, z0 + depth - 1
+    for storey in range(storeys):
+        floor_y = y0 + storey * wall_height
+        calls.append((range(x0, x1 + 1), floor_y, range(z0, z1 + 1), "default:cobble"))
+        walls_y = range(floor_y + 1, floor_y + wall_height)
+        calls.append((range(x0, x1 + 1), walls_y, (z0, z1), "default:wood"))
+        calls.append(((x0, x1), walls_y, range(z0 + 1, z1), "default:wood"))
+        calls.append((range(x0 + 1, x1), walls_y, range(z0 + 1, z1), "air"))
+        # windows every 3 nodes along the long walls
+        for x in range(x0 + 2, x1 - 1, 3):
+            calls.append((x, floor_y + 2, (z0, z1), "default:glass"))
+        calls.append((x0 + 4, floor_y + 3, z0 + 1, '{"name":"default:torch","param2":4}'))
+        calls.append((x1 - 4, floor_y + 3, z1 - 1, '{"name":"default:torch","param2":5}'))
+    door_x = x0 + width // 2
+    calls.append((door_x, y0 + 1, z0, '{"name":"doors:door_wood_a","param2":0}'))
+    calls.append((door_x, y0 + 2, z0, '{"name":"doors:hidden","param2":0}'))
+    # stair roof rising from both long sides
+    for step in range((depth + 1) // 2):
+        calls.append((range(x0 - 1, x1 + 2), top + step, z0 - 1 + step, '{"name":"stairs:stair_wood","param2":0}'))
+        calls.append((range(x0 - 1, x1 + 2), top + step, z1 + 1 - step, '{"name":"stairs:stair_wood","param2":2}'))
+    return calls
+
+
+def standard_shapes(quick=False):
+    """List of (name, build calls, end_list) used by bench_pipeline. quick gives smaller shapes for a fast check"""
+    if quick:
+        return [
+            ("sphere shell 12", sphere_shell(12), ()),
+            ("solid cube 16", solid_cube(16), ()),
+            ("random scatter 1000", random_scatter(1000), ()),
+            ("pixel art wall 32x32", pixel_art_wall(32, 32), ()),
+            ("house 12x8x2", house(12, 8, 2), ("air",)),
+        ]
+    return [
+        ("sphere shell 30", sphere_shell(30), ()),
+        ("solid cube 48", solid_cube(48), ()),
+        ("random scatter 5000", random_scatter(5000), ()),
+        ("pixel art wall 96x64", pixel_art_wall(96, 64), ()),
+        ("house 24x16x3", house(24, 16, 3), ("air",)),
+    ]
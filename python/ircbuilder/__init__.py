@@ -1,4 +1,5 @@
-import base64
+import collections
+import itertools
 import json
 import logging
 import math
@@ -11,16 +12,27 @@ import string
 import sys
 import threading
 import time
-import zlib
 
 from contextlib import contextmanager
 
+from ircbuilder import cache
+from ircbuilder import dispatch
+from ircbuilder import floodcontrol
+from ircbuilder import ircparser
+from ircbuilder import metrics
 from ircbuilder import nodebuilder
+from ircbuilder import parallel
+from ircbuilder import payload
 from ircbuilder.version import VERSION
 
 # Maximum length of nickname used in IRC
 NICK_MAX_LEN = 9
+# Largest regions read by one get_ground_levels or get_nodes_compressed command. Bigger regions are read in tiles
+HEIGHTMAP_TILE = 64
+REGION_TILE = 32
 CHAR_SET = "UTF-8"
+# Bytes read from the socket at a time by receive_irc
+RECV_SIZE = 2048
 
 # logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
@@ -53,7 +65,8 @@ def escape(s):
 
 class MinetestConnection:
     """Connection to IRC Server sending commands to Minetest"""
-    def __init__(self, ircserver, mtbotnick, pybotnick, port=6697):
+    def __init__(self, ircserver, mtbotnick, pybotnick, port=6697, flood_control=None):
+        """flood_control: floodcontrol.FloodControl token bucket limiting lines sent. Defaults to 10 lines/s with burst of 10"""
         context = ssl.create_default_context()
         self.ircsock = context.wrap_socket(socket.socket(socket.AF_INET, socket.SOCK_STREAM), server_hostname=ircserver)
         try:
@@ -86,8 +99,31 @@ class MinetestConnection:
         self.ircserver_name = None
         # building is a node dict which stores results of build commands before sending to minetest in a batch
         self.building = {}
+        # record of building as last sent by send_building(incremental=True)
+        self.sent_snapshot = None
+        # cache.ReadCache of nodes read from minetest. None unless enable_cache() called
+        self.cache = None
+        # maximum number of set_node_list commands awaiting replies. 1 waits for each reply before sending next batch
+        self.pipeline_window = 1
+        # set_node_list payload version. None until negotiated with the irc_builder mod on first set_node_list
+        self.node_list_version = None
+        # journal.SendJournal recording set_node_list batches acknowledged. Batches already in it are not sent again
+        self.journal = None
+        # set_node_list batches which timed out or were rejected, so callers can tell whether a send fully succeeded
+        self.failed_batches = 0
+        # False once the receive thread has stopped, so nothing more can be sent or received
+        self.connected = True
+        # q_msg holds messages from mtbotnick which are not replies to commands. Replies go to dispatcher
         self.q_msg = queue.Queue()
         self.q_num = queue.Queue()
+        self.dispatcher = dispatch.ReplyDispatcher()
+        self.cmd_lock = threading.Lock()
+        # metrics.Metrics of latency, batches and stage times. Add listeners to receive each measurement
+        self.metrics = metrics.Metrics()
+        # irc_builder mod keeps only the latest chunked reply per player so chunked commands must not overlap
+        self.chunk_lock = threading.Lock()
+        # all lines are written by the scheduler's thread so receive_irc replying PONG can't interleave with other sends
+        self.sender = floodcontrol.SendScheduler(self.write_line, flood_control)
         self.receive_thread = threading.Thread(target=self.receive_irc)
         # Set daemon so thread will stop when main program stops
         self.receive_thread.daemon = True
@@ -103,29 +139,38 @@ class MinetestConnection:
 
     def part_channel(self):
         self.send_string("PART " + self.channel)
+        self.sender.close()
+        logger.info("part_channel: Metrics summary\n" + metrics.format_summary(self.metrics_summary()))
         self.ircsock.shutdown(0)  # stop sending and receiving
         self.ircsock.close()
 
     def close(self):
         self.part_channel()
 
-    def send_string(self, s):
+    def send_string(self, s, priority=False):
+        """Queue s to be sent to IRC server subject to flood control
+
+        priority: True for control replies such as PONG which are sent before any other queued lines
+        """
         if self.pycharm_edu_check_task:
             if not self.irc_disabled_message_printed:
                 print(self.irc_disabled_message)
                 self.irc_disabled_message_printed = True
             return
-        # Adding a short delay here can stop occasional SSLError SSLV3_ALERT_BAD_RECORD_MAC
-        time.sleep(0.1)
-        self.ircsock.send(encode(s.strip("\r\n") + "\n"))
+        self.sender.put(s.strip("\r\n"), priority)
+        self.metrics.queue_depth('send', self.sender.pending())
         if s.startswith('PRIVMSG') and ': login' in s:
             idx_pass = s.rfind(' ')
             s = s[:idx_pass] + ' <PASSWORD REMOVED FROM LOG>'
         logger.info("SEND: " + s)
 
+    def write_line(self, line):
+        """Write one line to the socket immediately. Normally only called by self.sender"""
+        self.ircsock.sendall(encode(line + "\n"))
+
     def pong(self, *items):
         items = ['PONG'] + [x for x in items if x is not None]
-        self.send_string(' '.join(items))
+        self.send_string(' '.join(items), priority=True)
 
     def receive_irc(self):
         if self.pycharm_edu_check_task:
@@ -134,66 +179,67 @@ class MinetestConnection:
                 self.q_msg.put(self.irc_disabled_message)
             return
 
-        buffer = ''
+        parser = ircparser.IrcLineParser(CHAR_SET)
         while True:
             try:
-                buffer += self.ircsock.recv(2048).decode(CHAR_SET)
+                data = self.ircsock.recv(RECV_SIZE)
             except socket.timeout:
                 logger.warning("socket.recv timed out!!")
+                continue
             except ssl.SSLError as se:
                 logger.debug(f"SSLError but not stopping receive thread {se=}")
+                continue
             except OSError as ose:
                 # socket has been closed so stop receiving thread probably in part_channel
                 logger.debug(f"Socket closed so stopping receive thread {ose=}")
                 break
-            last_line_complete = len(buffer) > 0 and buffer[-1:] in '\r\n'
-            lines = buffer.split('\r\n')
-            if not last_line_complete:
-                buffer = lines[-1]
-                del lines[-1]
+            if not data:
+                logger.debug("Connection closed by server so stopping receive thread")
+                break
+            for message in parser.feed(data):
+                self.handle_message(message, parser.pending())
+        self.connected = False
+        # no more replies can arrive so don't keep commands waiting for their timeouts
+        self.dispatcher.close()
+
+    def handle_message(self, message, pending=0):
+        """Act on one ircparser.IrcMessage received from the IRC server
+
+        pending: bytes of incomplete lines still to be parsed, for logging
+        """
+        if logger.level > logging.DEBUG:
+            logger.info(f"RECV: {message.line}")
+        else:
+            logger.debug(f"RECV {len(message.line)} {pending}: {message.line}")
+        if message.prefix is None:
+            if message.command == "PING":
+                self.pong(*message.params)
+            elif message.command == "VERSION":
+                self.send_string("VERSION python ircbuilder " + VERSION, priority=True)
+            return
+        sender_name = message.nick
+        if not self.ircserver_name:
+            self.ircserver_name = sender_name
+        recipient_name = message.params[0] if message.params else None
+        logger.debug(f"receive_irc: SENDER: {sender_name} RECIPIENT: {recipient_name}")
+        if recipient_name != self.pybotnick:
+            return
+        if message.command == "PRIVMSG" and message.trailing == "\x01VERSION\x01":
+            self.send_string("VERSION python ircbuilder " + VERSION, priority=True)
+        if sender_name == self.ircserver_name:
+            if message.command.isdigit() and int(message.command):
+                self.q_num.put(int(message.command))
+                self.metrics.queue_depth('q_num', self.q_num.qsize())
+                logger.debug(f"receive_irc: Queued msg_num: {message.command}")
+        elif sender_name == self.mtbotnick and message.command == "PRIVMSG" and len(message.params) > 1:
+            # get the message to look for commands
+            reply = message.trailing
+            if self.dispatcher.deliver(reply):
+                logger.debug(f"receive_irc: Delivered reply: {reply}")
             else:
-                buffer = ''
-            for line in lines:
-                if len(line) == 0:
-                    continue
-                if logger.level > logging.DEBUG:
-                    logger.info(f"RECV: {line}")
-                else:
-                    logger.debug(f"RECV {len(line)} {len(buffer)}: {line}")
-                if line.find("PING :") == 0:
-                    self.pong(line[6:])
-                elif line.find("VERSION") == 0:
-                    self.send_string("VERSION python ircbuilder " + VERSION)
-                else:
-                    if line.startswith(':'):
-                        parts = line[1:].split(' ', maxsplit=3)
-                        # 0: sender
-                        # 1: PRIVMSG
-                        # 2: recipient
-                        # 3: message (starting with a :)
-                        sender = parts[0]
-                        sender_name = sender.split('!', 1)[0]
-                        if not self.ircserver_name:
-                            self.ircserver_name = sender_name
-                        recipient_name = parts[2]
-                        logger.debug(f"receive_irc: SENDER: {sender_name} RECIPIENT: {recipient_name}")
-                        if recipient_name == self.pybotnick:
-                            if parts[1] == "PRIVMSG" and parts[3] == ":\x01VERSION\x01":
-                                self.send_string("VERSION python ircbuilder " + VERSION)
-                            if sender_name == self.ircserver_name:
-                                try:
-                                    message_num = int(parts[1])
-                                except ValueError:
-                                    message_num = None
-                                if message_num:
-                                    self.q_num.put(message_num)
-                                    logger.debug(f"receive_irc: Queued msg_num: {parts[1]}")
-                            elif sender_name == self.mtbotnick:
-                                if parts[1] == "PRIVMSG":
-                                    # get the message to look for commands
-                                    message = parts[3].split(':', 1)[1]
-                                    self.q_msg.put(message)
-                                    logger.debug(f"receive_irc: Queued message: {message}")
+                self.q_msg.put(reply)
+                self.metrics.queue_depth('q_msg', self.q_msg.qsize())
+                logger.debug(f"receive_irc: Queued unsolicited message: {reply}")
 
     def send_msg(self, msg):  # send private message to mtbotnick
         self.send_privmsg(self.channel + " :" + msg)
@@ -202,95 +248,208 @@ class MinetestConnection:
         self.send_string("PRIVMSG " + msg)
 
     def wait_for_privmsg(self, timeout=5.0):
+        """Wait for a message from mtbotnick which is not a reply to a command sent with send_irccmd"""
         start = time.time()
-        while time.time() - start < timeout:
-            if not self.q_msg.empty():
-                return self.q_msg.get()
-            else:
-                time.sleep(0.1)
-        logger.info("Timeout waiting for privmsg " + str(time.time() - start))
-        return
+        try:
+            return self.q_msg.get(timeout=timeout)
+        except queue.Empty:
+            logger.info("Timeout waiting for privmsg " + str(time.time() - start))
+            return
+
+    def wait_for_reply(self, ticket, timeout=5.0):
+        """Wait for the reply to a command sent with send_irccmd(msg, wait=False). Returns None on timeout"""
+        if self.pycharm_edu_check_task:
+            # nothing was sent so only message available is irc_disabled_message
+            return self.wait_for_privmsg(timeout)
+        reply = self.dispatcher.wait(ticket, timeout)
+        self.metrics.command(ticket.command, time.monotonic() - ticket.sent_at, reply is None)
+        return reply
 
     def wait_for_message_num(self, message_num, timeout=15.0):
         start = time.time()
-        while time.time() - start < timeout:
-            if not self.q_num.empty():
-                num = self.q_num.get()
-                if message_num == num or num >= 400:
-                    # logger.debug(f"wait_for_message_num: Seconds {(time.time()-start)} waiting for {message_num} and found {num}")
-                    return num
-            else:
-                time.sleep(0.1)
+        remaining = timeout
+        while remaining > 0:
+            try:
+                num = self.q_num.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if message_num == num or num >= 400:
+                # logger.debug(f"wait_for_message_num: Seconds {(time.time()-start)} waiting for {message_num} and found {num}")
+                return num
+            remaining = timeout - (time.time() - start)
         logger.warning(f"Timeout waiting for {message_num}. Time taken {time.time() - start} ")
         return None
 
-    def send_irccmd(self, msg):  # send private message to mtbotnick
-        # self.send_msg(self.mtbotnick + ': ' + msg) # displays in chat room
-        self.send_privmsg(self.mtbotnick + ' : ' + msg)  # doesn't display in chat room
-        return self.wait_for_privmsg()
+    def send_irccmd(self, msg, wait=True, timeout=5.0):  # send private message to mtbotnick
+        """Send msg to mtbotnick and return its reply, or None if no reply within timeout seconds
 
-    def send_cmd(self, msg):  # send private message to mtbotnick
-        return self.send_irccmd("cmd " + msg)
+        If wait is False return a ticket immediately. Pass the ticket to wait_for_reply to get the reply
+        """
+        # ticket must be registered in the same order as the command is queued for sending
+        with self.cmd_lock:
+            ticket = self.dispatcher.expect(' '.join(msg.split(' ', 2)[:2]))
+            # self.send_msg(self.mtbotnick + ': ' + msg) # displays in chat room
+            self.send_privmsg(self.mtbotnick + ' : ' + msg)  # doesn't display in chat room
+        self.metrics.queue_depth('replies', self.dispatcher.outstanding())
+        if wait:
+            return self.wait_for_reply(ticket, timeout)
+        return ticket
+
+    def send_cmd(self, msg, wait=True, timeout=5.0):  # send private message to mtbotnick
+        return self.send_irccmd("cmd " + msg, wait, timeout)
+
+    def enable_cache(self, max_size=65536, ttl=None):
+        """Cache results of get_node, compare_nodes and get_ground_level. Writes through this connection update cache
+
+        max_size: maximum number of entries before least recently used are evicted
+        ttl: seconds before entries expire so changes by other players are seen. None means never expire
+        returns the cache.ReadCache. Its stats() reports hits and misses
+        """
+        self.cache = cache.ReadCache(max_size, ttl)
+        return self.cache
+
+    def disable_cache(self):
+        self.cache = None
+
+    def invalidate_cache(self, pos1=None, pos2=None):
+        """Forget cached reads in cuboid pos1 to pos2, or all cached reads if no cuboid given"""
+        if self.cache is not None:
+            self.cache.invalidate(pos1 if pos1 is None else nodebuilder.int_tuple(*pos1),
+                                  pos2 if pos2 is None else nodebuilder.int_tuple(*pos2))
+
+    def _written(self, pos1, pos2, itemtext, reply, expected):
+        """Update cache after a write of expected nodes which returned reply"""
+        if self.cache is not None:
+            name = cache.item_name(itemtext) if payload.reply_count(reply, itemtext) == expected else None
+            self.cache.written(pos1, pos2, name)
 
     def get_node(self, x, y, z):
         """Get block (x,y,z) => item:string"""
-        return self.send_cmd("get_node " + str_xyz_int(x, y, z))
+        pos = nodebuilder.int_tuple(x, y, z)
+        if self.cache is not None:
+            name = self.cache.get_node(pos)
+            if name is not None:
+                return name
+        name = self.send_cmd("get_node " + str_xyz_int(x, y, z))
+        if self.cache is not None:
+            self.cache.put_node(pos, name)
+        return name
 
     def compare_nodes(self, x1, y1, z1, x2, y2, z2, item):
         """Compare a cuboid of blocks (x1, y1, z1, x2, y2, z2) with an item => count of differences"""
+        if self.cache is not None and not item.startswith("{"):
+            # json items compare attributes such as param2 which are not cached
+            count = self.cache.compare_nodes(nodebuilder.int_tuple(x1, y1, z1), nodebuilder.int_tuple(x2, y2, z2), item)
+            if count is not None:
+                return str(count)
         return self.send_cmd("compare_nodes " + str_xyz_int(x1, y1, z1) + str_xyz_int(x2, y2, z2) + " " + item)
 
     def set_node(self, x, y, z, item):
         """Set block (x, y, z, item)"""
-        return self.send_cmd("set_node " + str_xyz_int(x, y, z) + item)
+        ret = self.send_cmd("set_node " + str_xyz_int(x, y, z) + item)
+        pos = nodebuilder.int_tuple(x, y, z)
+        self._written(pos, pos, item, ret, 1)
+        return ret
 
     def set_nodes(self, x1, y1, z1, x2, y2, z2, item):
         """Set a cuboid of blocks (x1, y1, z1, x2, y2, z2, item)"""
-        return self.send_cmd("set_nodes " + str_xyz_int(x1, y1, z1) + str_xyz_int(x2, y2, z2) + item)
-
-    def set_node_list(self, list_pos, item):
-        """Set all blocks at a list of position tuples to the same item ([(x1, y1, z1), (x2, y2, z2), ...], item)"""
-        batches = 0
-        max_per_batch = 0
-        b64 = None
-        while batches == 0 or max_per_batch > 400:
-            # keep increasing the number of batches until max_per_batch <= 400
-            max_per_batch = 0
-            batches += 1
-            batch_size = len(list_pos) // batches + 1
-            b64 = []
-            for batch in range(batches):
-                beg = batch * batch_size
-                end = beg + batch_size
-                s = '|'
-                for pos in list_pos[beg:end]:
-                    if len(pos) == 2 and len(pos[0]) == 3 and len(pos[1]) == 3:
-                        s = s + str_xyz_int(pos[0][0], pos[0][1], pos[0][2]).strip("() ") + " "
-                        s = s + str_xyz_int(pos[1][0], pos[1][1], pos[1][2]).strip("() ") + "|"
-                    else:
-                        s = s + str_xyz_int(pos[0], pos[1], pos[2]).strip("() ") + "|"
-                bytes_unzipped = s.encode('utf-8')
-                bytes_zipped = zlib.compress(bytes_unzipped)
-                b64.append(base64.standard_b64encode(bytes_zipped).decode('utf-8') + " ")
-                len_transmit = len("set_node_list " + b64[batch] + item)
-                max_per_batch = max(len_transmit, max_per_batch)
-                logger.debug("set_node_list: Batch {} of {} from {} to {} len {}".format(batch, batches, beg, end, len_transmit))
-        str_error = ''
-        str_item = ''
-        count = 0
-        for batch in range(batches):
-            ret = self.send_cmd("set_node_list " + b64[batch] + item)
-            try:
-                list_ret = ret.split(' ', maxsplit=1)
-                count += int(list_ret[1])
-                if len(list_ret) > 1 and list_ret[0] not in str_item:
-                    str_item += list_ret[0] + " "
-            except AttributeError:
-                # list_ret is None so can't be split
-                pass
-            except ValueError:
-                str_error += " [" + ret + "]"
-        return str_item + str(count) + str_error
+        ret = self.send_cmd("set_nodes " + str_xyz_int(x1, y1, z1) + str_xyz_int(x2, y2, z2) + item)
+        pos1 = nodebuilder.int_tuple(x1, y1, z1)
+        pos2 = nodebuilder.int_tuple(x2, y2, z2)
+        self._written(pos1, pos2, item, ret, payload.node_count([(pos1, pos2)]))
+        return ret
+
+    def negotiate_node_list_version(self):
+        """Ask the irc_builder mod which set_node_list payload versions it supports and use the most compact one
+
+        Older mods don't have the irc_builder_version command so fall back to version 1
+        """
+        reply = self.send_cmd("irc_builder_version")
+        if reply and "set_node_list2" in reply.split():
+            self.node_list_version = payload.NODE_LIST_VERSION_2
+        else:
+            self.node_list_version = payload.NODE_LIST_VERSION_1
+        logger.debug(f"negotiate_node_list_version: Using version {self.node_list_version} after reply {reply}")
+        return self.node_list_version
+
+    def set_node_list(self, list_pos, item, window=None):
+        """Set all blocks at a list of position tuples to the same item ([(x1, y1, z1), (x2, y2, z2), ...], item)
+
+        window: maximum number of set_node_list batches sent before waiting for a reply. Defaults to self.pipeline_window
+        """
+        if self.node_list_version is None:
+            self.negotiate_node_list_version()
+        batch_stats = []
+        with self.metrics.stage("encode"):
+            commands = payload.node_list_commands(list_pos, item, version=self.node_list_version, batch_stats=batch_stats)
+        return self.send_node_list_commands(commands, list_pos, item, batch_stats, window)
+
+    def send_node_list_commands(self, commands, list_pos, item, batch_stats=(), window=None):
+        """Send set_node_list commands already encoded from list_pos by payload.node_list_commands, eg in another process
+
+        batch_stats: (entries, raw bytes, compressed bytes) of each command as returned by payload.node_list_commands
+        returns the same result as set_node_list
+        """
+        replies = self.send_node_list_batches(commands, list_pos, item, batch_stats, window)
+        return payload.set_node_list_result(replies, item)
+
+    def send_node_list_batches(self, commands, list_pos, item, batch_stats=(), window=None):
+        """As send_node_list_commands but returns the list of replies, one per command, or None for those timed out
+
+        list_pos: positions encoded in commands, to update the cache. Pass () if commands are only some of the batches
+                  encoded from list_pos, as the cache is then left unchanged
+        """
+        journal = self.journal
+        if journal is not None:
+            # replies recorded when batches were acknowledged before, eg on a connection since lost
+            replies = [journal.reply(command) for command in commands]
+            unsent = [batch for batch, reply in enumerate(replies) if reply is None]
+        else:
+            replies = [None] * len(commands)
+            unsent = range(len(commands))
+        for batch in unsent:
+            if batch < len(batch_stats):
+                self.metrics.batch(item, *batch_stats[batch])
+        with self.metrics.stage("send"):
+            for batch, reply in zip(unsent, self._send_batches([commands[batch] for batch in unsent], window)):
+                replies[batch] = reply
+        failed = sum(1 for ret in replies if payload.reply_count(ret, item) is None)
+        self.failed_batches += failed
+        if self.cache is not None:
+            # only know which batches succeeded, not which positions, so update cache only if every batch succeeded
+            success = not failed
+            name = cache.item_name(item) if success else None
+            for pos in list_pos:
+                self.cache.written(*payload.cuboid_corners(pos), name)
+        return replies
+
+    def _send_batches(self, commands, window=None):
+        """Send set_node_list commands keeping up to window awaiting replies. Returns list of replies
+
+        Replies are recorded in self.journal if set. Raises ConnectionError if the connection has closed
+        """
+        if window is None:
+            window = self.pipeline_window
+        # each batch in flight keeps the ticket which will receive its reply
+        replies = [None] * len(commands)
+        in_flight = collections.deque()
+
+        def wait_oldest():
+            batch_done, ticket = in_flight.popleft()
+            replies[batch_done] = self.wait_for_reply(ticket)
+            if self.journal is not None:
+                self.journal.record(commands[batch_done], replies[batch_done])
+
+        for batch, command in enumerate(commands):
+            if len(in_flight) >= window:
+                # window full so wait for oldest batch to be acknowledged before sending another
+                wait_oldest()
+            if not self.connected:
+                raise ConnectionError(f"Connection to {self.ircserver} closed after {batch} of {len(commands)} batches")
+            in_flight.append((batch, self.send_cmd(command, wait=False)))
+        while in_flight:
+            wait_oldest()
+        return replies
 
     def set_sign(self, x, y, z, direction, text, sign_node="default:sign_wall_wood", **kwargs):
         """Set a sign at a location with text and facing direction
@@ -338,7 +497,98 @@ class MinetestConnection:
         return self.send_cmd("add_book_to_chest " + str_xyz_int(x, y, z) + json.dumps(book).replace("\r", "").replace("\n", "\\n"))
 
     def get_ground_level(self, x, z):
-        return int(self.send_cmd("get_ground_level " + str(math.floor(x+0.5)) + " " + str(math.floor(z+0.5))))
+        xi, zi = nodebuilder.int_tuple(x, z)
+        if self.cache is not None:
+            level = self.cache.get_ground_level(xi, zi)
+            if level is not None:
+                return level
+        level = int(self.send_cmd("get_ground_level " + str(xi) + " " + str(zi)))
+        if self.cache is not None:
+            self.cache.put_ground_level(xi, zi, level)
+        return level
+
+    def send_cmd_chunked(self, msg, timeout=5.0):
+        """Send a command whose reply is split into chunks and return the reassembled decompressed text
+
+        The first chunk is the reply to msg. Remaining chunks are all requested with get_chunk before waiting for replies
+        returns None if msg was not answered with a chunk, eg because the irc_builder mod is older than 0.0.10
+        """
+        with self.chunk_lock:
+            chunk = payload.parse_chunk(self.send_cmd(msg, timeout=timeout))
+            if chunk is None:
+                return None
+            chunk_id, _, total, data = chunk
+            chunks = [data]
+            tickets = [self.send_cmd(f"get_chunk {chunk_id} {n}", wait=False) for n in range(2, total + 1)]
+            for n, ticket in enumerate(tickets, 2):
+                chunk = payload.parse_chunk(self.wait_for_reply(ticket, timeout))
+                if chunk is None or chunk[:2] != (chunk_id, n):
+                    logger.warning(f"send_cmd_chunked: Missing chunk {n} of {total} for {msg[:40]}")
+                    return None
+                chunks.append(chunk[3])
+        return payload.decode_chunks(chunks)
+
+    def get_heightmap(self, x1, z1, x2, z2, as_array=False):
+        """Ground levels of every column in rectangle x1, z1 to x2, z2 read with a few get_ground_levels commands
+
+        returns dict {(x, z): level}, or if as_array a numpy array of levels indexed [x - min x, z - min z]
+        Falls back to one get_ground_level command per column if the irc_builder mod doesn't have get_ground_levels
+        """
+        x1, z1, x2, z2 = nodebuilder.int_tuple(x1, z1, x2, z2)
+        xmin, xmax = min(x1, x2), max(x1, x2)
+        zmin, zmax = min(z1, z2), max(z1, z2)
+        levels = {}
+        for xa in range(xmin, xmax + 1, HEIGHTMAP_TILE):
+            for za in range(zmin, zmax + 1, HEIGHTMAP_TILE):
+                xb = min(xa + HEIGHTMAP_TILE - 1, xmax)
+                zb = min(za + HEIGHTMAP_TILE - 1, zmax)
+                text = self.send_cmd_chunked(f"get_ground_levels {xa} {za} {xb} {zb}")
+                if text is None:
+                    logger.warning("get_heightmap: get_ground_levels failed so reading one column at a time")
+                    tile = {(x, z): self.get_ground_level(x, z) for x in range(xa, xb + 1) for z in range(za, zb + 1)}
+                else:
+                    tile = payload.decode_ground_levels(text, xa, za, xb, zb)
+                    if self.cache is not None:
+                        for (x, z), level in tile.items():
+                            self.cache.put_ground_level(x, z, level)
+                levels.update(tile)
+        if as_array:
+            if nodebuilder.np is None:
+                raise ImportError("get_heightmap(as_array=True) requires numpy. Install it with 'pip install numpy'")
+            heights = nodebuilder.np.empty((xmax - xmin + 1, zmax - zmin + 1), dtype=nodebuilder.np.int32)
+            for (x, z), level in levels.items():
+                heights[x - xmin, z - zmin] = level
+            return heights
+        return levels
+
+    def get_region(self, x1, y1, z1, x2, y2, z2):
+        """Node names of every position in cuboid read with a few get_nodes_compressed commands
+
+        returns node dict {(x, y, z): name} in the same form as building so it can be compared or sent back
+        Falls back to one get_node command per position if the irc_builder mod doesn't have get_nodes_compressed
+        """
+        pos1 = nodebuilder.int_tuple(x1, y1, z1)
+        pos2 = nodebuilder.int_tuple(x2, y2, z2)
+        lo = [min(a, b) for a, b in zip(pos1, pos2)]
+        hi = [max(a, b) for a, b in zip(pos1, pos2)]
+        nodes = {}
+        for xa in range(lo[0], hi[0] + 1, REGION_TILE):
+            for ya in range(lo[1], hi[1] + 1, REGION_TILE):
+                for za in range(lo[2], hi[2] + 1, REGION_TILE):
+                    tile_lo = (xa, ya, za)
+                    tile_hi = tuple(min(a + REGION_TILE - 1, h) for a, h in zip(tile_lo, hi))
+                    text = self.send_cmd_chunked("get_nodes_compressed " + str_xyz(*tile_lo) + str_xyz(*tile_hi))
+                    if text is None:
+                        logger.warning("get_region: get_nodes_compressed failed so reading one node at a time")
+                        tile = {pos: self.get_node(*pos) for pos in itertools.product(
+                            *(range(a, b + 1) for a, b in zip(tile_lo, tile_hi)))}
+                    else:
+                        tile = payload.decode_nodes_compressed(text, tile_lo, tile_hi)
+                        if self.cache is not None:
+                            for pos, name in tile.items():
+                                self.cache.put_node(pos, name)
+                    nodes.update(tile)
+        return nodes
 
     def get_connected_players(self):
         return self.send_cmd("get_connected_players").split(" ")
@@ -414,25 +664,57 @@ class MinetestConnection:
         x, y, z: coordinates to be added to nodes. They are converted to integers so that each node has unique set of coordinates
         x, y, z can also be supplied as iterables eg range or list or tuple or generator
         """
-        for xi in nodebuilder.make_iter(x):
-            for yi in nodebuilder.make_iter(y):
-                for zi in nodebuilder.make_iter(z):
-                    del self.building[nodebuilder.int_tuple(xi, yi, zi)]
+        for pos in itertools.product(nodebuilder.int_values(x), nodebuilder.int_values(y), nodebuilder.int_values(z)):
+            del self.building[pos]
 
-    def send_building(self, end_list=()):
+    def send_building(self, end_list=(), strategy="fast", incremental=False, workers=None):
         """sends building dict, which has been created from multiple calls to build(), to minetest
 
-        end_list: order of items to send last. eg ("air", "default:torch")"""
-        nodebuilder.send_node_dict(self, self.building, end_list)
-        self.building = {}
+        end_list: order of items to send last. eg ("air", "default:torch")
+        strategy: cuboid merging strategy "fast" or "fewest"
+        incremental: if True keep building dict and only send nodes changed since the last incremental send.
+                     Nodes removed since then are sent as air. If any batch fails the changes are all sent again next time
+        workers: merge and encode in a pool of this many processes while sending, as ircbuilder.parallel.send_node_dict.
+                 None merges and encodes everything in this process"""
+        if incremental:
+            if self.sent_snapshot is None:
+                self.sent_snapshot = nodebuilder.NodeSnapshot()
+            with self.metrics.stage("diff"):
+                delta = self.sent_snapshot.diff(self.building)
+            failed = self.failed_batches
+            self._send_node_dict(delta, end_list, strategy, workers)
+            failed = self.failed_batches - failed
+            if failed:
+                # don't know which nodes failed so keep the old snapshot and send the whole delta again next time
+                logger.warning(f"send_building: {failed} batches failed so they will be sent again by the next send")
+            else:
+                self.sent_snapshot.update(self.building)
+        else:
+            self._send_node_dict(self.building, end_list, strategy, workers)
+            self.building = {}
+
+    def _send_node_dict(self, node_dict, end_list, strategy, workers):
+        if workers is None:
+            nodebuilder.send_node_dict(self, node_dict, end_list, strategy)
+        else:
+            parallel.send_node_dict(self, node_dict, end_list, strategy, workers=workers)
+
+    def metrics_summary(self):
+        """Dict of metrics recorded so far together with totals from the sender and reply dispatcher"""
+        summary = self.metrics.summary()
+        summary['sender'] = self.sender.stats()
+        summary['late_replies'] = self.dispatcher.late_replies
+        summary['lost_replies'] = self.dispatcher.lost_replies
+        summary['outstanding_replies'] = self.dispatcher.outstanding()
+        return summary
 
     @staticmethod
-    def create(ircserver, mtuser, mtuserpass, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697):
+    def create(ircserver, mtuser, mtuserpass, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697, flood_control=None):
         if not pybotnick:
             pybotnick = "py" + mtuser
             if len(pybotnick) > NICK_MAX_LEN:
                 pybotnick = pybotnick[0:NICK_MAX_LEN]
-        new_mc = MinetestConnection(ircserver, mtbotnick, pybotnick, port)
+        new_mc = MinetestConnection(ircserver, mtbotnick, pybotnick, port, flood_control)
         # mc.send_string("USER " + pybotnick + " " + pybotnick + " " + pybotnick + " " + pybotnick) # user authentication
         new_mc.send_string("CAP END")
         new_mc.send_string("USER " + pybotnick + " 0 * :" + pybotnick)  # user authentication  first pybotnick is username, second pybotnick is real name
@@ -449,9 +731,9 @@ class MinetestConnection:
 
 
 @contextmanager
-def open_irc(ircserver, mtuser, mtuserpass, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697):
+def open_irc(ircserver, mtuser, mtuserpass, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697, flood_control=None):
     """open_irc ensures channel is always parted """
-    new_mc = MinetestConnection.create(ircserver, mtuser, mtuserpass, mtbotnick, channel, pybotnick, port)
+    new_mc = MinetestConnection.create(ircserver, mtuser, mtuserpass, mtbotnick, channel, pybotnick, port, flood_control)
     # @contextmanager requires a yield. Everything before yield is __enter__(). Everything after is __exit__()
     yield new_mc
     new_mc.part_channel()
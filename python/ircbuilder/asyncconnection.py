@@ -0,0 +1,337 @@
+import asyncio
+import collections
+import itertools
+import logging
+import math
+import random
+import ssl
+import string
+
+from contextlib import asynccontextmanager
+
+from ircbuilder import CHAR_SET, NICK_MAX_LEN, RECV_SIZE, str_xyz_int
+from ircbuilder import dispatch
+from ircbuilder import floodcontrol
+from ircbuilder import ircparser
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+from ircbuilder.version import VERSION
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncMinetestConnection:
+    """asyncio connection to IRC Server sending commands to Minetest
+
+    Equivalent to MinetestConnection but every command is a coroutine, so one event loop can drive many connections
+    and many concurrent commands without a thread per connection. Use open_irc_async() or AsyncMinetestConnection.create()
+
+    Example:
+
+    async def main():
+        async with open_irc_async('irc.triptera.com.au', 'mtuser', 'mtuserpass', channel='#pythonator') as mc:
+            mc.build(range(100, 110), 14, 20, 'wool:green')
+            await mc.send_building()
+    asyncio.run(main())
+
+    """
+    def __init__(self, reader, writer, mtbotnick, pybotnick, flood_control=None):
+        self.reader = reader
+        self.writer = writer
+        self.mtbotnick = mtbotnick
+        self.pybotnick = pybotnick
+        self.channel = "##" + "".join(random.choice(string.ascii_letters) for _ in range(6))
+        self.ircserver_name = None
+        # building is a node dict which stores results of build commands before sending to minetest in a batch
+        self.building = {}
+        # maximum number of set_node_list commands awaiting replies
+        self.pipeline_window = 1
+        # set_node_list payload version. None until negotiated with the irc_builder mod on first set_node_list
+        self.node_list_version = None
+        self.flood_control = flood_control if flood_control else floodcontrol.FloodControl()
+        self.dispatcher = dispatch.ReplyDispatcher()
+        self.q_msg = asyncio.Queue()
+        self.q_num = asyncio.Queue()
+        self.q_send = asyncio.PriorityQueue()
+        self._seq = itertools.count()
+        self.receive_task = asyncio.ensure_future(self.receive_irc())
+        self.send_task = asyncio.ensure_future(self.write_lines())
+
+    @classmethod
+    async def connect(cls, ircserver, mtbotnick, pybotnick, port=6697, flood_control=None):
+        """Open TLS connection to ircserver, falling back the same way as MinetestConnection"""
+        try:
+            reader, writer = await asyncio.open_connection(ircserver, port, ssl=ssl.create_default_context())
+        except ssl.SSLCertVerificationError as scve:
+            logger.warning(f"Certificate verification failed so retrying without verification. This will be disallowed in future. {scve}")
+            context = ssl.SSLContext(protocol=ssl.PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            reader, writer = await asyncio.open_connection(ircserver, port, ssl=context)
+        except (ssl.SSLError, ConnectionResetError) as se:
+            # plain text servers usually close the connection on receiving a TLS handshake
+            logger.warning(f"You have initiated a connection without using SSL. Data packets not encrypted, Recommend using port 6697 instead of {port}. {se}")
+            reader, writer = await asyncio.open_connection(ircserver, port)
+        return cls(reader, writer, mtbotnick, pybotnick, flood_control)
+
+    async def join_channel(self, channel=None):
+        if channel:
+            # if channel not set, use randomly generated channel
+            self.channel = channel
+        else:
+            logger.debug("join_channel: Joining IRC channel " + self.channel)
+        self.send_string("JOIN " + self.channel)
+
+    async def part_channel(self):
+        self.send_string("PART " + self.channel)
+        await self.q_send.join()
+        self.send_task.cancel()
+        self.receive_task.cancel()
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except (OSError, ssl.SSLError) as e:
+            logger.debug(f"part_channel: Error while closing {e=}")
+
+    async def close(self):
+        await self.part_channel()
+
+    def send_string(self, s, priority=False):
+        """Queue s to be sent to IRC server subject to flood control. Returns immediately"""
+        self.q_send.put_nowait((0 if priority else 1, next(self._seq), s.strip("\r\n")))
+        if s.startswith('PRIVMSG') and ': login' in s:
+            idx_pass = s.rfind(' ')
+            s = s[:idx_pass] + ' <PASSWORD REMOVED FROM LOG>'
+        logger.info("SEND: " + s)
+
+    async def write_lines(self):
+        """Task writing queued lines to the server subject to flood control"""
+        while True:
+            item = await self.q_send.get()
+            line = item[2]
+            nbytes = len(line.encode(CHAR_SET))
+            delay = self.flood_control.delay(nbytes)
+            if delay > 0:
+                # put line back so any priority line queued while waiting is sent first
+                self.q_send.put_nowait(item)
+                self.q_send.task_done()
+                await asyncio.sleep(delay)
+                continue
+            self.flood_control.consume(nbytes)
+            try:
+                self.writer.write((line + "\n").encode(CHAR_SET))
+                await self.writer.drain()
+            except OSError as ose:
+                logger.warning(f"write_lines: Failed to send line {ose=}")
+            finally:
+                self.q_send.task_done()
+
+    async def receive_irc(self):
+        """Task reading lines from the server and dispatching replies"""
+        parser = ircparser.IrcLineParser(CHAR_SET)
+        try:
+            while True:
+                try:
+                    data = await self.reader.read(RECV_SIZE)
+                except (OSError, ssl.SSLError) as e:
+                    logger.debug(f"Socket closed so stopping receive task {e=}")
+                    break
+                if not data:
+                    logger.debug("Connection closed by server so stopping receive task")
+                    break
+                for message in parser.feed(data):
+                    self.handle_message(message)
+        finally:
+            # no more replies can arrive so don't keep commands waiting for their timeouts
+            self.dispatcher.close()
+
+    def handle_line(self, line):
+        """Act on one line received from the server, without CR LF"""
+        message = ircparser.parse_line(line)
+        if message is not None:
+            self.handle_message(message)
+
+    def handle_message(self, message):
+        """Act on one ircparser.IrcMessage received from the server"""
+        logger.info(f"RECV: {message.line}")
+        if message.prefix is None:
+            if message.command == "PING":
+                self.send_string(" ".join(["PONG"] + message.params), priority=True)
+            elif message.command == "VERSION":
+                self.send_string("VERSION python ircbuilder " + VERSION, priority=True)
+            return
+        sender_name = message.nick
+        if not self.ircserver_name:
+            self.ircserver_name = sender_name
+        if not message.params or message.params[0] != self.pybotnick:
+            return
+        if message.command == "PRIVMSG" and message.trailing == "\x01VERSION\x01":
+            self.send_string("VERSION python ircbuilder " + VERSION, priority=True)
+        if sender_name == self.ircserver_name:
+            if message.command.isdigit():
+                self.q_num.put_nowait(int(message.command))
+        elif sender_name == self.mtbotnick and message.command == "PRIVMSG" and len(message.params) > 1:
+            reply = message.trailing
+            if not self.dispatcher.deliver(reply):
+                self.q_msg.put_nowait(reply)
+
+    def send_msg(self, msg):
+        self.send_privmsg(self.channel + " :" + msg)
+
+    def send_privmsg(self, msg):
+        self.send_string("PRIVMSG " + msg)
+
+    async def wait_for_privmsg(self, timeout=5.0):
+        """Wait for a message from mtbotnick which is not a reply to a command"""
+        try:
+            return await asyncio.wait_for(self.q_msg.get(), timeout)
+        except asyncio.TimeoutError:
+            logger.info(f"Timeout waiting for privmsg {timeout}")
+            return
+
+    async def wait_for_message_num(self, message_num, timeout=15.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while loop.time() < deadline:
+            try:
+                num = await asyncio.wait_for(self.q_num.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if message_num == num or num >= 400:
+                return num
+        logger.warning(f"Timeout waiting for {message_num}")
+        return None
+
+    async def wait_for_reply(self, ticket, timeout=5.0):
+        return await self.dispatcher.wait_async(ticket, timeout)
+
+    async def send_irccmd(self, msg, wait=True, timeout=5.0):
+        """Send msg to mtbotnick and return its reply, or None if no reply within timeout seconds
+
+        If wait is False return a ticket immediately. Pass the ticket to wait_for_reply to get the reply
+        """
+        future = asyncio.get_running_loop().create_future()
+        ticket = self.dispatcher.expect(' '.join(msg.split(' ', 2)[:2]), future)
+        self.send_privmsg(self.mtbotnick + ' : ' + msg)
+        if wait:
+            return await self.wait_for_reply(ticket, timeout)
+        return ticket
+
+    async def send_cmd(self, msg, wait=True, timeout=5.0):
+        return await self.send_irccmd("cmd " + msg, wait, timeout)
+
+    async def get_node(self, x, y, z):
+        """Get block (x,y,z) => item:string"""
+        return await self.send_cmd("get_node " + str_xyz_int(x, y, z))
+
+    async def compare_nodes(self, x1, y1, z1, x2, y2, z2, item):
+        """Compare a cuboid of blocks (x1, y1, z1, x2, y2, z2) with an item => count of differences"""
+        return await self.send_cmd("compare_nodes " + str_xyz_int(x1, y1, z1) + str_xyz_int(x2, y2, z2) + " " + item)
+
+    async def set_node(self, x, y, z, item):
+        """Set block (x, y, z, item)"""
+        return await self.send_cmd("set_node " + str_xyz_int(x, y, z) + item)
+
+    async def set_nodes(self, x1, y1, z1, x2, y2, z2, item):
+        """Set a cuboid of blocks (x1, y1, z1, x2, y2, z2, item)"""
+        return await self.send_cmd("set_nodes " + str_xyz_int(x1, y1, z1) + str_xyz_int(x2, y2, z2) + item)
+
+    async def negotiate_node_list_version(self):
+        """Ask the irc_builder mod which set_node_list payload versions it supports and use the most compact one
+
+        Older mods don't have the irc_builder_version command so fall back to version 1
+        """
+        reply = await self.send_cmd("irc_builder_version")
+        if reply and "set_node_list2" in reply.split():
+            self.node_list_version = payload.NODE_LIST_VERSION_2
+        else:
+            self.node_list_version = payload.NODE_LIST_VERSION_1
+        logger.debug(f"negotiate_node_list_version: Using version {self.node_list_version} after reply {reply}")
+        return self.node_list_version
+
+    async def set_node_list(self, list_pos, item, window=None):
+        """Set all blocks at a list of position tuples to the same item ([(x1, y1, z1), (x2, y2, z2), ...], item)
+
+        window: maximum number of set_node_list batches sent before waiting for a reply. Defaults to self.pipeline_window
+        """
+        if self.node_list_version is None:
+            await self.negotiate_node_list_version()
+        commands = payload.node_list_commands(list_pos, item, version=self.node_list_version)
+        if window is None:
+            window = self.pipeline_window
+        replies = [None] * len(commands)
+        in_flight = collections.deque()
+        for batch, command in enumerate(commands):
+            if len(in_flight) >= window:
+                batch_done, ticket = in_flight.popleft()
+                replies[batch_done] = await self.wait_for_reply(ticket)
+            in_flight.append((batch, await self.send_cmd(command, wait=False)))
+        while in_flight:
+            batch_done, ticket = in_flight.popleft()
+            replies[batch_done] = await self.wait_for_reply(ticket)
+        return payload.set_node_list_result(replies, item)
+
+    async def get_ground_level(self, x, z):
+        return int(await self.send_cmd("get_ground_level " + str(math.floor(x+0.5)) + " " + str(math.floor(z+0.5))))
+
+    async def get_connected_players(self):
+        return (await self.send_cmd("get_connected_players")).split(" ")
+
+    def build(self, x, y, z, item):
+        """similar to set_node but stores nodes in building dict rather than sending to minetest
+
+        x, y, z: coordinates to be added to nodes. They are converted to integers so that each node has unique set of coordinates
+        item: minetest item name as a string "default:glass", or json string '{"name":"default:torch", "param2":"1"}'
+        x, y, z can also be supplied as iterables eg range or list or tuple or generator
+        """
+        self.building.update(nodebuilder.build(x, y, z, item))
+
+    def build_undo(self, x, y, z):
+        """removes any nodes already built from building dict prior to sending to minetest"""
+        for pos in itertools.product(nodebuilder.int_values(x), nodebuilder.int_values(y), nodebuilder.int_values(z)):
+            del self.building[pos]
+
+    async def send_node_lists(self, node_lists, end_list=(), region_size=nodebuilder.MAPBLOCK_SIZE):
+        """Send node_lists to minetest in the same order as nodebuilder.send_node_lists"""
+        for item, list_pos in nodebuilder.schedule_node_lists(node_lists, end_list, region_size):
+            await self.set_node_list(list_pos, item)
+
+    async def send_node_dict(self, node_dict, end_list=(), strategy="fast"):
+        """Merge node_dict into cuboids in a worker thread, so the event loop stays responsive, then send it"""
+        node_lists = await asyncio.get_running_loop().run_in_executor(None, nodebuilder.node_lists_from_node_dict, node_dict, strategy)
+        await self.send_node_lists(node_lists, end_list)
+
+    async def send_building(self, end_list=(), strategy="fast"):
+        """sends building dict, which has been created from multiple calls to build(), to minetest
+
+        end_list: order of items to send last. eg ("air", "default:torch")
+        strategy: cuboid merging strategy "fast" or "fewest" """
+        building = self.building
+        self.building = {}
+        await self.send_node_dict(building, end_list, strategy)
+
+    @classmethod
+    async def create(cls, ircserver, mtuser, mtuserpass, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697, flood_control=None):
+        if not pybotnick:
+            pybotnick = "py" + mtuser
+            if len(pybotnick) > NICK_MAX_LEN:
+                pybotnick = pybotnick[0:NICK_MAX_LEN]
+        new_mc = await cls.connect(ircserver, mtbotnick, pybotnick, port, flood_control)
+        new_mc.send_string("CAP END")
+        new_mc.send_string("USER " + pybotnick + " 0 * :" + pybotnick)
+        new_mc.send_string("NICK " + pybotnick)
+        await new_mc.wait_for_message_num(376)  # End of MOTD
+        await new_mc.join_channel(channel)
+        await new_mc.wait_for_message_num(366)  # End of NAMES list
+        await new_mc.send_irccmd("login " + mtuser + " " + mtuserpass)
+        return new_mc
+
+
+@asynccontextmanager
+async def open_irc_async(ircserver, mtuser, mtuserpass, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697, flood_control=None):
+    """open_irc_async ensures channel is always parted """
+    new_mc = await AsyncMinetestConnection.create(ircserver, mtuser, mtuserpass, mtbotnick, channel, pybotnick, port, flood_control)
+    try:
+        yield new_mc
+    finally:
+        await new_mc.part_channel()
@@ -1,4 +1,60 @@
+import array
+import collections.abc
+import itertools
+import logging
+import tempfile
+
+from ircbuilder import metrics
 from ircbuilder import nodebuilder
+from ircbuilder import parallel
+from ircbuilder import payload
+from ircbuilder import storage
+from ircbuilder import transform
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional and only required by VoxelBuilding
+    np = None
+
+logger = logging.getLogger(__name__)
+
+MAPBLOCK_SIZE = nodebuilder.MAPBLOCK_SIZE
+
+
+class NodeDictView(collections.abc.MutableMapping):
+    """Node dict {(x, y, z): item} of a Building, decoding ids of its nodes as they are read
+
+    It reflects later changes to the building, and changes made through it change the building. Items assigned are
+    interned in the building's palette, as build() does.
+    """
+    __slots__ = ('_building',)
+
+    def __init__(self, building):
+        self._building = building
+
+    def __getitem__(self, pos):
+        return self._building.palette[self._building.nodes[pos]]
+
+    def __setitem__(self, pos, item):
+        self._building.nodes[pos] = self._building.palette.id(item)
+        self._building.cuboids = None
+
+    def __delitem__(self, pos):
+        del self._building.nodes[pos]
+        self._building.cuboids = None
+
+    def __iter__(self):
+        return iter(self._building.nodes)
+
+    def __len__(self):
+        return len(self._building.nodes)
+
+    def __contains__(self, pos):
+        return pos in self._building.nodes
+
+    def __repr__(self):
+        return f"NodeDictView({self._building.palette.decode(self._building.nodes)!r})"
 
 
 class Building:
@@ -13,8 +69,30 @@ class Building:
         b.send(mc)
 
     """
-    def __init__(self):
-        self.building = {}
+    def __init__(self, incremental=False, palette=None):
+        """incremental: if True send() keeps the building and later sends only nodes changed since the last send
+        palette: nodebuilder.ItemPalette numbering the items of nodes. Defaults to a new palette for this building
+        """
+        # items are interned once in palette and nodes {(x, y, z): id} store only their id
+        self.palette = nodebuilder.ItemPalette() if palette is None else palette
+        self.nodes = {}
+        self.incremental = incremental
+        self.snapshot = nodebuilder.NodeSnapshot(self.palette) if incremental else None
+        # node_lists already merged from building, eg loaded from a file. Discarded when building is changed
+        self.cuboids = None
+
+    @property
+    def building(self):
+        """NodeDictView {(x, y, z): item} of all nodes which changes them like a dict. Assign a node dict to replace all"""
+        return NodeDictView(self)
+
+    @building.setter
+    def building(self, node_dict):
+        self.nodes = self.palette.encode(node_dict)
+        self.cuboids = None
+
+    def __len__(self):
+        return len(self.nodes)
 
     def build(self, x, y, z, item):
         """similar to set_node but stores nodes in building dict rather than sending to minetest
@@ -23,7 +101,8 @@ class Building:
         item: minetest item name as a string "default:glass", or json string '{"name":"default:torch", "param2":"1"}'
         x, y, z can also be supplied as iterables eg range or list or tuple or generator
         """
-        self.building.update(nodebuilder.build(x, y, z, item))
+        self.nodes.update(dict.fromkeys(nodebuilder.positions(x, y, z), self.palette.id(item)))
+        self.cuboids = None
 
     def build_undo(self, x, y, z):
         """removes any nodes already built from building dict prior to sending to minetest
@@ -31,15 +110,490 @@ class Building:
         x, y, z: coordinates to be added to nodes. They are converted to integers so that each node has unique set of coordinates
         x, y, z can also be supplied as iterables eg range or list or tuple or generator
         """
-        for xi in nodebuilder.make_iter(x):
-            for yi in nodebuilder.make_iter(y):
-                for zi in nodebuilder.make_iter(z):
-                    del self.building[nodebuilder.int_tuple(xi, yi, zi)]
+        for pos in nodebuilder.positions(x, y, z):
+            del self.nodes[pos]
+        self.cuboids = None
 
-    def send(self, minetest_connection, end_list=()):
+    def send(self, minetest_connection, end_list=(), strategy="fast", workers=None):
         """sends building dict, which has been created from multiple calls to build(), to minetest
 
-        end_list: order of items to send last. eg ("air", "default:torch")"""
-        nodebuilder.send_node_dict(minetest_connection, self.building, end_list)
-        self.building = {}
+        end_list: order of items to send last. eg ("air", "default:torch")
+        strategy: cuboid merging strategy "fast" or "fewest"
+        workers: merge and encode in a pool of this many processes while sending, as ircbuilder.parallel.send_node_dict.
+                 None merges and encodes everything in this process
+        If incremental, only nodes added or changed since last send are sent, and removed nodes are sent as air.
+        If any batch fails the snapshot is left as it was, so the next send() sends all those changes again.
+        Otherwise the whole building is sent and then cleared. Cuboids saved with the building and loaded by load()
+        are sent without merging again unless build() or build_undo() has changed the building since."""
+        if self.incremental:
+            with metrics.timed(getattr(minetest_connection, "metrics", None), "diff"):
+                delta = self.snapshot.diff(self.nodes)
+            failed = getattr(minetest_connection, "failed_batches", 0)
+            self._send_nodes(minetest_connection, delta, end_list, strategy, workers)
+            failed = getattr(minetest_connection, "failed_batches", 0) - failed
+            if failed:
+                # don't know which nodes failed so keep the old snapshot and send the whole delta again next time
+                logger.warning(f"send: {failed} batches failed so they will be sent again by the next send")
+            else:
+                self.snapshot.update(self.nodes)
+        elif self.cuboids is not None:
+            nodebuilder.send_node_lists(minetest_connection, self.cuboids, end_list)
+            self.nodes = {}
+            self.cuboids = None
+        else:
+            self._send_nodes(minetest_connection, self.nodes, end_list, strategy, workers)
+            self.nodes = {}
+
+    def _send_nodes(self, minetest_connection, nodes, end_list, strategy, workers):
+        if workers is None:
+            nodebuilder.send_node_dict(minetest_connection, nodes, end_list, strategy, self.palette)
+        else:
+            parallel.send_node_dict(minetest_connection, nodes, end_list, strategy, self.palette, workers)
+
+    def plan(self, end_list=(), strategy="fast", version=payload.NODE_LIST_VERSION_2, mtbotnick="mtserver"):
+        """nodebuilder.SendPlan of what send() would send now, made without a connection
+
+        The building is not cleared and an incremental snapshot is not updated, so send the plan with
+        nodebuilder.send_plan then call send() only if the building should be cleared or its snapshot updated.
+        Other arguments are as for nodebuilder.plan_node_dict
+        """
+        if self.incremental:
+            delta = self.snapshot.diff(self.nodes)
+            return nodebuilder.plan_node_dict(delta, end_list, strategy, self.palette, version=version,
+                                              mtbotnick=mtbotnick)
+        if self.cuboids is not None:
+            return nodebuilder.plan_node_lists(self.cuboids, end_list, version=version, mtbotnick=mtbotnick)
+        return nodebuilder.plan_node_dict(self.nodes, end_list, strategy, self.palette, version=version,
+                                          mtbotnick=mtbotnick)
+
+    def save(self, path, strategy=None):
+        """Save building to a compact binary file which loads much faster than rebuilding
+
+        strategy: also save nodes merged into cuboids with strategy "fast" or "fewest" so that a loaded building
+                  can be sent without merging again. None saves only the nodes, or cuboids already loaded
+        """
+        if strategy:
+            node_lists = nodebuilder.node_lists_from_node_dict(self.nodes, strategy, self.palette)
+        else:
+            node_lists = self.cuboids
+        storage.save_building(path, self.nodes, node_lists, self.palette)
+
+    @classmethod
+    def load(cls, path, incremental=False):
+        """Return a Building loaded from a file written by save(), including any saved cuboids"""
+        items, nodes = storage.load_nodes(path)
+        b = cls(incremental, nodebuilder.ItemPalette(items))
+        b.nodes = nodes
+        b.cuboids = storage.load_node_lists(path)
+        return b
+
+    @classmethod
+    def from_mts(cls, path, origin=(0, 0, 0), include_air=True, incremental=False):
+        """Return a Building of a minetest .mts schematic with its minimum corner at origin"""
+        b = cls(incremental)
+        b.building = storage.read_mts(path, origin, include_air)
+        return b
+
+    def bounds(self):
+        """(min corner, max corner) of all nodes in building, or None if building is empty"""
+        return transform.bounds(self.nodes)
+
+    def _derived(self):
+        """Empty building with the same settings and a copy of the palette, so node ids can be copied from this one"""
+        return Building(self.incremental, self.palette.copy())
+
+    def _transformed(self, matrix, offset):
+        b = self._derived()
+        b.nodes = transform.transform_node_dict(self.nodes, matrix, offset)
+        if self.cuboids is not None:
+            b.cuboids = transform.transform_node_lists(self.cuboids, matrix, offset)
+        return b
+
+    def _anchored(self, matrix):
+        """Building transformed by matrix then moved back so its minimum corner is where it was"""
+        box = self.bounds()
+        if box is None:
+            return self._derived()
+        return self._transformed(matrix, transform.anchored_offset(matrix, *box))
+
+    def translated(self, dx, dy, dz):
+        """Return a copy of building moved by dx, dy, dz"""
+        return self._transformed(transform.IDENTITY, nodebuilder.int_tuple(dx, dy, dz))
+
+    def rotated(self, axis, quarter_turns=1):
+        """Return a copy of building rotated quarter_turns * 90 degrees about axis "x", "y" or "z"
+
+        One quarter turn about y takes +z (north) to +x (east). The minimum corner of the bounding box stays put.
+        param2 of json items is not changed
+        """
+        return self._anchored(transform.rotation(axis, quarter_turns))
+
+    def mirrored(self, axis):
+        """Return a copy of building reflected along axis "x", "y" or "z" keeping its minimum corner where it was"""
+        return self._anchored(transform.mirror(axis))
+
+    def tiled(self, nx=1, ny=1, nz=1, spacing=None):
+        """Return a building with nx * ny * nz copies of this building in a grid
+
+        spacing: (sx, sy, sz) distance between copies. Defaults to the size of the bounding box so copies touch
+        Where copies overlap, later copies in x, then y, then z order replace earlier ones
+        """
+        box = self.bounds()
+        if box is None:
+            return self._derived()
+        if spacing is None:
+            spacing = tuple(box[1][axis] - box[0][axis] + 1 for axis in range(3))
+        sx, sy, sz = nodebuilder.int_tuple(*spacing)
+        b = self._derived()
+        if self.cuboids is not None:
+            b.cuboids = {}
+        for k in range(nz):
+            for j in range(ny):
+                for i in range(nx):
+                    tile = self.translated(i * sx, j * sy, k * sz)
+                    b.nodes.update(tile.nodes)
+                    if b.cuboids is not None:
+                        for item, list_pos in tile.cuboids.items():
+                            b.cuboids.setdefault(item, []).extend(list_pos)
+        extent = [box[1][axis] - box[0][axis] for axis in range(3)]
+        if b.cuboids is not None and any(n > 1 and abs(s) <= e for n, s, e in zip((nx, ny, nz), (sx, sy, sz), extent)):
+            # overlapping copies would send cuboids of replaced nodes so merge again instead
+            b.cuboids = None
+        return b
+
+    def forget_sent(self):
+        """Forget what has been sent so the next incremental send() sends the whole building"""
+        if self.snapshot is not None:
+            self.snapshot.clear()
+
+
+class VoxelBuilding:
+    """A Building stored as a dense numpy grid of palette indices rather than a dict of tuples
+
+    Uses 2 bytes per node within the bounding box of the structure so suits large solid builds.
+    The grid grows automatically as nodes are built outside the current bounding box.
+    Requires numpy.
+
+    Example:
+
+    import ircbuilder.building
+    b = ircbuilder.building.VoxelBuilding()
+    b.build(range(100, 300), range(14, 114), range(20, 220), 'default:stone')
+    with ircbuilder.open_irc('irc.triptera.com.au', 'mtuser', 'mtuserpass', 'mtbotnick', '#pythonator') as mc:
+        b.send(mc)
+
+    """
+    # palette index 0 means no node has been built at that position
+    EMPTY = 0
+    MAX_ITEMS = 65535
+
+    def __init__(self):
+        if np is None:
+            raise ImportError("VoxelBuilding requires numpy. Install it with 'pip install numpy'")
+        self.clear()
+
+    def clear(self):
+        """Remove all nodes and items"""
+        self.palette = nodebuilder.ItemPalette((None,), self.MAX_ITEMS + 1)
+        self.origin = None
+        self.grid = None
+
+    def __len__(self):
+        if self.grid is None:
+            return 0
+        return int(np.count_nonzero(self.grid))
+
+    def item_index(self, item):
+        """Return palette index for item, adding it to the palette if required"""
+        return self.palette.id(item)
+
+    @staticmethod
+    def _axis(values):
+        """Round coordinates along one axis exactly as nodebuilder.int_tuple does"""
+        return np.asarray(nodebuilder.int_values(values), dtype=np.int64)
+
+    def _ensure_bounds(self, lo, hi):
+        """Grow grid so that it includes the positions from lo to hi inclusive"""
+        lo = np.asarray(lo, dtype=np.int64)
+        hi = np.asarray(hi, dtype=np.int64)
+        if self.grid is None:
+            self.origin = lo
+            self.grid = np.zeros(hi - lo + 1, dtype=np.uint16)
+            return
+        old_lo = self.origin
+        old_hi = self.origin + self.grid.shape - 1
+        if (lo >= old_lo).all() and (hi <= old_hi).all():
+            return
+        # grow by at least half the current size in each direction that needs growing so repeated builds amortise
+        slack = np.asarray(self.grid.shape, dtype=np.int64) // 2
+        new_lo = np.where(lo < old_lo, np.minimum(lo, old_lo - slack), old_lo)
+        new_hi = np.where(hi > old_hi, np.maximum(hi, old_hi + slack), old_hi)
+        grid = np.zeros(new_hi - new_lo + 1, dtype=np.uint16)
+        offset = old_lo - new_lo
+        grid[offset[0]:offset[0] + self.grid.shape[0],
+             offset[1]:offset[1] + self.grid.shape[1],
+             offset[2]:offset[2] + self.grid.shape[2]] = self.grid
+        self.origin = new_lo
+        self.grid = grid
+
+    def _index(self, xs, ys, zs):
+        return np.ix_(xs - self.origin[0], ys - self.origin[1], zs - self.origin[2])
+
+    def build(self, x, y, z, item):
+        """similar to set_node but stores nodes in grid rather than sending to minetest
+
+        x, y, z: coordinates to be added to nodes. They are converted to integers so that each node has unique set of coordinates
+        item: minetest item name as a string "default:glass", or json string '{"name":"default:torch", "param2":"1"}'
+        x, y, z can also be supplied as iterables eg range or list or tuple or generator
+        """
+        xs, ys, zs = self._axis(x), self._axis(y), self._axis(z)
+        if len(xs) == 0 or len(ys) == 0 or len(zs) == 0:
+            return
+        idx = self.item_index(item)
+        self._ensure_bounds((xs.min(), ys.min(), zs.min()), (xs.max(), ys.max(), zs.max()))
+        self.grid[self._index(xs, ys, zs)] = idx
+
+    def build_undo(self, x, y, z):
+        """removes any nodes already built from grid prior to sending to minetest
+
+        x, y, z: coordinates to be added to nodes. They are converted to integers so that each node has unique set of coordinates
+        x, y, z can also be supplied as iterables eg range or list or tuple or generator
+        Raises KeyError if any of the positions has not been built
+        """
+        xs, ys, zs = self._axis(x), self._axis(y), self._axis(z)
+        if len(xs) == 0 or len(ys) == 0 or len(zs) == 0:
+            return
+        if self.grid is None:
+            raise KeyError((int(xs[0]), int(ys[0]), int(zs[0])))
+        for axis, values in enumerate((xs, ys, zs)):
+            outside = (values < self.origin[axis]) | (values >= self.origin[axis] + self.grid.shape[axis])
+            if outside.any():
+                pos = [int(xs[0]), int(ys[0]), int(zs[0])]
+                pos[axis] = int(values[outside][0])
+                raise KeyError(tuple(pos))
+        index = self._index(xs, ys, zs)
+        missing = np.argwhere(self.grid[index] == self.EMPTY)
+        if len(missing):
+            i, j, k = missing[0]
+            raise KeyError((int(xs[i]), int(ys[j]), int(zs[k])))
+        self.grid[index] = self.EMPTY
+
+    def node_lists_flat(self):
+        """Return {item: [(x, y, z), ...]} for every built node without creating a node dict"""
+        node_lists = {}
+        if self.grid is None:
+            return node_lists
+        for idx in np.unique(self.grid):
+            if idx == self.EMPTY:
+                continue
+            positions = np.argwhere(self.grid == idx) + self.origin
+            node_lists[self.palette[idx]] = list(map(tuple, positions.tolist()))
+        return node_lists
+
+    def node_lists(self, strategy="fast"):
+        """Return node_lists with adjacent nodes merged into cuboids ready for nodebuilder.send_node_lists
+
+        Cuboids are merged from a mask of each item in turn, so no tuple is created per node
+        """
+        node_lists = {}
+        if self.grid is None:
+            return node_lists
+        for idx in np.unique(self.grid):
+            if idx == self.EMPTY:
+                continue
+            node_lists[self.palette[idx]] = nodebuilder.cuboids_from_mask(self.grid == idx, self.origin, strategy)
+        return node_lists
+
+    def send(self, minetest_connection, end_list=(), strategy="fast"):
+        """sends grid, which has been created from multiple calls to build(), to minetest
+
+        end_list: order of items to send last. eg ("air", "default:torch")
+        strategy: cuboid merging strategy "fast" or "fewest" """
+        nodebuilder.send_node_lists(minetest_connection, self.node_lists(strategy), end_list)
+        self.clear()
+
+
+class StreamingBuilding:
+    """A Building for structures too big to hold in memory as a node dict
+
+    Nodes are partitioned into cubic chunks aligned with mapblocks. When more than max_nodes_in_memory nodes are held,
+    all chunks are appended to a temporary spill file. send() then loads, merges and sends one chunk at a time, so
+    memory use is bounded by max_nodes_in_memory plus one chunk however big the build is.
+    Items in end_list are sent last within each chunk, so eg air never opens a chunk to water before its walls exist.
+    Cuboids which cross chunk boundaries are split, so larger chunks give fewer commands but use more memory.
+
+    Example:
+
+    import ircbuilder.building
+    with ircbuilder.building.StreamingBuilding() as b:
+        b.add_nodes((x, height(x, z), z, 'default:dirt') for x in range(-5000, 5000) for z in range(-5000, 5000))
+        with ircbuilder.open_irc('irc.triptera.com.au', 'mtuser', 'mtuserpass', 'mtbotnick', '#pythonator') as mc:
+            b.send(mc, end_list=('air',))
+
+    chunk_size: edge length of chunks in nodes. Multiples of MAPBLOCK_SIZE keep chunks aligned with mapblocks
+    max_nodes_in_memory: nodes held before chunks are spilled to disk
+    directory: where the spill file is created. Defaults to the system temporary directory
+    """
+    # palette index 0 records that a node was removed by build_undo
+    REMOVED = 0
+    MAX_ITEMS = 65535
+
+    def __init__(self, chunk_size=2 * MAPBLOCK_SIZE, max_nodes_in_memory=1000000, directory=None):
+        self.chunk_size = chunk_size
+        self.max_nodes_in_memory = max_nodes_in_memory
+        self.directory = directory
+        # local index within chunk needs 3 * log2(chunk_size) bits
+        self.index_type = 'H' if chunk_size ** 3 <= 1 << 16 else 'L'
+        self.spill_file = None
+        self.clear()
+
+    def clear(self):
+        """Remove all nodes and items and delete the spill file"""
+        self.palette = nodebuilder.ItemPalette((None,), self.MAX_ITEMS + 1)
+        # chunk key (cx, cy, cz) => {local index: palette index}
+        self.chunks = {}
+        self.nodes_in_memory = 0
+        # chunk key => [(file offset, node count), ...] of spilled records in the order they were written
+        self.spill_index = {}
+        self.nodes_spilled = 0
+        if self.spill_file is not None:
+            self.spill_file.close()
+            self.spill_file = None
+
+    def close(self):
+        self.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def item_index(self, item):
+        """Return palette index for item, adding it to the palette if required"""
+        return self.palette.id(item)
+
+    def _put(self, x, y, z, idx):
+        cs = self.chunk_size
+        key = (x // cs, y // cs, z // cs)
+        chunk = self.chunks.get(key)
+        if chunk is None:
+            chunk = self.chunks[key] = {}
+        size = len(chunk)
+        chunk[((x % cs) * cs + y % cs) * cs + z % cs] = idx
+        if len(chunk) > size:
+            self.nodes_in_memory += 1
+            if self.nodes_in_memory > self.max_nodes_in_memory:
+                self.spill()
+
+    def _put_cuboid(self, lo, hi, idx):
+        """Set every node from lo to hi inclusive one chunk at a time"""
+        cs = self.chunk_size
+        for key in itertools.product(*(range(lo[axis] // cs, hi[axis] // cs + 1) for axis in range(3))):
+            # part of cuboid inside this chunk in local coordinates
+            ranges = [range(max(lo[axis], key[axis] * cs) - key[axis] * cs, min(hi[axis], key[axis] * cs + cs - 1) - key[axis] * cs + 1)
+                      for axis in range(3)]
+            chunk = self.chunks.get(key)
+            if chunk is None:
+                chunk = self.chunks[key] = {}
+            size = len(chunk)
+            chunk.update(dict.fromkeys(((lx * cs + ly) * cs + lz for lx, ly, lz in itertools.product(*ranges)), idx))
+            self.nodes_in_memory += len(chunk) - size
+            if self.nodes_in_memory > self.max_nodes_in_memory:
+                self.spill()
+
+    def _build_index(self, x, y, z, idx):
+        xs, ys, zs = nodebuilder.int_values(x), nodebuilder.int_values(y), nodebuilder.int_values(z)
+        if all(isinstance(v, range) and v.step == 1 for v in (xs, ys, zs)):
+            if len(xs) and len(ys) and len(zs):
+                self._put_cuboid((xs.start, ys.start, zs.start), (xs.stop - 1, ys.stop - 1, zs.stop - 1), idx)
+            return
+        for pos in itertools.product(xs, ys, zs):
+            self._put(*pos, idx)
+
+    def build(self, x, y, z, item):
+        """similar to Building.build but partitions nodes into chunks which are spilled to disk when memory is full
+
+        x, y, z: coordinates to be added to nodes. They are converted to integers so that each node has unique set of coordinates
+        item: minetest item name as a string "default:glass", or json string '{"name":"default:torch", "param2":"1"}'
+        x, y, z can also be supplied as iterables eg range or list or tuple or generator
+        """
+        self._build_index(x, y, z, self.item_index(item))
+
+    def build_undo(self, x, y, z):
+        """removes nodes already built, including nodes already spilled to disk, prior to sending to minetest
+
+        Unlike Building.build_undo, positions which have not been built are ignored
+        """
+        self._build_index(x, y, z, self.REMOVED)
+
+    def add_nodes(self, nodes):
+        """Build every (x, y, z, item) from an iterable or generator of nodes"""
+        for x, y, z, item in nodes:
+            self._put(*nodebuilder.int_tuple(x, y, z), self.item_index(item))
+
+    def add_cuboids(self, cuboids):
+        """Build every ((x1, y1, z1), (x2, y2, z2), item) from an iterable or generator of cuboids"""
+        for pos1, pos2, item in cuboids:
+            lo, hi = payload.cuboid_corners((pos1, pos2))
+            self._put_cuboid(lo, hi, self.item_index(item))
+
+    def spill(self):
+        """Append all chunks held in memory to the spill file"""
+        if not self.chunks:
+            return
+        if self.spill_file is None:
+            self.spill_file = tempfile.TemporaryFile(prefix="ircbuilder_", suffix=".spill", dir=self.directory)
+        f = self.spill_file
+        f.seek(0, 2)
+        for key, chunk in self.chunks.items():
+            self.spill_index.setdefault(key, []).append((f.tell(), len(chunk)))
+            f.write(array.array(self.index_type, chunk.keys()).tobytes())
+            f.write(array.array('H', chunk.values()).tobytes())
+            self.nodes_spilled += len(chunk)
+        self.chunks = {}
+        self.nodes_in_memory = 0
+
+    def chunk_keys(self):
+        """Keys of all chunks containing nodes, lowest layer first"""
+        return sorted(set(self.chunks) | set(self.spill_index), key=lambda key: (key[1], key[0], key[2]))
+
+    def chunk_node_dict(self, key):
+        """Node dict of one chunk combining spilled records and nodes in memory, later builds replacing earlier"""
+        local = {}
+        if key in self.spill_index:
+            f = self.spill_file
+            for offset, count in self.spill_index[key]:
+                f.seek(offset)
+                indexes = array.array(self.index_type)
+                indexes.frombytes(f.read(count * indexes.itemsize))
+                items = array.array('H')
+                items.frombytes(f.read(count * items.itemsize))
+                local.update(zip(indexes, items))
+        local.update(self.chunks.get(key, {}))
+        cs = self.chunk_size
+        ox, oy, oz = key[0] * cs, key[1] * cs, key[2] * cs
+        return {(ox + i // (cs * cs), oy + i // cs % cs, oz + i % cs): self.palette[idx]
+                for i, idx in local.items() if idx != self.REMOVED}
+
+    def node_lists(self, strategy="fast"):
+        """Generate (chunk key, node_lists) for each chunk in turn with nodes merged into cuboids"""
+        for key in self.chunk_keys():
+            node_dict = self.chunk_node_dict(key)
+            if node_dict:
+                yield key, nodebuilder.node_lists_from_node_dict(node_dict, strategy)
+
+    def send(self, minetest_connection, end_list=(), strategy="fast"):
+        """sends chunks, which have been created from multiple calls to build(), to minetest one chunk at a time
 
+        end_list: order of items to send last within each chunk. eg ("air", "default:torch")
+        strategy: cuboid merging strategy "fast" or "fewest" """
+        mc_metrics = getattr(minetest_connection, "metrics", None)
+        chunks = self.node_lists(strategy)
+        while True:
+            with metrics.timed(mc_metrics, "merge"):
+                key, node_lists = next(chunks, (None, None))
+            if key is None:
+                break
+            nodebuilder.send_node_lists(minetest_connection, node_lists, end_list)
+        self.clear()
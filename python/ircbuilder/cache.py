@@ -0,0 +1,151 @@
+import collections
+import json
+import time
+
+
+def item_name(itemtext):
+    """Node name that get_node will return after setting itemtext, eg '{"name":"default:torch","param2":1}' => default:torch"""
+    if itemtext.startswith("{"):
+        try:
+            return json.loads(itemtext).get("name")
+        except ValueError:
+            return None
+    return itemtext
+
+
+class ReadCache:
+    """Bounded least recently used cache of node names and ground levels read from minetest
+
+    Writes made through the same MinetestConnection update cached entries. Changes made by other players or mods
+    are only noticed when entries expire after ttl seconds, or after invalidate() is called.
+
+    max_size: maximum number of node names plus ground levels cached
+    ttl: seconds before an entry expires. None means entries never expire
+    """
+    def __init__(self, max_size=65536, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        # (x, y, z) => (name, time cached)
+        self.nodes = collections.OrderedDict()
+        # (x, z) => (ground level, time cached)
+        self.ground = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.nodes) + len(self.ground)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'size': len(self),
+        }
+
+    def _get(self, table, key):
+        entry = table.get(key)
+        if entry is not None and self.ttl is not None and time.monotonic() - entry[1] > self.ttl:
+            del table[key]
+            entry = None
+        if entry is None:
+            return None
+        table.move_to_end(key)
+        return entry[0]
+
+    def _put(self, table, key, value):
+        table[key] = (value, time.monotonic())
+        table.move_to_end(key)
+        while len(self) > self.max_size:
+            # evict least recently used entry of the larger table
+            if len(self.nodes) >= len(self.ground):
+                self.nodes.popitem(last=False)
+            else:
+                self.ground.popitem(last=False)
+
+    def get_node(self, pos):
+        """Return cached node name at integer pos or None, counting hit or miss"""
+        name = self._get(self.nodes, pos)
+        if name is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return name
+
+    def put_node(self, pos, name):
+        if name is not None:
+            self._put(self.nodes, pos, name)
+
+    def get_ground_level(self, x, z):
+        level = self._get(self.ground, (x, z))
+        if level is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return level
+
+    def put_ground_level(self, x, z, level):
+        if level is not None:
+            self._put(self.ground, (x, z), level)
+
+    def compare_nodes(self, pos1, pos2, name):
+        """Count of nodes in cuboid which differ from name, or None if any node in cuboid is not cached"""
+        lo = [min(a, b) for a, b in zip(pos1, pos2)]
+        hi = [max(a, b) for a, b in zip(pos1, pos2)]
+        volume = (hi[0] - lo[0] + 1) * (hi[1] - lo[1] + 1) * (hi[2] - lo[2] + 1)
+        count = 0
+        if volume <= len(self.nodes):
+            for x in range(lo[0], hi[0] + 1):
+                for y in range(lo[1], hi[1] + 1):
+                    for z in range(lo[2], hi[2] + 1):
+                        cached = self._get(self.nodes, (x, y, z))
+                        if cached is None:
+                            self.misses += 1
+                            return None
+                        if cached != name:
+                            count += 1
+            self.hits += 1
+            return count
+        self.misses += 1
+        return None
+
+    def written(self, pos1, pos2, name):
+        """Record that the cuboid pos1 to pos2 was set to name. Use name None if result of write is unknown
+
+        Only positions already cached are updated so large writes don't evict useful entries
+        """
+        lo = [min(a, b) for a, b in zip(pos1, pos2)]
+        hi = [max(a, b) for a, b in zip(pos1, pos2)]
+        now = time.monotonic()
+        for pos in self._cached_in(self.nodes, lo, hi, 3):
+            if name is None:
+                del self.nodes[pos]
+            else:
+                self.nodes[pos] = (name, now)
+        # any write in a column might change its ground level
+        for key in self._cached_in(self.ground, (lo[0], lo[2]), (hi[0], hi[2]), 2):
+            del self.ground[key]
+
+    def invalidate(self, pos1=None, pos2=None):
+        """Forget cached entries in cuboid pos1 to pos2, or everything if no cuboid given"""
+        if pos1 is None:
+            self.nodes.clear()
+            self.ground.clear()
+        else:
+            self.written(pos1, pos2 if pos2 is not None else pos1, None)
+
+    @staticmethod
+    def _cached_in(table, lo, hi, dims):
+        """List of keys in table inside region lo to hi, iterating whichever of region or table is smaller"""
+        volume = 1
+        for axis in range(dims):
+            volume *= hi[axis] - lo[axis] + 1
+        if volume <= len(table):
+            ranges = [range(lo[axis], hi[axis] + 1) for axis in range(dims)]
+            if dims == 3:
+                keys = ((x, y, z) for x in ranges[0] for y in ranges[1] for z in ranges[2])
+            else:
+                keys = ((x, z) for x in ranges[0] for z in ranges[1])
+            return [key for key in keys if key in table]
+        return [key for key in table if all(lo[axis] <= key[axis] <= hi[axis] for axis in range(dims))]
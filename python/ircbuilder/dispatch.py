@@ -0,0 +1,134 @@
+import asyncio
+import collections
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Ticket:
+    """A command awaiting a reply from mtbotnick"""
+    __slots__ = ('tag', 'command', 'event', 'future', 'reply', 'sent_at', 'abandoned_at')
+
+    def __init__(self, tag, command, future=None):
+        self.tag = tag
+        self.command = command
+        self.event = threading.Event()
+        # asyncio clients await future instead of blocking on event
+        self.future = future
+        self.reply = None
+        self.sent_at = time.monotonic()
+        self.abandoned_at = None
+
+    def __repr__(self):
+        return f"Ticket({self.tag}, {self.command!r})"
+
+
+class ReplyDispatcher:
+    """Matches replies from mtbotnick to the commands which caused them
+
+    mtbotnick replies to commands in the order they are received and does not echo any identifier, so every command
+    is given a ticket with an increasing tag and replies are matched to the oldest outstanding ticket.
+    A ticket whose waiter timed out is abandoned but kept for late_reply_grace seconds, so that its late reply is
+    discarded rather than being handed to the next command. Replies when no ticket is outstanding are unsolicited.
+
+    Replies carry nothing to say which command they answer, so a reply arriving while the oldest ticket is abandoned
+    is always discarded as late, even if that command's reply was really lost. The next command may then time out too,
+    but no reply is ever handed to a command it doesn't belong to. Abandoned tickets which never get a reply within
+    late_reply_grace are counted as lost.
+
+    late_reply_grace: seconds after a timeout during which a late reply is still expected
+    """
+    def __init__(self, late_reply_grace=10.0):
+        self.late_reply_grace = late_reply_grace
+        self.late_replies = 0
+        self.lost_replies = 0
+        self._tags = itertools.count(1)
+        self._outstanding = collections.deque()
+        self._lock = threading.Lock()
+
+    def expect(self, command=None, future=None):
+        """Register a command about to be sent. Returns a Ticket to pass to wait() or wait_async()
+
+        future: asyncio.Future to receive the reply. deliver() must then be called from the future's event loop
+        """
+        ticket = Ticket(next(self._tags), command, future)
+        with self._lock:
+            self._outstanding.append(ticket)
+        return ticket
+
+    def outstanding(self):
+        """Number of commands sent which have not received a reply"""
+        return len(self._outstanding)
+
+    def deliver(self, message):
+        """Hand message to the oldest outstanding ticket. Returns False if message was unsolicited"""
+        now = time.monotonic()
+        with self._lock:
+            while self._outstanding:
+                ticket = self._outstanding.popleft()
+                if ticket.abandoned_at is None:
+                    self._reply(ticket, message)
+                    return True
+                if now - ticket.abandoned_at <= self.late_reply_grace:
+                    self.late_replies += 1
+                    logger.info(f"deliver: Discarding late reply to tag {ticket.tag} {ticket.command!r}: {message}")
+                    return True
+                self.lost_replies += 1
+                logger.debug(f"deliver: No reply received for tag {ticket.tag} {ticket.command!r}")
+        return False
+
+    @staticmethod
+    def _reply(ticket, message):
+        ticket.reply = message
+        ticket.event.set()
+        if ticket.future is not None and not ticket.future.done():
+            ticket.future.set_result(message)
+
+    @staticmethod
+    def _timed_out(ticket):
+        """Abandon ticket whose waiter timed out. Returns its reply if it arrived just as wait timed out, else None.
+        Must hold self._lock
+        """
+        if ticket.event.is_set():
+            return ticket.reply
+        ticket.abandoned_at = time.monotonic()
+        return None
+
+    def close(self):
+        """Give every outstanding ticket a reply of None, eg when the connection closes so no replies can arrive
+
+        Tickets with futures must be closed from the futures' event loop
+        """
+        with self._lock:
+            while self._outstanding:
+                ticket = self._outstanding.popleft()
+                ticket.event.set()
+                if ticket.future is not None and not ticket.future.done():
+                    ticket.future.set_result(None)
+
+    def wait(self, ticket, timeout=5.0):
+        """Block until ticket receives its reply. Returns reply or None if timeout expired"""
+        if ticket.event.wait(timeout):
+            return ticket.reply
+        with self._lock:
+            reply = self._timed_out(ticket)
+        if reply is not None:
+            return reply
+        logger.info(f"wait: Timeout waiting for reply to tag {ticket.tag} {ticket.command!r} after {timeout} seconds")
+        return None
+
+    async def wait_async(self, ticket, timeout=5.0):
+        """Await reply to a ticket created with a future. Returns reply or None if timeout expired"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+        except asyncio.TimeoutError:
+            pass
+        with self._lock:
+            reply = self._timed_out(ticket)
+        if reply is not None:
+            return reply
+        logger.info(f"wait_async: Timeout waiting for reply to tag {ticket.tag} {ticket.command!r} after {timeout} seconds")
+        return None
@@ -0,0 +1,469 @@
+"""Local stand-in for an IRC server with a Minetest server running the irc, irc_commands and irc_builder mods
+
+Lets MinetestConnection be tested and benchmarked on one computer without an IRC network or Minetest.
+The world is an in-memory dict of node names. Latency, flood limits and line length limits are configurable so
+throughput can be measured reproducibly.
+
+Example:
+
+with ircbuilder.fakeserver.FakeIrcServer(latency=0.05) as server:
+    with ircbuilder.open_irc(server.host, 'mtuser', 'mtuserpass', port=server.port) as mc:
+        mc.set_nodes(0, 0, 0, 9, 9, 9, 'default:stone')
+    print(server.world.get_node((5, 5, 5)), server.stats())
+
+Or run a server for other programs to connect to:
+
+    python -m ircbuilder.fakeserver --port 6667 --latency 0.05
+"""
+import base64
+import itertools
+import json
+import logging
+import queue
+import re
+import socket
+import socketserver
+import threading
+import time
+import zlib
+
+from ircbuilder import cache
+from ircbuilder import payload
+
+logger = logging.getLogger(__name__)
+
+# Maximum length of IRC line including CR LF (RFC 1459)
+IRC_MAX_LINE_LEN = 512
+# Nodes which get_ground_level looks through, as in init.lua
+UNGROUND = {"ignore", "air", "default:tree", "default:leaves"}
+MOD_VERSION = "0.0.10"
+MAPBLOCK_SIZE = 16
+# Limits of get_ground_levels and get_nodes_compressed in init.lua
+MAX_GROUND_LEVELS = 16384
+MAX_NODES_COMPRESSED = 32768
+RE_POS = r"\(\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*,\s*(-?[\d.]+)\s*\)"
+
+
+def parse_pos(match, first=1):
+    return tuple(round(float(match.group(first + i))) for i in range(3))
+
+
+class FakeMinetest:
+    """In-memory world answering the chat commands of the irc_builder mod with the same replies as init.lua
+
+    ground_level: nodes at or below this y are ground_item unless set, above are air
+    node_time: seconds of server time used per node set, simulating a busy server. Commands run one at a time
+    node_list_versions: set_node_list payload versions understood. (1,) simulates a mod older than 0.0.9
+    chunked: False simulates a mod older than 0.0.10 without get_ground_levels and get_nodes_compressed
+    drop_replies: {command name: n} runs the next n commands of that name but never sends their replies, as if lost
+    Only node names are stored so json items compare and set by name only.
+    mapblock_loads counts the mapblocks each command sets nodes in, summed over commands, as a measure of how much
+    loading and saving of mapblocks a real server would do.
+    """
+    def __init__(self, ground_level=0, ground_item="default:stone", node_time=0.0, node_list_versions=(1, 2),
+                 chunked=True, players=("singleplayer",)):
+        self.ground_level = ground_level
+        self.ground_item = ground_item
+        self.node_time = node_time
+        self.node_list_versions = tuple(node_list_versions)
+        self.chunked = chunked
+        self.players = list(players)
+        # (x, y, z) => node name for nodes which differ from the generated world
+        self.nodes = {}
+        self.lock = threading.Lock()
+        self.commands = 0
+        self.nodes_set = 0
+        self.mapblock_loads = 0
+        # mapblocks changed by the command being run
+        self.blocks_touched = set()
+        self.chunks = {}
+        self.next_chunk_id = 0
+        self.drop_replies = {}
+        self.handlers = {
+            "irc_builder_version": self.cmd_irc_builder_version,
+            "get_node": self.cmd_get_node,
+            "get_ground_level": self.cmd_get_ground_level,
+            "compare_nodes": self.cmd_compare_nodes,
+            "set_node": self.cmd_set_node,
+            "set_nodes": self.cmd_set_nodes,
+            "set_node_list": self.cmd_set_node_list,
+            "get_connected_players": self.cmd_get_connected_players,
+        }
+        if payload.NODE_LIST_VERSION_2 in self.node_list_versions:
+            self.handlers["set_node_list2"] = self.cmd_set_node_list2
+        if chunked:
+            self.handlers.update({
+                "get_chunk": self.cmd_get_chunk,
+                "get_ground_levels": self.cmd_get_ground_levels,
+                "get_nodes_compressed": self.cmd_get_nodes_compressed,
+            })
+
+    def get_node(self, pos):
+        name = self.nodes.get(pos)
+        if name is None:
+            return self.ground_item if pos[1] <= self.ground_level else "air"
+        return name
+
+    def set_cuboid(self, pos1, pos2, name):
+        """Set all nodes in cuboid to name returning count of nodes set"""
+        ranges = [range(min(a, b), max(a, b) + 1) for a, b in zip(pos1, pos2)]
+        count = 0
+        for pos in itertools.product(*ranges):
+            self.nodes[pos] = name
+            count += 1
+        self.nodes_set += count
+        self.blocks_touched.update(itertools.product(
+            *(range(r.start // MAPBLOCK_SIZE, (r.stop - 1) // MAPBLOCK_SIZE + 1) for r in ranges)))
+        if self.node_time:
+            time.sleep(self.node_time * count)
+        return count
+
+    def get_ground_level(self, x, z):
+        y = 100
+        while y >= 0 and self.get_node((x, y, z)) in UNGROUND:
+            y -= 1
+        return y
+
+    def command(self, name, param):
+        """Run chat command name with param text returning the reply, or None if the reply is to be dropped"""
+        handler = self.handlers.get(name)
+        if handler is None:
+            return "Unknown command. Try 'help'"
+        with self.lock:
+            self.commands += 1
+            try:
+                reply = handler(param)
+            except (ValueError, IndexError, zlib.error) as e:
+                logger.debug(f"command: {name} failed {e!r}")
+                reply = None
+            self.mapblock_loads += len(self.blocks_touched)
+            self.blocks_touched.clear()
+            if self.drop_replies.get(name):
+                self.drop_replies[name] -= 1
+                return None
+        return reply if reply is not None else "Invalid usage, see /help " + name
+
+    def cmd_irc_builder_version(self, param):
+        return MOD_VERSION + "".join(f" set_node_list{v}" for v in self.node_list_versions)
+
+    def cmd_get_node(self, param):
+        m = re.fullmatch(RE_POS + r"\s*", param)
+        return self.get_node(parse_pos(m)) if m else None
+
+    def cmd_get_ground_level(self, param):
+        x, z = (int(s) for s in param.split())
+        return str(self.get_ground_level(x, z))
+
+    def cmd_compare_nodes(self, param):
+        m = re.fullmatch(RE_POS + r"\s*" + RE_POS + r"\s*(.+)", param)
+        if not m:
+            return None
+        name = cache.item_name(m.group(7))
+        ranges = [range(min(a, b), max(a, b) + 1) for a, b in zip(parse_pos(m), parse_pos(m, 4))]
+        return str(sum(1 for pos in itertools.product(*ranges) if self.get_node(pos) != name))
+
+    def cmd_set_node(self, param):
+        m = re.fullmatch(RE_POS + r"\s*(.+)", param)
+        if not m:
+            return None
+        pos = parse_pos(m)
+        return m.group(4) + " " + str(self.set_cuboid(pos, pos, cache.item_name(m.group(4))))
+
+    def cmd_set_nodes(self, param):
+        m = re.fullmatch(RE_POS + r"\s*" + RE_POS + r"\s*(.+)", param)
+        if not m:
+            return None
+        return m.group(7) + " " + str(self.set_cuboid(parse_pos(m), parse_pos(m, 4), cache.item_name(m.group(7))))
+
+    def _set_corners(self, corners, itemtext):
+        name = cache.item_name(itemtext)
+        return itemtext + " " + str(sum(self.set_cuboid(lo, hi, name) for lo, hi in corners))
+
+    def cmd_set_node_list(self, param):
+        b64, itemtext = param.split(' ', 1)
+        return self._set_corners(payload.decode_node_list(b64), itemtext)
+
+    def cmd_set_node_list2(self, param):
+        b64, itemtext = param.split(' ', 1)
+        try:
+            corners = payload.decode_node_list2(b64)
+        except ValueError as e:
+            # as the mod replies when it can't decode the payload
+            return f"set_node_list2 failed: {e}"
+        return self._set_corners(corners, itemtext)
+
+    def cmd_get_connected_players(self, param):
+        return " ".join(self.players)
+
+    def reply_chunked(self, data):
+        b64 = base64.standard_b64encode(zlib.compress(data.encode('utf-8'))).decode('utf-8')
+        chunks = [b64[i:i + 380] for i in range(0, len(b64), 380)]
+        self.next_chunk_id += 1
+        # like the mod only the latest chunked reply is kept. The mod keeps one per player
+        self.chunks = {'id': self.next_chunk_id, 'chunks': chunks}
+        return f"chunk {self.next_chunk_id} 1 {len(chunks)} {chunks[0]}"
+
+    def cmd_get_chunk(self, param):
+        chunk_id, n = (int(s) for s in param.split())
+        if self.chunks.get('id') != chunk_id or not 1 <= n <= len(self.chunks['chunks']):
+            return f"no chunk {chunk_id} {n}"
+        return f"chunk {chunk_id} {n} {len(self.chunks['chunks'])} {self.chunks['chunks'][n - 1]}"
+
+    def cmd_get_ground_levels(self, param):
+        x1, z1, x2, z2 = (int(s) for s in param.split())
+        if (abs(x2 - x1) + 1) * (abs(z2 - z1) + 1) > MAX_GROUND_LEVELS:
+            return f"too many columns, maximum {MAX_GROUND_LEVELS}"
+        keys = itertools.product(range(min(x1, x2), max(x1, x2) + 1), range(min(z1, z2), max(z1, z2) + 1))
+        return self.reply_chunked(",".join(str(self.get_ground_level(x, z)) for x, z in keys))
+
+    def cmd_get_nodes_compressed(self, param):
+        m = re.fullmatch(RE_POS + r"\s*" + RE_POS + r"\s*", param)
+        if not m:
+            return None
+        ranges = [range(min(a, b), max(a, b) + 1) for a, b in zip(parse_pos(m), parse_pos(m, 4))]
+        if len(ranges[0]) * len(ranges[1]) * len(ranges[2]) > MAX_NODES_COMPRESSED:
+            return f"too many nodes, maximum {MAX_NODES_COMPRESSED}"
+        palette = {}
+        indices = [palette.setdefault(self.get_node(pos), len(palette) + 1) for pos in itertools.product(*ranges)]
+        return self.reply_chunked(" ".join(palette) + "\n" + ",".join(str(i) for i in indices))
+
+
+class FakeIrcClient(socketserver.StreamRequestHandler):
+    """Connection from one IRC client. Reads lines on the handler thread and writes replies on a writer thread"""
+    def setup(self):
+        super().setup()
+        self.nick = None
+        self.mtuser = None
+        self.channels = set()
+        self.bucket = None
+        # (time due, line) in order of time due because every reply has the same latency
+        self.outgoing = queue.Queue()
+        self.writer = threading.Thread(target=self.write_lines, daemon=True)
+        self.writer.start()
+
+    def finish(self):
+        self.outgoing.put(None)
+        super().finish()
+
+    def write_lines(self):
+        while True:
+            entry = self.outgoing.get()
+            if entry is None:
+                break
+            due, line = entry
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                self.wfile.write(line)
+            except OSError:
+                break
+
+    def send(self, line, delay=0.0):
+        data = self.server.limit_line(line.encode('utf-8', errors='replace') + b"\r\n")
+        self.outgoing.put((time.monotonic() + delay, data))
+
+    def numeric(self, num, text):
+        self.send(f":{self.server.name} {num:03d} {self.nick} {text}")
+
+    def handle(self):
+        try:
+            if self.request.recv(1, socket.MSG_PEEK) == b"\x16":
+                # TLS handshake. Closing makes MinetestConnection retry without TLS
+                logger.debug("handle: Closing TLS connection")
+                return
+        except OSError:
+            return
+        while True:
+            try:
+                data = self.rfile.readline()
+            except OSError:
+                break
+            if not data:
+                break
+            self.server.count('lines_received')
+            self.server.count('bytes_received', len(data))
+            if len(data) > self.server.max_line_len:
+                self.server.count('lines_truncated')
+                data = data[:self.server.max_line_len - 2]
+            if not self.flood_check():
+                self.send("ERROR :Closing Link: (Excess Flood)")
+                self.server.count('flood_kills')
+                break
+            line = data.decode('utf-8', errors='replace').strip("\r\n")
+            if line:
+                self.handle_line(line)
+
+    def flood_check(self):
+        """Apply server flood limits to a line just received. Returns False if client should be disconnected"""
+        server = self.server
+        if server.flood_rate is None:
+            return True
+        if self.bucket is None:
+            self.bucket = [float(server.flood_burst), time.monotonic()]
+        now = time.monotonic()
+        self.bucket[0] = min(server.flood_burst, self.bucket[0] + (now - self.bucket[1]) * server.flood_rate)
+        self.bucket[1] = now
+        if self.bucket[0] < 1.0:
+            if server.flood_kill:
+                return False
+            # stop reading this client until the bucket refills, like the fake lag of many IRC servers
+            wait = (1.0 - self.bucket[0]) / server.flood_rate
+            server.count('flood_delay', wait)
+            time.sleep(wait)
+            self.bucket = [1.0, time.monotonic()]
+        self.bucket[0] -= 1.0
+        return True
+
+    def handle_line(self, line):
+        words = line.split(' ', 2)
+        verb = words[0].upper()
+        if verb == "NICK":
+            self.nick = words[1]
+            self.numeric(1, f":Welcome to the fake IRC network {self.nick}")
+            self.numeric(375, ":- Message of the day -")
+            self.numeric(372, ":- Offline stand-in for testing ircbuilder")
+            self.numeric(376, ":End of /MOTD command.")
+        elif verb == "JOIN":
+            channel = words[1]
+            self.channels.add(channel)
+            self.send(f":{self.nick}!{self.nick}@localhost JOIN {channel}")
+            self.numeric(353, f"= {channel} :{self.nick} {self.server.mtbotnick}")
+            self.numeric(366, f"{channel} :End of /NAMES list.")
+        elif verb == "PART":
+            self.channels.discard(words[1])
+        elif verb == "PING":
+            self.send(f":{self.server.name} PONG {self.server.name} {' '.join(words[1:])}")
+        elif verb == "PRIVMSG" and len(words) == 3:
+            self.handle_privmsg(words[1], words[2][1:] if words[2].startswith(':') else words[2])
+        elif verb == "QUIT":
+            self.request.shutdown(socket.SHUT_RDWR)
+
+    def handle_privmsg(self, target, message):
+        if target != self.server.mtbotnick:
+            return
+        # irc_commands ignores spaces between the colon and the command
+        words = message.strip().split(' ', 1)
+        command = words[0]
+        rest = words[1] if len(words) > 1 else ""
+        self.server.count('commands')
+        if command == "login":
+            self.mtuser = self.server.login(*rest.split(' ', 1))
+            reply = "You are now logged in as " + self.mtuser if self.mtuser else "Incorrect password"
+        elif command == "logout":
+            self.mtuser = None
+            reply = "You are now logged off"
+        elif command == "cmd":
+            if not self.mtuser:
+                reply = "You must be logged in to use this command"
+            else:
+                name, _, param = rest.partition(' ')
+                reply = self.server.world.command(name, param)
+                if reply is None:
+                    return
+        else:
+            reply = f"Unknown command '{command}'. Try 'help'."
+        self.send(f":{self.server.mtbotnick}!{self.server.mtbotnick}@localhost PRIVMSG {self.nick} :{reply}",
+                  self.server.latency)
+
+
+class FakeIrcServer(socketserver.ThreadingTCPServer):
+    """IRC server on localhost whose only other user is mtbotnick, a FakeMinetest world
+
+    port: 0 picks a free port, available as self.port after construction
+    latency: seconds added to every reply from mtbotnick, simulating round trip time to IRC and Minetest servers
+    flood_burst, flood_rate: lines the server accepts without delay and lines per second after that.
+                             flood_rate None means no flood limit
+    flood_kill: True disconnects flooding clients with "Excess Flood". False delays reading, as many servers do
+    max_line_len: longer lines, including CR LF, are truncated in both directions
+    passwords: dict of mtuser => password. None accepts any login
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, mtbotnick="mtserver", world=None, latency=0.0, flood_burst=10,
+                 flood_rate=None, flood_kill=False, max_line_len=IRC_MAX_LINE_LEN, passwords=None):
+        super().__init__((host, port), FakeIrcClient)
+        self.host, self.port = self.server_address[:2]
+        self.name = "fake.irc"
+        self.mtbotnick = mtbotnick
+        self.world = world if world is not None else FakeMinetest()
+        self.latency = latency
+        self.flood_burst = flood_burst
+        self.flood_rate = flood_rate
+        self.flood_kill = flood_kill
+        self.max_line_len = max_line_len
+        self.passwords = passwords
+        self.line_stats = {'lines_received': 0, 'bytes_received': 0, 'lines_truncated': 0, 'commands': 0,
+                           'flood_kills': 0, 'flood_delay': 0.0}
+        self.stats_lock = threading.Lock()
+        self.thread = None
+
+    def login(self, mtuser, password=""):
+        if self.passwords is None or self.passwords.get(mtuser) == password:
+            return mtuser
+        return None
+
+    def count(self, key, n=1):
+        with self.stats_lock:
+            self.line_stats[key] += n
+
+    def limit_line(self, data):
+        if len(data) > self.max_line_len:
+            self.count('lines_truncated')
+            return data[:self.max_line_len - 2] + b"\r\n"
+        return data
+
+    def stats(self):
+        with self.stats_lock:
+            stats = dict(self.line_stats)
+        stats['nodes_set'] = self.world.nodes_set
+        stats['world_commands'] = self.world.commands
+        stats['mapblock_loads'] = self.world.mapblock_loads
+        return stats
+
+    def start(self):
+        """Serve on a daemon thread. Returns self so can be used as server = FakeIrcServer().start()"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    import argparse
+    parser = argparse.ArgumentParser(description="Fake IRC server with a simulated Minetest irc_builder bot")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6667)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every reply")
+    parser.add_argument("--flood-burst", type=int, default=10)
+    parser.add_argument("--flood-rate", type=float, default=None, help="lines per second. Default unlimited")
+    parser.add_argument("--flood-kill", action="store_true", help="disconnect flooding clients instead of delaying")
+    parser.add_argument("--max-line-len", type=int, default=IRC_MAX_LINE_LEN)
+    parser.add_argument("--node-time", type=float, default=0.0, help="server seconds per node set")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    server = FakeIrcServer(args.host, args.port, world=FakeMinetest(node_time=args.node_time), latency=args.latency,
+                           flood_burst=args.flood_burst, flood_rate=args.flood_rate, flood_kill=args.flood_kill,
+                           max_line_len=args.max_line_len)
+    logger.info(f"Fake IRC server listening on {server.host}:{server.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(server.stats()))
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class FloodControl:
+    """Token bucket limiting the rate lines are sent to the IRC server
+
+    Each line costs 1 token plus byte_penalty tokens per byte. Tokens refill at rate per second up to burst.
+    A line costing more than burst is sent as soon as the bucket is full.
+
+    burst: number of tokens in a full bucket. Roughly the number of short lines which can be sent without delay
+    rate: tokens added per second. Roughly the number of short lines per second once the burst is used
+    byte_penalty: extra tokens per byte sent. eg 1/120 makes a 480 byte line cost the same as 5 short lines
+    """
+    def __init__(self, burst=10, rate=10.0, byte_penalty=0.0):
+        self.burst = burst
+        self.rate = rate
+        self.byte_penalty = byte_penalty
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+
+    def cost(self, nbytes):
+        return min(1.0 + self.byte_penalty * nbytes, self.burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+
+    def delay(self, nbytes):
+        """Seconds to wait before a line of nbytes can be sent"""
+        self._refill()
+        shortfall = self.cost(nbytes) - self.tokens
+        return shortfall / self.rate if shortfall > 0 else 0.0
+
+    def consume(self, nbytes):
+        self._refill()
+        self.tokens -= self.cost(nbytes)
+
+
+def estimate_send_time(groups, flood_control=None, rtt=0.0, window=1):
+    """Seconds to send commands through a SendScheduler and receive the last reply, without sending anything
+
+    Simulates the token bucket of flood_control, starting full, and waiting for the reply to the oldest command once
+    window commands are awaiting replies, as MinetestConnection does for set_node_list batches.
+    groups: list of lists of bytes of each line, as counted by flood control. Each group is sent as one call of
+            MinetestConnection.set_node_list, which waits for every reply before returning
+    flood_control: FloodControl whose burst, rate and byte_penalty are used. Defaults to FloodControl()
+    rtt: seconds from sending a command until its reply arrives
+    window: commands sent before waiting for a reply
+    """
+    if flood_control is None:
+        flood_control = FloodControl()
+    burst, rate = flood_control.burst, flood_control.rate
+    tokens = float(burst)
+    now = last = 0.0
+    for line_bytes in groups:
+        replies = []
+        for i, nbytes in enumerate(line_bytes):
+            if i >= window:
+                # window full so wait for the reply to the oldest command
+                now = max(now, replies[i - window])
+            tokens = min(burst, tokens + (now - last) * rate)
+            cost = flood_control.cost(nbytes)
+            if cost > tokens:
+                now += (cost - tokens) / rate
+                tokens = cost
+            tokens -= cost
+            last = now
+            replies.append(now + rtt)
+        if replies:
+            now = replies[-1]
+    return now
+
+
+class SendScheduler:
+    """Writer thread which sends queued lines through write() subject to flood control
+
+    Lines put with priority=True (eg PONG) are sent before any normal lines still waiting in the queue.
+    All writes happen on one thread so the socket is never written to concurrently.
+
+    write: callable which sends one line (str) to the server
+    flood_control: FloodControl instance. Defaults to FloodControl()
+    """
+    def __init__(self, write, flood_control=None):
+        self.write = write
+        self.flood_control = flood_control if flood_control else FloodControl()
+        self.lines_sent = 0
+        self.bytes_sent = 0
+        self.throttled_time = 0.0
+        self.start_time = time.monotonic()
+        self._heap = []
+        self._seq = itertools.count()
+        self._pending = 0
+        self._closed = False
+        self._stopped = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        # Set daemon so thread will stop when main program stops
+        self._thread.daemon = True
+        self._thread.start()
+
+    def put(self, line, priority=False):
+        """Queue line for sending. Returns immediately"""
+        with self._cond:
+            if self._closed:
+                logger.warning(f"put: Scheduler closed so not sending {line}")
+                return
+            heapq.heappush(self._heap, (0 if priority else 1, next(self._seq), line))
+            self._pending += 1
+            self._cond.notify_all()
+
+    def pending(self):
+        """Number of lines queued or being sent"""
+        return self._pending
+
+    def flush(self, timeout=None):
+        """Wait until all queued lines have been sent. Returns False if timeout expired first"""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._pending == 0, timeout)
+
+    def close(self, timeout=5.0):
+        """Send remaining lines then stop the writer thread
+
+        Lines still queued after timeout seconds are dropped. Returns once the writer thread has stopped, so the
+        caller can close the socket without a write in progress.
+        """
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            if not flushed:
+                logger.warning(f"close: Flush timed out so dropping {len(self._heap)} queued lines")
+                self._stopped = True
+                self._pending -= len(self._heap)
+                self._heap.clear()
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        """Return dict of lines and bytes sent and the achieved rates"""
+        elapsed = time.monotonic() - self.start_time
+        return {
+            'lines_sent': self.lines_sent,
+            'bytes_sent': self.bytes_sent,
+            'throttled_time': self.throttled_time,
+            'elapsed': elapsed,
+            'lines_per_second': self.lines_sent / elapsed if elapsed > 0 else 0.0,
+            'bytes_per_second': self.bytes_sent / elapsed if elapsed > 0 else 0.0,
+        }
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closed:
+                    self._cond.wait()
+                if self._stopped or not self._heap:
+                    # stopped, or closed and nothing left to send
+                    return
+                line = self._heap[0][2]
+                nbytes = len(line.encode('utf-8'))
+                delay = self.flood_control.delay(nbytes)
+                if delay > 0:
+                    # wait for tokens but wake early if a priority line arrives
+                    started = time.monotonic()
+                    self._cond.wait(delay)
+                    self.throttled_time += time.monotonic() - started
+                    continue
+                heapq.heappop(self._heap)
+                self.flood_control.consume(nbytes)
+            try:
+                self.write(line)
+                self.lines_sent += 1
+                self.bytes_sent += nbytes
+            except OSError as ose:
+                logger.warning(f"_run: Failed to send line {ose=}")
+            finally:
+                with self._cond:
+                    self._pending -= 1
+                    self._cond.notify_all()
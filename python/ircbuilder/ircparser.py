@@ -0,0 +1,122 @@
+"""Incremental parser of IRC lines received from a socket
+
+IrcLineParser is fed whatever bytes each recv returns and gives back an IrcMessage for each complete line.
+Incomplete lines are kept until the rest arrives. Lines are only decoded once complete and the bytes of a multi-byte
+utf-8 character never include a line feed, so characters split between two recv calls are decoded correctly.
+Complete lines are decoded together straight from the received bytes through a memoryview, and only an incomplete
+line at the end is copied into the parser's own buffer.
+
+Example:
+
+parser = IrcLineParser()
+for message in parser.feed(sock.recv(2048)):
+    print(message.nick, message.command, message.params)
+"""
+
+LF = b"\n"
+
+
+class IrcMessage:
+    """One IRC line split into prefix, command and params as in RFC 1459
+
+    prefix: sender such as "nick!user@host" or "irc.server.name", or None if the line has no prefix
+    command: eg "PRIVMSG", "PING" or a 3 digit numeric reply such as "376"
+    params: list of parameters. The last is the trailing parameter if the line had one, eg the text of a PRIVMSG
+    line: the whole line without CR LF
+    """
+    __slots__ = ('prefix', 'command', 'params', 'line')
+
+    def __init__(self, prefix, command, params, line):
+        self.prefix = prefix
+        self.command = command
+        self.params = params
+        self.line = line
+
+    @property
+    def nick(self):
+        """Nick or server name of the sender, or None if the line has no prefix"""
+        if self.prefix is None:
+            return None
+        return self.prefix.split('!', 1)[0]
+
+    @property
+    def trailing(self):
+        """Last parameter, eg the text of a PRIVMSG, or empty string if there are no params"""
+        return self.params[-1] if self.params else ""
+
+    def __repr__(self):
+        return f"IrcMessage({self.prefix!r}, {self.command!r}, {self.params!r})"
+
+
+def parse_line(line):
+    """Split line, without CR LF, into an IrcMessage. Returns None for an empty line"""
+    if not line:
+        return None
+    if line[0] == ':':
+        parts = line.split(' ', 3)
+        if len(parts) == 4 and parts[3][:1] == ':' and parts[2][:1] not in ('', ':') and parts[1]:
+            # most lines are ":prefix COMMAND target :text" so split them in one go
+            return IrcMessage(parts[0][1:], parts[1], [parts[2], parts[3][1:]], line)
+        prefix, _, rest = line.partition(' ')
+        prefix = prefix[1:]
+    else:
+        prefix = None
+        rest = line
+    head, trailing, text = rest.partition(' :')
+    params = head.split()
+    if trailing:
+        params.append(text)
+    command = params.pop(0) if params else ""
+    return IrcMessage(prefix, command, params, line)
+
+
+class IrcLineParser:
+    """Splits bytes received from an IRC server into IrcMessages, one per line
+
+    encoding: character set of the lines
+    errors: how to decode bytes which are not valid in encoding, as for bytes.decode
+    """
+    def __init__(self, encoding="utf-8", errors="replace"):
+        self.encoding = encoding
+        self.errors = errors
+        # incomplete line waiting for the rest of its bytes
+        self.buffer = bytearray()
+        self.lines = 0
+
+    def feed(self, data):
+        """Return list of IrcMessage of every line completed by data, keeping any incomplete line for the next feed
+
+        data: bytes, bytearray or memoryview as received. bytes and bytearray are decoded without copying them
+        """
+        if self.buffer or isinstance(data, memoryview):
+            # continue an incomplete line. memoryview has no rfind so is always added to the buffer
+            self.buffer += data
+            end = self.buffer.rfind(LF) + 1
+            if not end:
+                return []
+            with memoryview(self.buffer) as view:
+                text = str(view[:end], self.encoding, self.errors)
+            del self.buffer[:end]
+        else:
+            end = data.rfind(LF) + 1
+            if end < len(data):
+                self.buffer += data[end:]
+            if not end:
+                return []
+            # usually data ends with a complete line so is decoded as it is
+            text = str(data if end == len(data) else memoryview(data)[:end], self.encoding, self.errors)
+        return self._messages(text)
+
+    def _messages(self, text):
+        """Return list of IrcMessage of each line of text, which ends with a line feed"""
+        lines = text.split("\r\n")
+        if len(lines) != text.count("\n") + 1:
+            # some lines end with a bare LF
+            lines = [line[:-1] if line[-1:] == "\r" else line for line in text.split("\n")]
+        messages = [parse_line(line) for line in lines if line]
+        self.lines += len(messages)
+        return messages
+
+    def pending(self):
+        """Number of bytes of an incomplete line waiting for the rest"""
+        return len(self.buffer)
@@ -0,0 +1,244 @@
+"""Persistent journal of acknowledged set_node_list batches, so a send interrupted by a disconnect can be resumed
+
+While MinetestConnection.journal is set, every set_node_list batch acknowledged by the irc_builder mod is appended to
+the journal file with the count of nodes it set, and batches already in the journal are not sent again. Merging,
+scheduling and encoding are deterministic, so sending the same nodes again after reconnecting produces the same
+commands and only those never acknowledged are sent. Batches are identified by a hash of their command, so the journal
+is only reused by sends of the same nodes with the same strategy, end_list and payload version.
+
+Example:
+
+import ircbuilder.journal
+def connect():
+    return ircbuilder.MinetestConnection.create('irc.triptera.com.au', 'mtuser', 'mtuserpass', 'mtbotnick', '#pythonator')
+ircbuilder.journal.send_resumable(connect, b.nodes, "castle.journal", end_list=('air',), palette=b.palette)
+"""
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+logger = logging.getLogger(__name__)
+
+# Connections tried by send_resumable before giving up
+RESUME_ATTEMPTS = 5
+# Seconds between connection attempts
+RESUME_DELAY = 5.0
+
+
+def batch_key(command):
+    """Short hash identifying a set_node_list command"""
+    return hashlib.blake2b(command.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def command_corners(command):
+    """List of (min corner, max corner) of every cuboid in a set_node_list or set_node_list2 command"""
+    name, b64, _ = command.split(' ', 2)
+    if name == "set_node_list2":
+        return payload.decode_node_list2(b64)
+    return payload.decode_node_list(b64)
+
+
+class JournalEntry:
+    """One acknowledged batch: item, count of nodes set and one of its cuboids to check with compare_nodes"""
+    __slots__ = ('key', 'item', 'count', 'sample')
+
+    def __init__(self, key, item, count, sample):
+        self.key = key
+        self.item = item
+        self.count = count
+        self.sample = sample
+
+    def as_dict(self):
+        return {'key': self.key, 'item': self.item, 'count': self.count, 'sample': self.sample}
+
+
+class SendJournal:
+    """Append only file of set_node_list batches acknowledged, one json object per line
+
+    path: journal file. Entries already in it are loaded, so a journal survives the program being restarted.
+          A last line left incomplete by a crash is ignored
+    """
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        # batches sent since reset_pass() which were not acknowledged
+        self.unacknowledged = 0
+        complete = True
+        if os.path.exists(path):
+            complete = self._load()
+        self._file = open(path, "a", encoding='utf-8')
+        if not complete:
+            # end the incomplete line so the next entry isn't joined to it
+            self._file.write("\n")
+
+    def _load(self):
+        """Load entries from the journal file. Returns False if its last line is incomplete"""
+        line = ""
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    d = json.loads(line)
+                except ValueError:
+                    logger.warning(f"_load: Ignoring incomplete line in {self.path}: {line[:80]!r}")
+                    continue
+                if d is None:
+                    # written by clear() so forget everything before it
+                    self.entries.clear()
+                else:
+                    self.entries[d['key']] = JournalEntry(d['key'], d['item'], d['count'], d['sample'])
+        return not line or line.endswith("\n")
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, command):
+        return batch_key(command) in self.entries
+
+    def reply(self, command):
+        """Reply "item count" recorded when command was acknowledged, or None if it never was"""
+        entry = self.entries.get(batch_key(command))
+        if entry is None:
+            return None
+        return f"{entry.item} {entry.count}"
+
+    def record(self, command, reply):
+        """Record reply to a set_node_list command. Returns count of nodes set, or None if reply was not an ack"""
+        item = command.split(' ', 2)[2]
+        count = payload.reply_count(reply, item)
+        if count is None:
+            self.unacknowledged += 1
+            return None
+        corners = command_corners(command)
+        sample = [list(c) for c in corners[0]] if corners else None
+        entry = JournalEntry(batch_key(command), item, count, sample)
+        self.entries[entry.key] = entry
+        # flush each entry so it survives the program being killed part way through a send
+        self._file.write(json.dumps(entry.as_dict()) + "\n")
+        self._file.flush()
+        return count
+
+    def forget(self, keys):
+        """Remove entries so their batches are sent again"""
+        for key in keys:
+            self.entries.pop(key, None)
+        self._rewrite()
+
+    def clear(self):
+        """Forget every batch so everything is sent again"""
+        self.entries.clear()
+        self._file.write("null\n")
+        self._file.flush()
+
+    def _rewrite(self):
+        self._file.close()
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding='utf-8') as f:
+            for entry in self.entries.values():
+                f.write(json.dumps(entry.as_dict()) + "\n")
+        os.replace(tmp, self.path)
+        self._file = open(self.path, "a", encoding='utf-8')
+
+    def reset_pass(self):
+        self.unacknowledged = 0
+
+    def nodes_set(self):
+        """Total count of nodes set by every acknowledged batch"""
+        return sum(entry.count for entry in self.entries.values())
+
+    def verify(self, mc, sample=10):
+        """Check with compare_nodes that a random sample of acknowledged batches is still in the world
+
+        Batches whose sample cuboid differs are forgotten so they are sent again.
+        returns count of batches which differ
+        """
+        entries = [e for e in self.entries.values() if e.sample is not None]
+        checked = random.sample(entries, min(sample, len(entries)))
+        wrong = []
+        for entry in checked:
+            lo, hi = entry.sample
+            reply = mc.compare_nodes(*lo, *hi, entry.item)
+            if reply != "0":
+                logger.info(f"verify: {entry.item} at {lo} {hi} has {reply} differences")
+                wrong.append(entry.key)
+        if wrong:
+            self.forget(wrong)
+        return len(wrong)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def resume(mc, node_lists, journal, end_list=(), verify_sample=0, region_size=nodebuilder.MAPBLOCK_SIZE):
+    """Send node_lists through mc skipping batches in journal, and record those acknowledged
+
+    verify_sample: first check this many acknowledged batches with compare_nodes. If any differ, eg because the
+                   server restarted without saving them, the whole journal is distrusted and everything sent again
+    returns True if every batch has now been acknowledged
+    Raises ConnectionError if the connection closes while sending
+    """
+    if verify_sample and len(journal):
+        wrong = journal.verify(mc, verify_sample)
+        if wrong:
+            logger.warning(f"resume: {wrong} of {verify_sample} batches checked are no longer in the world so "
+                           f"sending everything again")
+            journal.clear()
+    skipped = len(journal)
+    journal.reset_pass()
+    previous, mc.journal = mc.journal, journal
+    try:
+        nodebuilder.send_node_lists(mc, node_lists, end_list, region_size)
+    finally:
+        mc.journal = previous
+    logger.info(f"resume: {len(journal)} batches acknowledged, {skipped} of them before this pass, "
+                f"{journal.unacknowledged} not acknowledged")
+    return journal.unacknowledged == 0
+
+
+def send_resumable(connect, node_dict, path, end_list=(), strategy="fast", palette=None, verify_sample=0,
+                   attempts=RESUME_ATTEMPTS, delay=RESUME_DELAY):
+    """Send node_dict, reconnecting after disconnects and sending only batches not yet acknowledged
+
+    connect: callable returning a logged in MinetestConnection, eg lambda: MinetestConnection.create(...)
+    path: journal file. Run again with the same path to resume a send which gave up or whose program was killed
+    palette: nodebuilder.ItemPalette if the values of node_dict are its ids rather than items
+    verify_sample: acknowledged batches checked with compare_nodes after each connect, as for resume()
+    attempts: connections tried before giving up
+    delay: seconds to wait before reconnecting
+    returns the SendJournal, closed. Raises ConnectionError if batches are still unacknowledged after attempts
+    """
+    node_lists = nodebuilder.node_lists_from_node_dict(node_dict, strategy, palette)
+    with SendJournal(path) as journal:
+        for attempt in range(1, attempts + 1):
+            if attempt > 1:
+                time.sleep(delay)
+            try:
+                mc = connect()
+            except OSError as ose:
+                logger.warning(f"send_resumable: Connection attempt {attempt} failed {ose=}")
+                continue
+            try:
+                if resume(mc, node_lists, journal, end_list, verify_sample):
+                    return journal
+                logger.warning(f"send_resumable: {journal.unacknowledged} batches not acknowledged on attempt {attempt}")
+            except ConnectionError as ce:
+                logger.warning(f"send_resumable: Disconnected on attempt {attempt} after {len(journal)} batches {ce=}")
+            finally:
+                try:
+                    mc.close()
+                except OSError:
+                    # already disconnected
+                    pass
+    raise ConnectionError(f"send_resumable: Batches still not acknowledged after {attempts} attempts. "
+                          f"Run again with journal {path} to resume")
@@ -0,0 +1,174 @@
+import bisect
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of latency histogram buckets. Last bucket is everything slower
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0)
+
+
+class LatencyHistogram:
+    """Counts of latencies in exponential buckets, with total, min and max"""
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, seconds):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket containing the given fraction of latencies, or max if in the last bucket"""
+        if not self.count:
+            return None
+        target = fraction * self.count
+        seen = 0
+        for bound, n in zip(LATENCY_BUCKETS, self.counts):
+            seen += n
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def as_dict(self):
+        buckets = {f"<={bound}": n for bound, n in zip(LATENCY_BUCKETS, self.counts) if n}
+        if self.counts[-1]:
+            buckets[f">{LATENCY_BUCKETS[-1]}"] = self.counts[-1]
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'min': self.min,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+            'buckets': buckets,
+        }
+
+
+class Metrics:
+    """Counters and timings of everything sent through a MinetestConnection
+
+    Records reply latency per command, timeouts, compression of each set_node_list batch, the deepest the receive
+    queues have been and time spent in each stage of sending a building (diff, merge, encode, send).
+
+    Listeners are called with (event, data) as each measurement is made, eg to forward to a monitoring system.
+    Events are "command" {command, seconds, timeout}, "batch" {item, entries, raw_bytes, compressed_bytes}
+    and "stage" {stage, seconds}.
+    """
+    def __init__(self):
+        self.latency = {}
+        self.timeouts = {}
+        self.batches = 0
+        self.batch_entries = 0
+        self.batch_raw_bytes = 0
+        self.batch_compressed_bytes = 0
+        self.max_queue_depth = {}
+        self.stage_time = {}
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """listener(event, data) is called on the thread making the measurement so should return quickly"""
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def _notify(self, event, data):
+        for listener in self.listeners:
+            try:
+                listener(event, data)
+            except Exception:
+                logger.exception(f"_notify: Listener {listener!r} failed on {event}")
+
+    def command(self, command, seconds, timeout=False):
+        """Record time from sending command until its reply, or until giving up if timeout"""
+        with self._lock:
+            if timeout:
+                self.timeouts[command] = self.timeouts.get(command, 0) + 1
+            else:
+                self.latency.setdefault(command, LatencyHistogram()).add(seconds)
+        if self.listeners:
+            self._notify("command", {'command': command, 'seconds': seconds, 'timeout': timeout})
+
+    def batch(self, item, entries, raw_bytes, compressed_bytes):
+        """Record one set_node_list batch of entries positions or cuboids compressed from raw_bytes"""
+        with self._lock:
+            self.batches += 1
+            self.batch_entries += entries
+            self.batch_raw_bytes += raw_bytes
+            self.batch_compressed_bytes += compressed_bytes
+        if self.listeners:
+            self._notify("batch", {'item': item, 'entries': entries, 'raw_bytes': raw_bytes,
+                                   'compressed_bytes': compressed_bytes})
+
+    def queue_depth(self, name, depth):
+        if depth > self.max_queue_depth.get(name, 0):
+            self.max_queue_depth[name] = depth
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Context manager adding time spent inside it to stage name"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self.stage_time[name] = self.stage_time.get(name, 0.0) + seconds
+            if self.listeners:
+                self._notify("stage", {'stage': name, 'seconds': seconds})
+
+    def summary(self):
+        with self._lock:
+            return {
+                'commands': {command: h.as_dict() for command, h in self.latency.items()},
+                'timeouts': dict(self.timeouts),
+                'batches': self.batches,
+                'batch_entries': self.batch_entries,
+                'batch_raw_bytes': self.batch_raw_bytes,
+                'batch_compressed_bytes': self.batch_compressed_bytes,
+                'compression_ratio': self.batch_raw_bytes / self.batch_compressed_bytes if self.batch_compressed_bytes else None,
+                'max_queue_depth': dict(self.max_queue_depth),
+                'stage_time': dict(self.stage_time),
+            }
+
+
+def timed(metrics, name):
+    """metrics.stage(name) or a context manager doing nothing if metrics is None, eg for connections without metrics"""
+    return metrics.stage(name) if metrics is not None else contextlib.nullcontext()
+
+
+def format_summary(summary):
+    """Multi line text of a MinetestConnection.metrics_summary() for logging"""
+    lines = []
+    sender = summary.get('sender')
+    if sender:
+        lines.append(f"sent {sender['lines_sent']} lines {sender['bytes_sent']} bytes in {sender['elapsed']:.1f}s, "
+                     f"throttled {sender['throttled_time']:.1f}s")
+    for command, h in sorted(summary['commands'].items()):
+        lines.append(f"{command}: {h['count']} replies mean {h['mean']:.4f}s p50 {h['p50']:.4f}s "
+                     f"p90 {h['p90']:.4f}s max {h['max']:.4f}s")
+    for command, n in sorted(summary['timeouts'].items()):
+        lines.append(f"{command}: {n} timeouts")
+    if summary['batches']:
+        lines.append(f"set_node_list: {summary['batches']} batches {summary['batch_entries']} entries "
+                     f"compression ratio {summary['compression_ratio']:.2f}")
+    for name, seconds in summary['stage_time'].items():
+        lines.append(f"stage {name}: {seconds:.3f}s")
+    if summary['max_queue_depth']:
+        lines.append("max queue depth " + " ".join(f"{k}={v}" for k, v in sorted(summary['max_queue_depth'].items())))
+    if summary.get('late_replies'):
+        lines.append(f"late replies discarded: {summary['late_replies']}")
+    if summary.get('lost_replies'):
+        lines.append(f"replies never received: {summary['lost_replies']}")
+    return "\n".join(lines)
@@ -1,6 +1,33 @@
+import functools
+import itertools
 import json
 import math
 
+from ircbuilder import floodcontrol
+from ircbuilder import metrics
+from ircbuilder import payload
+
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional. Without it numpy arrays are rounded one value at a time
+    np = None
+
+# Strategies accepted by node_lists_with_cuboids
+CUBOID_STRATEGIES = ("fast", "fewest")
+# Integers up to this size are unchanged by float() so ranges within it need no rounding
+_EXACT_FLOAT_INT = 2 ** 53
+# Floats below this size can be converted to numpy int64 without overflow
+_MAX_INT64_FLOAT = 2.0 ** 62
+# NodeSnapshot packs each coordinate into 21 bits
+SNAPSHOT_MAX_COORD = 2 ** 20
+# Edge length in nodes of a minetest mapblock
+MAPBLOCK_SIZE = 16
+# Positions and cuboids in each region scheduled by schedule_node_lists, enough to fill several set_node_list commands
+SCHEDULE_MIN_ENTRIES = 512
+# Region coordinates are offset by this to make them positive for morton codes
+_MORTON_OFFSET = 2 ** 20
+
 
 def make_iter(i):
     try:
@@ -16,23 +43,113 @@ def int_tuple(*args):
     return tuple(my_list)
 
 
+def int_values(values):
+    """Round a coordinate, or an iterable of coordinates, to integers exactly as int_tuple does
+
+    Ranges are returned unchanged and 1-d numpy arrays are rounded in bulk. Anything else is rounded one value at a time.
+    returns an iterable of int which can be iterated more than once
+    """
+    if isinstance(values, range) and abs(values.start) <= _EXACT_FLOAT_INT and abs(values.stop) <= _EXACT_FLOAT_INT:
+        return values
+    if np is not None and isinstance(values, np.ndarray) and values.ndim == 1:
+        floats = values.astype(np.float64)
+        if np.isfinite(floats).all() and (np.abs(floats) < _MAX_INT64_FLOAT).all():
+            return np.floor(floats + 0.5).astype(np.int64).tolist()
+    return [math.floor(float(v) + 0.5) for v in make_iter(values)]
+
+
+# Types of dict values which item_string caches json for. Containers may hold values which compare equal but give
+# different json, eg (True,) and (1,)
+_SCALAR_TYPES = (str, int, float, bool)
+
+
+@functools.lru_cache(maxsize=256)
+def _item_json(key):
+    return json.dumps({k: v for k, _, _, v in key})
+
+
+def item_string(item):
+    """Return item as a string suitable for minetest. Non string items are converted to json
+
+    json for dict items of scalar values is cached so that repeated builds with the same dict do not call json.dumps
+    every time
+    """
+    if isinstance(item, str):
+        return item
+    if isinstance(item, dict) and all(type(v) in _SCALAR_TYPES for v in item.values()):
+        # include types so that eg {"param2": 1} and {"param2": True} are not confused
+        return _item_json(tuple((k, type(k), type(v), v) for k, v in item.items()))
+    return json.dumps(item)
+
+
+class ItemPalette:
+    """Items numbered with small integer ids so that nodes can store an id rather than their own copy of the item
+
+    Each item is converted with item_string and interned once, so equal items share one string and grouping nodes by
+    item hashes ints rather than strings. Ids never change once given, so node dicts of ids stay valid as items are added.
+
+    reserved: items taking the first ids, eg (None,) so that id 0 can mean no node
+    max_items: raise ValueError rather than go beyond this many ids, eg to fit ids in uint16
+    """
+    def __init__(self, reserved=(), max_items=None):
+        self.items = list(reserved)
+        self.ids = {item: idx for idx, item in enumerate(self.items)}
+        self.max_items = max_items
+
+    def __len__(self):
+        return len(self.items)
+
+    def __getitem__(self, idx):
+        return self.items[idx]
+
+    def __contains__(self, item):
+        return item_string(item) in self.ids
+
+    def id(self, item):
+        """Return id of item, adding it to the palette if required"""
+        item = item_string(item)
+        idx = self.ids.get(item)
+        if idx is None:
+            if self.max_items is not None and len(self.items) >= self.max_items:
+                raise ValueError(f"Item palette full. Maximum {self.max_items} different items")
+            idx = len(self.items)
+            self.items.append(item)
+            self.ids[item] = idx
+        return idx
+
+    def copy(self):
+        palette = ItemPalette(max_items=self.max_items)
+        palette.items = list(self.items)
+        palette.ids = dict(self.ids)
+        return palette
+
+    def encode(self, node_dict):
+        """Return {(x, y, z): id} of node_dict {(x, y, z): item}"""
+        ids = {}
+        for item in set(node_dict.values()):
+            ids[item] = self.id(item)
+        return dict(zip(node_dict, map(ids.__getitem__, node_dict.values())))
+
+    def decode(self, nodes):
+        """Return node_dict {(x, y, z): item} of nodes {(x, y, z): id}"""
+        return dict(zip(nodes, map(self.items.__getitem__, nodes.values())))
+
+
+def positions(x, y, z):
+    """Iterator of integer (x, y, z) for all combinations of coordinates as used by build"""
+    return itertools.product(int_values(x), int_values(y), int_values(z))
+
+
 def build(x, y, z, item):
     """similar to MinetestConnection.set_node but stores nodes in node_dict rather than sending to minetest
 
     x, y, z: coordinates to be added to nodes. They are converted to integers so that each node has unique set of coordinates
     item: minetest item name as a string "default:glass", or json string '{"name":"default:torch", "param2":"1"}'
-    x, y, z can also be supplied as iterables eg range or list or tuple or generator
+    x, y, z can also be supplied as iterables eg range or list or tuple or generator or numpy array
 
     returns node_dict: {(x, y, z): item} Dictionary of node
     """
-    if not isinstance(item, str):
-        item = json.dumps(item)
-    node_dict = {}
-    for xi in make_iter(x):
-        for yi in make_iter(y):
-            for zi in make_iter(z):
-                node_dict[int_tuple(xi, yi, zi)] = item
-    return node_dict
+    return dict.fromkeys(positions(x, y, z), item_string(item))
 
 
 def build_cuboid(x1, y1, z1, x2, y2, z2, item):
@@ -43,93 +160,512 @@ def build_cuboid(x1, y1, z1, x2, y2, z2, item):
     return build(range(x1, x2 + step_x, step_x), range(y1, y2 + step_y, step_y), range(z1, z2 + step_z, step_z), item)
 
 
-def node_lists_with_cuboids(node_lists_flat):
-    """Finds adjacent points in node_lists_flat and converts them to cuboids for data efficiency"""
+def _greedy_cuboids(points, order):
+    """Greedy box meshing of one item's points. Returns list of (pos1, pos2) tuples with pos1 the minimum corner
+
+    points: iterable of (x, y, z) tuples
+    order: permutation of axes (0, 1, 2). Boxes grow along order[2] first, then order[1], then order[0]
+    """
+    remaining = set(points)
+    slow, mid, fast = order
+    cuboids = []
+    for start in sorted(remaining, key=lambda p: (p[slow], p[mid], p[fast])):
+        if start not in remaining:
+            continue
+        lo = list(start)
+        hi = list(start)
+        for axis in (fast, mid, slow):
+            while True:
+                # every point on the face one step beyond hi along axis must still be unclaimed
+                face_lo = lo[:]
+                face_hi = hi[:]
+                face_lo[axis] = face_hi[axis] = hi[axis] + 1
+                if not all(p in remaining for p in _box_points(face_lo, face_hi)):
+                    break
+                hi[axis] += 1
+        remaining.difference_update(_box_points(lo, hi))
+        cuboids.append((tuple(lo), tuple(hi)))
+    return cuboids
+
+
+def _box_points(lo, hi):
+    return itertools.product(range(lo[0], hi[0] + 1), range(lo[1], hi[1] + 1), range(lo[2], hi[2] + 1))
+
+
+def _first_false(values):
+    """Index of the first False in a 1d numpy bool array, or its length if all True"""
+    i = int(np.argmin(values))
+    return i if not values[i] else len(values)
+
+
+def _greedy_cuboids_mask(mask, order):
+    """_greedy_cuboids of the True cells of 3d numpy bool array mask, as (pos1, pos2) tuples of indices into mask
+
+    Claims cells by clearing them in a copy of mask, so no tuple or set is made per cell.
+    """
+    slow, mid, fast = order
+    # copy with axes in (slow, mid, fast) order so C order is the order _greedy_cuboids takes starting points in
+    remaining = mask.transpose(order).copy(order='C')
+    flat = remaining.reshape(-1)
+    size_s, size_m, size_f = remaining.shape
+    cuboids = []
+    start = 0
+    while True:
+        # cells before start are all claimed, as boxes never grow towards lower coordinates
+        start += _first_false(~flat[start:])
+        if start >= len(flat):
+            break
+        s, rest = divmod(start, size_m * size_f)
+        m, f = divmod(rest, size_f)
+        f_hi = f + _first_false(remaining[s, m, f:]) - 1
+        m_hi = m
+        while m_hi + 1 < size_m and remaining[s, m_hi + 1, f:f_hi + 1].all():
+            m_hi += 1
+        s_hi = s
+        while s_hi + 1 < size_s and remaining[s_hi + 1, m:m_hi + 1, f:f_hi + 1].all():
+            s_hi += 1
+        remaining[s:s_hi + 1, m:m_hi + 1, f:f_hi + 1] = False
+        lo = [0, 0, 0]
+        hi = [0, 0, 0]
+        lo[slow], lo[mid], lo[fast] = s, m, f
+        hi[slow], hi[mid], hi[fast] = s_hi, m_hi, f_hi
+        cuboids.append((tuple(lo), tuple(hi)))
+    return cuboids
+
+
+def cuboids_from_mask(mask, origin=(0, 0, 0), strategy="fast"):
+    """Merge the True cells of a 3d numpy bool array into cuboids as node_lists_with_cuboids does. Requires numpy
+
+    Gives the same cuboids as node_lists_with_cuboids of the positions of the cells, but uses only a copy of the mask
+    rather than a tuple per cell, so suits dense grids such as building.VoxelBuilding.
+    mask: bool array indexed [x, y, z] relative to origin
+    returns list of positions and cuboids [(x1, y1, z1), ((x2a, y2a, z2a), (x2b, y2b, z2b)), ...]
+    """
+    if strategy not in CUBOID_STRATEGIES:
+        raise ValueError(f"Unknown cuboid strategy {strategy!r}. Expected one of {CUBOID_STRATEGIES}")
+    # crop to the bounding box of the cells so sparse items don't scan the whole grid
+    bounds = []
+    for axis in range(3):
+        present = np.flatnonzero(mask.any(axis=tuple(a for a in range(3) if a != axis)))
+        if not len(present):
+            return []
+        bounds.append((int(present[0]), int(present[-1]) + 1))
+    mask = mask[bounds[0][0]:bounds[0][1], bounds[1][0]:bounds[1][1], bounds[2][0]:bounds[2][1]]
+    offset = [int(origin[axis]) + bounds[axis][0] for axis in range(3)]
+    orders = ((0, 1, 2),) if strategy == "fast" else tuple(itertools.permutations((0, 1, 2)))
+    cuboids = None
+    for order in orders:
+        candidate = _greedy_cuboids_mask(mask, order)
+        if cuboids is None or len(candidate) < len(cuboids):
+            cuboids = candidate
+    if strategy != "fast":
+        cuboids.sort()
+    ox, oy, oz = offset
+    list_pos = []
+    for (x1, y1, z1), (x2, y2, z2) in cuboids:
+        pos1 = (x1 + ox, y1 + oy, z1 + oz)
+        list_pos.append(pos1 if (x1, y1, z1) == (x2, y2, z2) else (pos1, (x2 + ox, y2 + oy, z2 + oz)))
+    return list_pos
+
+
+def node_lists_with_cuboids(node_lists_flat, strategy="fast"):
+    """Finds adjacent points in node_lists_flat and converts them to cuboids for data efficiency
+
+    node_lists_flat: {'item1': [(x1, y1, z1), (x2, y2, z2), ...], 'item2': [...]}
+    strategy: "fast" grows boxes along z then y then x in a single greedy pass.
+              "fewest" runs the greedy pass for all six axis orders and keeps the one with fewest cuboids per item.
+
+    returns node_lists: {'item1': [(x1, y1, z1), ((x2a, y2a, z2a), (x2b, y2b, z2b)), ...], 'item2': [...]}
+    """
+    if strategy not in CUBOID_STRATEGIES:
+        raise ValueError(f"Unknown cuboid strategy {strategy!r}. Expected one of {CUBOID_STRATEGIES}")
+    orders = ((0, 1, 2),) if strategy == "fast" else tuple(itertools.permutations((0, 1, 2)))
     node_lists = {}
     for item, v in node_lists_flat.items():
-        node_lists[item] = []
-        # v is a list of singular tuples for given item
-        # vs is sorted in ascending order
-        vs = sorted(v)
-        # look for consecutive blocks in x then y then z
-        while len(vs) > 0:
-            start_x, start_y, start_z = vs[0]
-            dx, dy, dz = 0, 0, 0
-            tfx, tfy, tfz = True, True, True
-            while tfx or tfy or tfz:
-                if tfx:
-                    x = start_x+dx+1
-                    for y in range(start_y, start_y+dy+1):
-                        for z in range(start_z, start_z+dz+1):
-                            if not (x, y, z) in vs:
-                                tfx = False
-                    if tfx:
-                        dx += 1
-                if tfy:
-                    y = start_y+dy+1
-                    for x in range(start_x, start_x+dx+1):
-                        for z in range(start_z, start_z+dz+1):
-                            if not (x, y, z) in vs:
-                                tfy = False
-                    if tfy:
-                        dy += 1
-                if tfz:
-                    z = start_z+dz+1
-                    for x in range(start_x, start_x+dx+1):
-                        for y in range(start_y, start_y+dy+1):
-                            if not (x, y, z) in vs:
-                                tfz = False
-                    if tfz:
-                        dz += 1
-            if dx == 0 and dy == 0 and dz == 0:
-                node_lists[item].append((start_x, start_y, start_z))
-            else:
-                node_lists[item].append(((start_x, start_y, start_z), (start_x+dx, start_y+dy, start_z+dz)))
-            for x in range(start_x, start_x+dx+1):
-                for y in range(start_y, start_y+dy+1):
-                    for z in range(start_z, start_z+dz+1):
-                        vs.remove((x, y, z))
+        cuboids = None
+        for order in orders:
+            candidate = _greedy_cuboids(v, order)
+            if cuboids is None or len(candidate) < len(cuboids):
+                cuboids = candidate
+        if strategy != "fast":
+            # keep output in the same ascending order as the fast strategy
+            cuboids.sort()
+        node_lists[item] = [pos1 if pos1 == pos2 else (pos1, pos2) for pos1, pos2 in cuboids]
     return node_lists
 
 
-def node_lists_from_node_dict(node_dict):
-    """Convert node_dict to node_lists"""
+def node_lists_flat(node_dict, palette=None):
+    """Group positions of node_dict by item without merging: {'item1': [(x1, y1, z1), ...], 'item2': [...]}
+
+    palette: ItemPalette if the values of node_dict are its ids rather than items
+    """
+    if palette is not None:
+        # ids index straight into a list so no hashing per node
+        lists = [[] for _ in range(len(palette))]
+        appends = [list_pos.append for list_pos in lists]
+        for pos, idx in node_dict.items():
+            appends[idx](pos)
+        return {palette[idx]: list_pos for idx, list_pos in enumerate(lists) if list_pos}
     node_lists = {}
+    appends = {}
     for pos, item in node_dict.items():
-        if item not in node_lists:
-            node_lists[item] = []
-        node_lists[item].append(pos)
-    return node_lists_with_cuboids(node_lists)
+        try:
+            appends[item](pos)
+        except KeyError:
+            list_pos = node_lists[item] = [pos]
+            appends[item] = list_pos.append
+    return node_lists
 
 
-def send_node_lists(mc, node_lists, end_list=()):
-    """ Send node_lists to minetest. Should send air after walls so no lava and water flow in
+def node_lists_from_node_dict(node_dict, strategy="fast", palette=None):
+    """Convert node_dict to node_lists
+
+    strategy: cuboid merging strategy passed to node_lists_with_cuboids, "fast" or "fewest"
+    palette: ItemPalette if the values of node_dict are its ids rather than items
+    """
+    return node_lists_with_cuboids(node_lists_flat(node_dict, palette), strategy)
+
+
+def ordered_items(node_lists, end_list=()):
+    """Return items of node_lists in the order they should be sent, with items starting with end_list entries last
 
-    mc : MinetestConnection object
-    node_lists : { 'item1':[(x1,y1,z1), ((x2a,y2a,z2a),(x2b,y2b,z2b)), ...], 'item2':[...]}
     end_list : ('air', 'door:')
     """
     item_list = list(node_lists.keys())
     # Convert end_list to iterable in the case only a string was provided
-    try:
-        end_list = iter(end_list)
-    except TypeError:
+    if isinstance(end_list, str):
         end_list = end_list,
     for item in end_list:
-        for key in item_list:
+        for key in list(item_list):
             if key.find(item) == 0:
                 item_list.remove(key)
                 item_list.append(key)
-    for item in item_list:
-        mc.set_node_list(node_lists[item], item)
+    return item_list
+
+
+def morton(x, y, z):
+    """Morton (z-order) code interleaving the bits of non-negative integers x, y, z
+
+    Codes never decrease as any coordinate increases, and positions close together mostly have codes close together
+    """
+    code = 0
+    bit = 0
+    while x or y or z:
+        code |= (x & 1) << bit | (y & 1) << (bit + 1) | (z & 1) << (bit + 2)
+        x >>= 1
+        y >>= 1
+        z >>= 1
+        bit += 3
+    return code
 
 
-def send_node_dict(mc, node_dict, end_list=()):
+def region_morton(key):
+    """Morton code of a region or mapblock key (x, y, z), which may be negative, for sorting regions in morton order"""
+    return morton(key[0] + _MORTON_OFFSET, key[1] + _MORTON_OFFSET, key[2] + _MORTON_OFFSET)
+
+
+def schedule_node_lists(node_lists, end_list=(), region_size=MAPBLOCK_SIZE, min_entries=SCHEDULE_MIN_ENTRIES):
+    """Order node_lists for sending region by region, so minetest loads and saves each mapblock as few times as possible
+
+    Cuboids are grouped by the mapblock, or cube of region_size nodes, they start in. Mapblocks are taken in morton
+    order and consecutive mapblocks are combined into one region until it holds at least min_entries positions and
+    cuboids, so that regions are compact but still fill set_node_list commands. Within each region items are sent in
+    ordered_items order, so items starting with end_list entries are last. Cuboids are never split.
+
+    Cuboids of end_list items belong to the mapblock of their maximum corner and other cuboids to the mapblock of their
+    minimum corner. As morton order never decreases along any axis, an end_list cuboid is sent after every other cuboid
+    sharing any of the mapblocks it covers, so air is still sent after the walls around it.
+
+    node_lists : { 'item1':[(x1,y1,z1), ((x2a,y2a,z2a),(x2b,y2b,z2b)), ...], 'item2':[...]}
+    end_list : ('air', 'door:')
+    region_size : edge length in nodes of the cubes regions are made of. None sends each item once in ordered_items order
+    min_entries : positions and cuboids in a region before starting the next
+    returns list of (item, list_pos) in the order they should be sent
+    """
+    items = ordered_items(node_lists, end_list)
+    if region_size is None:
+        return [(item, node_lists[item]) for item in items if node_lists[item]]
+    if isinstance(end_list, str):
+        end_list = end_list,
+    # block key => {item: [pos, ...]} filled in ordered_items order
+    blocks = {}
+    for item in items:
+        corner = 1 if any(item.find(end) == 0 for end in end_list) else 0
+        for pos in node_lists[item]:
+            p = pos[corner] if payload.is_cuboid(pos) else pos
+            key = (p[0] // region_size, p[1] // region_size, p[2] // region_size)
+            block = blocks.get(key)
+            if block is None:
+                block = blocks[key] = {}
+            list_pos = block.get(item)
+            if list_pos is None:
+                list_pos = block[item] = []
+            list_pos.append(pos)
+    schedule = []
+    region = {}
+    entries = 0
+    for key in sorted(blocks, key=region_morton):
+        for item, list_pos in blocks[key].items():
+            region.setdefault(item, []).extend(list_pos)
+            entries += len(list_pos)
+        if entries >= min_entries:
+            schedule.extend(_region_items(region, items))
+            region = {}
+            entries = 0
+    schedule.extend(_region_items(region, items))
+    return schedule
+
+
+def _region_items(region, items):
+    """(item, list_pos) of region in the order of items"""
+    if len(region) < 2:
+        return list(region.items())
+    return [(item, region[item]) for item in items if item in region]
+
+
+def send_node_lists(mc, node_lists, end_list=(), region_size=MAPBLOCK_SIZE):
+    """ Send node_lists to minetest. Should send air after walls so no lava and water flow in
+
+    mc : MinetestConnection object
+    node_lists : { 'item1':[(x1,y1,z1), ((x2a,y2a,z2a),(x2b,y2b,z2b)), ...], 'item2':[...]}
+    end_list : ('air', 'door:')
+    region_size : send region by region as scheduled by schedule_node_lists. None sends each item in one go
+    """
+    for item, list_pos in schedule_node_lists(node_lists, end_list, region_size):
+        mc.set_node_list(list_pos, item)
+
+
+def send_node_dict(mc, node_dict, end_list=(), strategy="fast", palette=None, region_size=MAPBLOCK_SIZE):
     """Convert node_dict to node_lists and send to minetest
 
     mc : MinetestConnection object
     node_dict : { (x1,y1,z1):'item1', (x2,y2,z2):'item2', ...}
     end_list : ('air', 'door:')
+    strategy : cuboid merging strategy "fast" or "fewest"
+    palette : ItemPalette if the values of node_dict are its ids rather than items
+    region_size : passed to send_node_lists
+    """
+    with metrics.timed(getattr(mc, "metrics", None), "merge"):
+        node_lists = node_lists_from_node_dict(node_dict, strategy, palette)
+    send_node_lists(mc, node_lists, end_list, region_size)
+
+
+class SendPlan:
+    """set_node_list commands planned without a connection, in the order they will be sent, and what they will cost
+
+    Created by plan_node_dict or plan_node_lists and sent with send_plan. A plan can be saved and loaded so it is only
+    made once, eg while trying strategies before a long build.
+
+    steps: list of (item, list_pos, commands, batch_stats) where commands are encoded from list_pos by
+           payload.node_list_commands and batch_stats holds (entries, raw bytes, compressed bytes) of each command
+    version: set_node_list payload version of the commands
+    mtbotnick: nick commands are sent to, which is part of every line sent so counts towards its bytes
+    """
+    def __init__(self, steps, version=payload.NODE_LIST_VERSION_2, mtbotnick="mtserver"):
+        self.steps = steps
+        self.version = version
+        self.mtbotnick = mtbotnick
+
+    def __len__(self):
+        return sum(len(commands) for _, _, commands, _ in self.steps)
+
+    @property
+    def commands(self):
+        """Every command in the order sent"""
+        return [command for _, _, commands, _ in self.steps for command in commands]
+
+    def line_bytes(self):
+        """List for each step of bytes of the IRC line sending each command, as counted by flood control"""
+        prefix = len(f"PRIVMSG {self.mtbotnick} : cmd ".encode('utf-8'))
+        return [[prefix + len(command.encode('utf-8')) for command in commands] for _, _, commands, _ in self.steps]
+
+    def stats(self):
+        """Dict of lines and bytes sent, nodes set and compression, in total and per item"""
+        items = {}
+        raw_bytes = compressed_bytes = 0
+        for item, list_pos, commands, batch_stats in self.steps:
+            s = items.get(item)
+            if s is None:
+                s = items[item] = {'cuboids': 0, 'positions': 0, 'nodes': 0, 'commands': 0}
+            cuboids = sum(1 for pos in list_pos if payload.is_cuboid(pos))
+            s['cuboids'] += cuboids
+            s['positions'] += len(list_pos) - cuboids
+            s['nodes'] += payload.node_count(list_pos)
+            s['commands'] += len(commands)
+            raw_bytes += sum(raw for _, raw, _ in batch_stats)
+            compressed_bytes += sum(compressed for _, _, compressed in batch_stats)
+        lines = len(self)
+        return {
+            'lines': lines,
+            # each line is sent with a line feed
+            'bytes': sum(map(sum, self.line_bytes())) + lines,
+            'nodes': sum(s['nodes'] for s in items.values()),
+            'raw_bytes': raw_bytes,
+            'compressed_bytes': compressed_bytes,
+            'compression_ratio': raw_bytes / compressed_bytes if compressed_bytes else None,
+            'items': items,
+        }
+
+    def estimate(self, flood_control=None, rtt=0.0, window=1):
+        """Estimated seconds to send the plan with send_plan. See floodcontrol.estimate_send_time
+
+        flood_control: floodcontrol.FloodControl the connection will use. Defaults to FloodControl()
+        rtt: seconds from sending a command until its reply arrives
+        window: MinetestConnection.pipeline_window of the connection
+        """
+        return floodcontrol.estimate_send_time(self.line_bytes(), flood_control, rtt, window)
+
+    def split(self, max_seconds, flood_control=None, rtt=0.0, window=1):
+        """Split into plans each estimated to take no more than max_seconds, eg to send in separate time windows
+
+        Plans are split between steps so each part is sent in order. A step longer than max_seconds is a part of its own
+        """
+        parts = []
+        steps = []
+        for step in self.steps:
+            if steps and SendPlan(steps + [step], self.version, self.mtbotnick).estimate(
+                    flood_control, rtt, window) > max_seconds:
+                parts.append(SendPlan(steps, self.version, self.mtbotnick))
+                steps = []
+            steps.append(step)
+        if steps:
+            parts.append(SendPlan(steps, self.version, self.mtbotnick))
+        return parts
+
+    def save(self, path):
+        """Save plan to json file path"""
+        with open(path, "w", encoding='utf-8') as f:
+            json.dump({'version': self.version, 'mtbotnick': self.mtbotnick, 'steps': self.steps}, f)
+
+    @classmethod
+    def load(cls, path):
+        """Load a plan saved by save()"""
+        with open(path, encoding='utf-8') as f:
+            d = json.load(f)
+        steps = []
+        for item, list_pos, commands, batch_stats in d['steps']:
+            list_pos = [tuple(map(tuple, pos)) if isinstance(pos[0], list) else tuple(pos) for pos in list_pos]
+            steps.append((item, list_pos, commands, [tuple(stats) for stats in batch_stats]))
+        return cls(steps, d['version'], d['mtbotnick'])
+
+
+def plan_node_lists(node_lists, end_list=(), region_size=MAPBLOCK_SIZE, version=payload.NODE_LIST_VERSION_2,
+                    mtbotnick="mtserver"):
+    """SendPlan of the commands send_node_lists would send, without a connection
+
+    version: set_node_list payload version. NODE_LIST_VERSION_2 is negotiated with irc_builder mod 0.0.9 or later.
+             Plan with NODE_LIST_VERSION_1 to send to older mods
+    mtbotnick: nick the plan will be sent to
+    """
+    steps = []
+    for item, list_pos in schedule_node_lists(node_lists, end_list, region_size):
+        batch_stats = []
+        commands = payload.node_list_commands(list_pos, item, version=version, batch_stats=batch_stats)
+        steps.append((item, list_pos, commands, batch_stats))
+    return SendPlan(steps, version, mtbotnick)
+
+
+def plan_node_dict(node_dict, end_list=(), strategy="fast", palette=None, region_size=MAPBLOCK_SIZE,
+                   version=payload.NODE_LIST_VERSION_2, mtbotnick="mtserver"):
+    """SendPlan of the commands send_node_dict would send, without a connection
+
+    Merges node_dict into cuboids and encodes them, so compare strategies by their plans' stats() and estimate().
+    Other arguments are as for send_node_dict and plan_node_lists
+
+    Example:
+
+    plan = nodebuilder.plan_node_dict(node_dict, end_list=("air",), strategy="fewest")
+    print(plan.stats()['lines'], plan.estimate(floodcontrol.FloodControl(burst=10, rate=10.0), rtt=0.2, window=4))
+    nodebuilder.send_plan(mc, plan)
+    """
+    return plan_node_lists(node_lists_from_node_dict(node_dict, strategy, palette), end_list, region_size, version,
+                           mtbotnick)
+
+
+def send_plan(mc, plan, window=None):
+    """Send the commands of a SendPlan to minetest
+
+    mc : MinetestConnection object
+    window : maximum set_node_list batches awaiting replies. Defaults to mc.pipeline_window
+    Raises ValueError if the irc_builder mod doesn't support the payload version of the plan
+    """
+    if mc.node_list_version is None:
+        mc.negotiate_node_list_version()
+    if plan.version > mc.node_list_version:
+        raise ValueError(f"Plan uses set_node_list payload version {plan.version} but minetest only supports "
+                         f"version {mc.node_list_version}. Plan again with version={mc.node_list_version}")
+    for item, list_pos, commands, batch_stats in plan.steps:
+        mc.send_node_list_commands(commands, list_pos, item, batch_stats, window)
+
+
+class NodeSnapshot:
+    """Compact record of the nodes last sent to minetest, used to send only what has changed since
+
+    Positions are packed into single ints and items into small palette ids, so a snapshot uses much less memory
+    than a copy of the node dict. Coordinates must be within +/- SNAPSHOT_MAX_COORD, well beyond the minetest world.
+
+    palette: ItemPalette shared with a building whose nodes are stored as ids. Node dicts passed to diff and update
+             then hold ids of palette rather than items, and so does the delta returned by diff
     """
-    node_lists = node_lists_from_node_dict(node_dict)
-    send_node_lists(mc, node_lists, end_list)
+    def __init__(self, palette=None):
+        self.shared = palette is not None
+        self.palette = palette if self.shared else ItemPalette()
+        self.nodes = {}
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def clear(self):
+        if not self.shared:
+            self.palette = ItemPalette()
+        self.nodes = {}
+
+    @staticmethod
+    def pack(pos):
+        x, y, z = pos
+        if not (-SNAPSHOT_MAX_COORD <= x < SNAPSHOT_MAX_COORD and -SNAPSHOT_MAX_COORD <= y < SNAPSHOT_MAX_COORD
+                and -SNAPSHOT_MAX_COORD <= z < SNAPSHOT_MAX_COORD):
+            raise ValueError(f"Position {pos} outside range supported by NodeSnapshot")
+        return ((x + SNAPSHOT_MAX_COORD) << 42) | ((y + SNAPSHOT_MAX_COORD) << 21) | (z + SNAPSHOT_MAX_COORD)
+
+    @staticmethod
+    def unpack(key):
+        mask = (1 << 21) - 1
+        return (key >> 42) - SNAPSHOT_MAX_COORD, ((key >> 21) & mask) - SNAPSHOT_MAX_COORD, (key & mask) - SNAPSHOT_MAX_COORD
+
+    def diff(self, node_dict, removed_item="air"):
+        """Return node dict of nodes in node_dict which are new or changed since snapshot, plus removed_item at
+        positions in snapshot which are no longer in node_dict. Positions last sent as removed_item are not repeated
+        """
+        delta = {}
+        matched = 0
+        # with a shared palette node_dict values are ids so compare them directly
+        items = None if self.shared else self.palette.items
+        for pos, item in node_dict.items():
+            idx = self.nodes.get(self.pack(pos))
+            if idx is None:
+                delta[pos] = item
+            else:
+                matched += 1
+                if (idx if items is None else items[idx]) != item:
+                    delta[pos] = item
+        if matched < len(self.nodes):
+            # some positions in snapshot are no longer in node_dict
+            if self.shared:
+                removed = removed_idx = self.palette.id(removed_item)
+            else:
+                removed = removed_item
+                removed_idx = self.palette.ids.get(removed_item)
+            for key, idx in self.nodes.items():
+                if idx != removed_idx:
+                    pos = self.unpack(key)
+                    if pos not in node_dict:
+                        delta[pos] = removed
+        return delta
+
+    def update(self, node_dict):
+        """Replace snapshot with node_dict which has just been sent"""
+        if self.shared:
+            self.nodes = {self.pack(pos): idx for pos, idx in node_dict.items()}
+        else:
+            self.nodes = {self.pack(pos): self.palette.id(item) for pos, item in node_dict.items()}
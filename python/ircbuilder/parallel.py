@@ -0,0 +1,123 @@
+"""Merging and encoding node dicts in a process pool while sending them, so CPU work overlaps with IRC transmission
+
+The node dict is partitioned by item and by groups of regions in morton order, as nodebuilder.schedule_node_lists
+orders cuboids. A worker process merges each part into cuboids and encodes them as set_node_list commands. Parts are
+sent in order, each as soon as it is ready, while workers carry on with later parts. Cuboids never cross groups, so
+items in end_list are still sent after all other items of their group.
+
+Worker processes are started with forkserver, or spawn where forkserver isn't available such as on Windows, rather
+than forked from a process whose receive and sender threads may be holding locks. The program sending must therefore
+be guarded by if __name__ == "__main__":
+
+Example:
+
+import ircbuilder.parallel
+with ircbuilder.open_irc('irc.triptera.com.au', 'mtuser', 'mtuserpass', 'mtbotnick', '#pythonator') as mc:
+    ircbuilder.parallel.send_node_dict(mc, b.nodes, end_list=('air',), palette=b.palette, workers=4)
+"""
+import concurrent.futures
+import multiprocessing
+
+from ircbuilder import metrics
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+# Edge length in nodes of the regions node dicts are partitioned into. A multiple of nodebuilder.MAPBLOCK_SIZE
+PARALLEL_REGION_SIZE = 2 * nodebuilder.MAPBLOCK_SIZE
+# Nodes in each group of regions given to workers
+PARALLEL_MIN_NODES = 4096
+# How worker processes are started. Forking copies locks held by other threads, which can deadlock the workers
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+
+def partition(node_dict, end_list=(), palette=None, region_size=PARALLEL_REGION_SIZE, min_nodes=PARALLEL_MIN_NODES):
+    """Split node_dict into parts [(item, [(x, y, z), ...]), ...] in the order they should be sent
+
+    Regions are taken in morton order and consecutive regions are combined until they hold at least min_nodes nodes,
+    so sparse builds still give parts big enough to fill set_node_list commands. Within each group of regions there is
+    one part per item, in ordered_items order so items starting with end_list entries are last.
+    palette: nodebuilder.ItemPalette if the values of node_dict are its ids rather than items
+    """
+    # region key => {item: [pos, ...]}
+    regions = {}
+    appends = {}
+    for pos, item in node_dict.items():
+        key = (pos[0] // region_size, pos[1] // region_size, pos[2] // region_size, item)
+        try:
+            appends[key](pos)
+        except KeyError:
+            region = regions.get(key[:3])
+            if region is None:
+                region = regions[key[:3]] = {}
+            list_pos = region[item] = [pos]
+            appends[key] = list_pos.append
+    if palette is not None:
+        regions = {key: {palette[idx]: list_pos for idx, list_pos in region.items()} for key, region in regions.items()}
+    items = nodebuilder.ordered_items({item: None for region in regions.values() for item in region}, end_list)
+    parts = []
+    group = {}
+    nodes = 0
+    for key in sorted(regions, key=nodebuilder.region_morton):
+        for item, list_pos in regions[key].items():
+            group.setdefault(item, []).extend(list_pos)
+            nodes += len(list_pos)
+        if nodes >= min_nodes:
+            parts.extend((item, group[item]) for item in items if item in group)
+            group = {}
+            nodes = 0
+    parts.extend((item, group[item]) for item in items if item in group)
+    return parts
+
+
+def merge_encode(item, points, strategy, version):
+    """Merge points of one item into cuboids and encode them as set_node_list commands. Runs in a worker process
+
+    returns (list_pos, commands, batch_stats) ready for MinetestConnection.send_node_list_commands
+    """
+    list_pos = nodebuilder.node_lists_with_cuboids({item: points}, strategy)[item]
+    batch_stats = []
+    commands = payload.node_list_commands(list_pos, item, version=version, batch_stats=batch_stats)
+    return list_pos, commands, batch_stats
+
+
+def send_node_dict(mc, node_dict, end_list=(), strategy="fast", palette=None, workers=None,
+                   region_size=PARALLEL_REGION_SIZE, min_nodes=PARALLEL_MIN_NODES, executor=None):
+    """Merge and encode node_dict in a process pool while sending it to minetest
+
+    mc : MinetestConnection object
+    node_dict : { (x1,y1,z1):'item1', (x2,y2,z2):'item2', ...}
+    end_list : ('air', 'door:')
+    strategy : cuboid merging strategy "fast" or "fewest"
+    palette : nodebuilder.ItemPalette if the values of node_dict are its ids rather than items
+    workers : processes in the pool. Defaults to the number of CPUs
+    region_size, min_nodes : size of the regions and groups of regions node_dict is partitioned into, see partition.
+                             Smaller parts are ready to send sooner but split more cuboids at their boundaries
+    executor : concurrent.futures executor to use rather than starting a process pool, eg to reuse one between sends
+    returns list of set_node_list results in the order sent
+    """
+    if mc.node_list_version is None:
+        mc.negotiate_node_list_version()
+    mc_metrics = getattr(mc, "metrics", None)
+    with metrics.timed(mc_metrics, "partition"):
+        parts = partition(node_dict, end_list, palette, region_size, min_nodes)
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context(START_METHOD))
+    futures = []
+    try:
+        # submit in sending order so the parts needed first are ready first
+        for item, points in parts:
+            futures.append((item, executor.submit(merge_encode, item, points, strategy, mc.node_list_version)))
+        # workers have their own copies of the points now
+        del parts
+        results = []
+        for item, future in futures:
+            with metrics.timed(mc_metrics, "wait_workers"):
+                list_pos, commands, batch_stats = future.result()
+            results.append(mc.send_node_list_commands(commands, list_pos, item, batch_stats))
+        return results
+    finally:
+        for _, future in futures:
+            future.cancel()
+        if own_executor:
+            executor.shutdown()
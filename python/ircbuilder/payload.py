@@ -0,0 +1,308 @@
+import base64
+import logging
+import math
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Maximum length of a command sent to mtbotnick so that the PRIVMSG fits in one IRC line
+MAX_CMD_LEN = 400
+# set_node_list payload versions. 1 is zlib compressed text "|x,y,z|x1,y1,z1 x2,y2,z2|" for set_node_list.
+# 2 is zlib compressed delta and varint binary for set_node_list2 which requires irc_builder mod 0.0.9 or later
+NODE_LIST_VERSION_1 = 1
+NODE_LIST_VERSION_2 = 2
+
+
+def str_pos(pos):
+    """Format position (x, y, z) as "x,y,z" rounding to nearest integer"""
+    return ",".join(str(math.floor(c + 0.5)) for c in pos)
+
+
+def is_cuboid(pos):
+    return len(pos) == 2 and len(pos[0]) == 3 and len(pos[1]) == 3
+
+
+def node_count(list_pos):
+    """Number of nodes in list of positions and cuboids"""
+    count = 0
+    for pos in list_pos:
+        if is_cuboid(pos):
+            count += (abs(pos[1][0] - pos[0][0]) + 1) * (abs(pos[1][1] - pos[0][1]) + 1) * (abs(pos[1][2] - pos[0][2]) + 1)
+        else:
+            count += 1
+    return count
+
+
+def node_list_text(pos):
+    """Text for one position or cuboid in a set_node_list payload, including trailing separator"""
+    if is_cuboid(pos):
+        return str_pos(pos[0]) + " " + str_pos(pos[1]) + "|"
+    return str_pos(pos) + "|"
+
+
+def encode_node_list(list_pos):
+    """Encode positions and cuboids as zlib compressed base64 text understood by set_node_list in init.lua
+
+    list_pos: [(x1, y1, z1), ((x2a, y2a, z2a), (x2b, y2b, z2b)), ...]
+    """
+    s = '|' + ''.join(node_list_text(pos) for pos in list_pos)
+    return base64.standard_b64encode(zlib.compress(s.encode('utf-8'))).decode('utf-8')
+
+
+def cuboid_corners(pos):
+    """Return (min corner, max corner) of a position or cuboid with coordinates rounded to integers"""
+    if is_cuboid(pos):
+        p1 = [math.floor(c + 0.5) for c in pos[0]]
+        p2 = [math.floor(c + 0.5) for c in pos[1]]
+        return (min(p1[0], p2[0]), min(p1[1], p2[1]), min(p1[2], p2[2])), (max(p1[0], p2[0]), max(p1[1], p2[1]), max(p1[2], p2[2]))
+    p = tuple(math.floor(c + 0.5) for c in pos)
+    return p, p
+
+
+def _varint(n, out):
+    """Append unsigned integer n to bytearray out as LEB128 varint, 7 bits per byte, least significant first"""
+    while n >= 0x80:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _zigzag(n):
+    """Map signed integer to unsigned so that small magnitudes give short varints. 0, -1, 1, -2 => 0, 1, 2, 3"""
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+
+def encode_node_list2_raw(corners):
+    """Encode cuboids as the uncompressed binary payload of set_node_list2
+
+    corners: list of (min corner, max corner) tuples, preferably sorted so consecutive deltas are small
+    Format, all integers varints:
+      version byte 2
+      zigzag origin x, y, z, being the minimum corner of all cuboids
+      per cuboid: zigzag(dx) * 2 + is_cuboid, zigzag(dy), zigzag(dz), then if is_cuboid the extents x, y, z
+      where d is the difference between this cuboid's min corner and the previous one's, starting from origin
+    """
+    out = bytearray([NODE_LIST_VERSION_2])
+    if not corners:
+        return bytes(out)
+    origin = [min(lo[axis] for lo, _ in corners) for axis in range(3)]
+    for c in origin:
+        _varint(_zigzag(c), out)
+    prev = origin
+    for lo, hi in corners:
+        cuboid = 1 if lo != hi else 0
+        _varint(_zigzag(lo[0] - prev[0]) * 2 + cuboid, out)
+        _varint(_zigzag(lo[1] - prev[1]), out)
+        _varint(_zigzag(lo[2] - prev[2]), out)
+        if cuboid:
+            _varint(hi[0] - lo[0], out)
+            _varint(hi[1] - lo[1], out)
+            _varint(hi[2] - lo[2], out)
+        prev = lo
+    return bytes(out)
+
+
+def _read_varint(data, i):
+    n = 0
+    shift = 0
+    while True:
+        if i >= len(data):
+            raise ValueError("truncated payload")
+        b = data[i]
+        i += 1
+        n |= (b & 0x7f) << shift
+        shift += 7
+        if b < 0x80:
+            return n, i
+
+
+def _unzigzag(n):
+    return n >> 1 if n % 2 == 0 else -((n + 1) >> 1)
+
+
+def decode_node_list2_raw(data):
+    """Decode binary payload of set_node_list2 into list of (min corner, max corner) tuples"""
+    if not data or data[0] != NODE_LIST_VERSION_2:
+        # same message as the mod's decoder
+        raise ValueError(f"payload version {data[0] if data else None} not supported")
+    corners = []
+    i = 1
+    if len(data) == 1:
+        return corners
+    prev = []
+    for _ in range(3):
+        n, i = _read_varint(data, i)
+        prev.append(_unzigzag(n))
+    while i < len(data):
+        head, i = _read_varint(data, i)
+        dy, i = _read_varint(data, i)
+        dz, i = _read_varint(data, i)
+        lo = (prev[0] + _unzigzag(head >> 1), prev[1] + _unzigzag(dy), prev[2] + _unzigzag(dz))
+        if head & 1:
+            ex, i = _read_varint(data, i)
+            ey, i = _read_varint(data, i)
+            ez, i = _read_varint(data, i)
+            corners.append((lo, (lo[0] + ex, lo[1] + ey, lo[2] + ez)))
+        else:
+            corners.append((lo, lo))
+        prev = lo
+    return corners
+
+
+def decode_node_list(b64):
+    """Decode a version 1 set_node_list payload into list of (min corner, max corner) tuples"""
+    text = zlib.decompress(base64.standard_b64decode(b64)).decode('utf-8')
+    corners = []
+    for entry in text.split('|'):
+        if entry:
+            pos = tuple(tuple(int(c) for c in s.split(',')) for s in entry.split())
+            corners.append(cuboid_corners(pos[0] if len(pos) == 1 else pos))
+    return corners
+
+
+def decode_node_list2(b64):
+    """Decode a version 2 set_node_list2 payload into list of (min corner, max corner) tuples"""
+    return decode_node_list2_raw(zlib.decompress(base64.standard_b64decode(b64)))
+
+
+def node_list_commands(list_pos, item, max_len=MAX_CMD_LEN, version=NODE_LIST_VERSION_1, batch_stats=None):
+    """Split list_pos into set_node_list commands each no longer than max_len characters
+
+    Each batch is packed with as many positions as fit, found by galloping then binary search on the batch size,
+    so every position is compressed only a few times and every command except the last is close to max_len.
+
+    list_pos: [(x1, y1, z1), ((x2a, y2a, z2a), (x2b, y2b, z2b)), ...]
+    item: minetest item name or json string
+    version: NODE_LIST_VERSION_1 for "set_node_list" text payloads understood by all versions of init.lua
+             NODE_LIST_VERSION_2 for "set_node_list2" delta and varint payloads. Positions are sorted before packing
+    batch_stats: optional list to which (entries, raw bytes, compressed bytes) is appended for each command
+    returns list of command strings "set_node_list b64 item" or "set_node_list2 b64 item"
+    """
+    if version == NODE_LIST_VERSION_1:
+        prefix = "set_node_list "
+        texts = [node_list_text(pos) for pos in list_pos]
+
+        def raw_batch(beg, end):
+            return ('|' + ''.join(texts[beg:end])).encode('utf-8')
+
+        def zipped_batch(beg, end):
+            return zlib.compress(raw_batch(beg, end))
+    elif version == NODE_LIST_VERSION_2:
+        prefix = "set_node_list2 "
+        texts = sorted(cuboid_corners(pos) for pos in list_pos)
+
+        def raw_batch(beg, end):
+            return encode_node_list2_raw(texts[beg:end])
+
+        def zipped_batch(beg, end):
+            return zlib.compress(raw_batch(beg, end), 9)
+    else:
+        raise ValueError(f"Unknown set_node_list payload version {version!r}")
+    suffix = " " + item
+    # base64 encodes each 3 bytes as 4 characters
+    max_zipped = (max_len - len(prefix) - len(suffix)) // 4 * 3
+    commands = []
+    beg = 0
+    guess = 64
+    while beg < len(texts) or not commands:
+        remaining = len(texts) - beg
+        # largest batch size known to fit, its compressed payload, and smallest size known not to fit
+        good, good_zipped, bad = 0, None, remaining + 1
+        size = max(1, min(guess, remaining))
+        while bad - good > 1:
+            zipped = zipped_batch(beg, beg + size)
+            if len(zipped) <= max_zipped:
+                good, good_zipped = size, zipped
+                # gallop upwards until a size doesn't fit
+                size = min(size * 2, remaining) if bad > remaining else (good + bad) // 2
+                if size == good:
+                    break
+            else:
+                bad = size
+                size = (good + bad) // 2
+        if good_zipped is None:
+            if remaining == 0:
+                good_zipped = zipped_batch(beg, beg)
+            else:
+                raise ValueError(f"set_node_list command for item {item[:40]!r} can't fit in {max_len} characters")
+        commands.append(prefix + base64.standard_b64encode(good_zipped).decode('utf-8') + suffix)
+        if batch_stats is not None:
+            batch_stats.append((good, len(raw_batch(beg, beg + good)), len(good_zipped)))
+        logger.debug(f"node_list_commands: Batch {len(commands)} from {beg} to {beg + good} len {len(commands[-1])}")
+        beg += good
+        guess = max(good, 1)
+    return commands
+
+
+def reply_count(reply, item=None):
+    """Count of nodes set from a reply "item count", or None if reply is missing or an error
+
+    item: item text the command was sent with. Successful replies start with it, so error replies which also end in a
+          number, eg "protected 0" from set_node, are only rejected when item is given
+    """
+    try:
+        reply_item, count = reply.rsplit(' ', maxsplit=1)
+        if item is not None and reply_item != item:
+            return None
+        return int(count)
+    except (AttributeError, ValueError):
+        return None
+
+
+def set_node_list_result(replies, item=None):
+    """Combine replies to set_node_list batches into a single "item count [errors]" string
+
+    replies: list of reply strings, "item count", or None for batches which timed out
+    item: item text the batches were sent with, so error replies ending in a number are reported as errors
+    """
+    str_error = ''
+    str_item = ''
+    count = 0
+    for ret in replies:
+        if ret is None:
+            continue
+        n = reply_count(ret, item)
+        if n is None:
+            str_error += " [" + ret + "]"
+            continue
+        count += n
+        # item may be json containing spaces so count is after last space
+        reply_item = ret.rsplit(' ', maxsplit=1)[0]
+        if reply_item not in str_item:
+            str_item += reply_item + " "
+    return str_item + str(count) + str_error
+
+
+def parse_chunk(reply):
+    """Split a chunked reply "chunk id n total data" into (id, n, total, data), or None if reply is not a chunk"""
+    try:
+        word, chunk_id, n, total, data = reply.split(' ')
+        if word == "chunk":
+            return int(chunk_id), int(n), int(total), data
+    except (AttributeError, ValueError):
+        pass
+    return None
+
+
+def decode_chunks(chunks):
+    """Join base64 data of all chunks of a reply and decompress into text"""
+    return zlib.decompress(base64.standard_b64decode(''.join(chunks))).decode('utf-8')
+
+
+def decode_ground_levels(text, x1, z1, x2, z2):
+    """Decode text of get_ground_levels into dict {(x, z): level}. Levels are listed x outer loop, z inner loop"""
+    keys = ((x, z) for x in range(min(x1, x2), max(x1, x2) + 1) for z in range(min(z1, z2), max(z1, z2) + 1))
+    return dict(zip(keys, (int(level) for level in text.split(','))))
+
+
+def decode_nodes_compressed(text, pos1, pos2):
+    """Decode text of get_nodes_compressed into dict {(x, y, z): name}
+
+    text is node names separated by spaces, newline, then 1 based indices into names listed x outer loop, y, z inner loop
+    """
+    names, indices = text.split('\n', 1)
+    palette = names.split(' ')
+    lo = [min(a, b) for a, b in zip(pos1, pos2)]
+    hi = [max(a, b) for a, b in zip(pos1, pos2)]
+    keys = ((x, y, z) for x in range(lo[0], hi[0] + 1) for y in range(lo[1], hi[1] + 1) for z in range(lo[2], hi[2] + 1))
+    return dict(zip(keys, (palette[int(i) - 1] for i in indices.split(','))))
@@ -0,0 +1,212 @@
+import concurrent.futures
+import copy
+import itertools
+import logging
+import time
+
+from contextlib import contextmanager
+
+from ircbuilder import MinetestConnection, NICK_MAX_LEN
+from ircbuilder import cache
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionStats:
+    """Throughput of one connection in a MinetestConnectionPool"""
+    def __init__(self, pybotnick):
+        self.pybotnick = pybotnick
+        # set_node_list commands sent, and all lines written to IRC including any others such as version negotiation
+        self.commands = 0
+        self.lines = 0
+        self.nodes = 0
+        self.busy_time = 0.0
+
+    def as_dict(self):
+        return {
+            'pybotnick': self.pybotnick,
+            'commands': self.commands,
+            'lines': self.lines,
+            'nodes': self.nodes,
+            'busy_time': self.busy_time,
+            'nodes_per_second': self.nodes / self.busy_time if self.busy_time > 0 else 0.0,
+        }
+
+
+class MinetestConnectionPool:
+    """Several MinetestConnections, each with its own IRC nick, sharing the work of sending a building
+
+    Each nick has its own flood control limits so the pool can send up to size times faster than one connection.
+    Every item is encoded into set_node_list commands once and the commands are shared between connections, so even a
+    single large cuboid list keeps all connections busy.
+    Items are sent in phases. Items starting with an end_list entry are only sent once every connection has finished
+    the previous phase, so eg air is never placed before walls are complete on all connections.
+
+    Example:
+
+    with ircbuilder.pool.open_irc_pool('irc.triptera.com.au', 'mtuser', 'mtuserpass', size=4) as pool:
+        pool.send_node_dict(b.nodes, end_list=('air',), palette=b.palette)
+        print(pool.stats())
+
+    """
+    def __init__(self, connections):
+        self.connections = list(connections)
+        self.connection_stats = [ConnectionStats(mc.pybotnick) for mc in self.connections]
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.connections))
+
+    def __len__(self):
+        return len(self.connections)
+
+    @staticmethod
+    def create(ircserver, mtuser, mtuserpass, size=2, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697, flood_control=None):
+        """Log in size connections in parallel with nicks pybotnick1, pybotnick2, ...
+
+        flood_control: FloodControl which is copied so each connection has its own token bucket
+        """
+        if not pybotnick:
+            pybotnick = "py" + mtuser
+        pybotnick = pybotnick[0:NICK_MAX_LEN - len(str(size))]
+        with concurrent.futures.ThreadPoolExecutor(max_workers=size) as executor:
+            futures = [executor.submit(MinetestConnection.create, ircserver, mtuser, mtuserpass, mtbotnick, channel,
+                                       pybotnick + str(i + 1), port, copy.copy(flood_control))
+                       for i in range(size)]
+            connections = [future.result() for future in futures]
+        return MinetestConnectionPool(connections)
+
+    def close(self):
+        for mc in self.connections:
+            mc.part_channel()
+        self.executor.shutdown()
+
+    @property
+    def failed_batches(self):
+        """set_node_list batches which timed out or were rejected on any connection"""
+        return sum(mc.failed_batches for mc in self.connections)
+
+    def stats(self):
+        """Return list of per connection throughput dicts"""
+        return [cs.as_dict() for cs in self.connection_stats]
+
+    def _send_jobs(self, index, jobs):
+        """Send list of (item, command) jobs on connection index. Run in executor thread
+
+        returns list of (item, replies) with one entry for each run of consecutive jobs with the same item
+        """
+        mc = self.connections[index]
+        cs = self.connection_stats[index]
+        results = []
+        for item, group in itertools.groupby(jobs, key=lambda job: job[0]):
+            commands = [command for _, command in group]
+            lines = mc.sender.lines_sent
+            start = time.monotonic()
+            # a run of commands is sent together so it is pipelined as by MinetestConnection.set_node_list.
+            # Its positions aren't known here so caches are updated by _written once every connection has finished
+            replies = mc.send_node_list_batches(commands, (), item)
+            cs.busy_time += time.monotonic() - start
+            cs.commands += len(commands)
+            cs.lines += mc.sender.lines_sent - lines
+            cs.nodes += sum(payload.reply_count(reply, item) or 0 for reply in replies)
+            results.append((item, replies))
+        return results
+
+    def _run_phase(self, jobs):
+        """Spread (item, command) jobs across connections balancing command lengths then wait for all to finish
+
+        returns list of (item, replies)
+        """
+        loads = [0] * len(self.connections)
+        assigned = [[] for _ in self.connections]
+        # in order, rather than largest first, so each connection gets runs of the same item which can be pipelined.
+        # Commands are nearly all close to the maximum length so this balances as well
+        for item, command in jobs:
+            index = loads.index(min(loads))
+            assigned[index].append((item, command))
+            # flood control charges by bytes so balance the bytes each connection has to send
+            loads[index] += len(command) + 1
+        futures = [self.executor.submit(self._send_jobs, i, a) for i, a in enumerate(assigned) if a]
+        results = []
+        for future in futures:
+            results.extend(future.result())
+        return results
+
+    def node_list_version(self):
+        """set_node_list payload version understood by the mod, negotiated on connections which haven't yet"""
+        for mc in self.connections:
+            if mc.node_list_version is None:
+                mc.negotiate_node_list_version()
+        return min(mc.node_list_version for mc in self.connections)
+
+    def _jobs(self, item, list_pos, version):
+        """Encode one item's positions into (item, command) jobs, one per set_node_list command"""
+        return [(item, command) for command in payload.node_list_commands(list_pos, item, version=version)]
+
+    def _written(self, item, list_pos, replies):
+        """Update the read cache of every connection which has one, as any connection may have written the positions
+
+        As for MinetestConnection.set_node_list, cached nodes are updated only if every batch succeeded, else forgotten
+        """
+        caches = [mc.cache for mc in self.connections if mc.cache is not None]
+        if not caches:
+            return
+        name = cache.item_name(item) if all(payload.reply_count(ret, item) is not None for ret in replies) else None
+        for pos in list_pos:
+            pos1, pos2 = payload.cuboid_corners(pos)
+            for read_cache in caches:
+                read_cache.written(pos1, pos2, name)
+
+    def set_node_list(self, list_pos, item):
+        """Set all blocks at a list of positions to the same item, spreading batches across all connections"""
+        replies = []
+        for _, item_replies in self._run_phase(self._jobs(item, list_pos, self.node_list_version())):
+            replies.extend(item_replies)
+        self._written(item, list_pos, replies)
+        return payload.set_node_list_result(replies, item)
+
+    def send_node_lists(self, node_lists, end_list=()):
+        """Send node_lists across all connections. Items in end_list are sent after all other items on all connections
+
+        node_lists : { 'item1':[(x1,y1,z1), ((x2a,y2a,z2a),(x2b,y2b,z2b)), ...], 'item2':[...]}
+        end_list : ('air', 'door:')
+        returns list of set_node_list results, one per item
+        """
+        if isinstance(end_list, str):
+            end_list = end_list,
+        version = self.node_list_version()
+        phases = [[] for _ in range(len(end_list) + 1)]
+        for item in nodebuilder.ordered_items(node_lists, end_list):
+            # phase is 1 + index of last end_list entry matching item, or 0 if none match
+            phase = 0
+            for i, end in enumerate(end_list):
+                if item.find(end) == 0:
+                    phase = i + 1
+            phases[phase].extend(self._jobs(item, node_lists[item], version))
+        results = []
+        for jobs in phases:
+            if jobs:
+                # replies of each item may come from several connections
+                item_replies = {item: [] for item, _ in jobs}
+                for item, replies in self._run_phase(jobs):
+                    item_replies[item].extend(replies)
+                for item, replies in item_replies.items():
+                    self._written(item, node_lists[item], replies)
+                    results.append(payload.set_node_list_result(replies, item))
+        return results
+
+    def send_node_dict(self, node_dict, end_list=(), strategy="fast", palette=None):
+        """Convert node_dict to node_lists and send across all connections
+
+        palette: nodebuilder.ItemPalette if the values of node_dict are its ids, eg Building.nodes with Building.palette
+        """
+        return self.send_node_lists(nodebuilder.node_lists_from_node_dict(node_dict, strategy, palette), end_list)
+
+
+@contextmanager
+def open_irc_pool(ircserver, mtuser, mtuserpass, size=2, mtbotnick="mtserver", channel=None, pybotnick=None, port=6697, flood_control=None):
+    """open_irc_pool ensures all connections are always parted"""
+    pool = MinetestConnectionPool.create(ircserver, mtuser, mtuserpass, size, mtbotnick, channel, pybotnick, port, flood_control)
+    try:
+        yield pool
+    finally:
+        pool.close()
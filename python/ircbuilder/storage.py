@@ -0,0 +1,226 @@
+"""Saving and loading buildings in a compact binary file, and importing minetest .mts schematics
+
+Building file format, all integers little endian, arrays start on 4 byte boundaries so the file can be memory mapped:
+  b"IRCB", u16 format version, u16 palette count, then per item u16 length and utf-8 item string
+  u32 node count n, u32 count of cuboid sections, padding to 4 bytes
+  int32 x[n], int32 y[n], int32 z[n], uint16 item[n], padding to 4 bytes
+  per cuboid section: u32 item, u32 count k, int32 corners[k * 6] being x1, y1, z1, x2, y2, z2 of each cuboid
+Cuboid sections are optional and hold node_lists already merged by nodebuilder so they can be sent without merging.
+"""
+import array
+import mmap
+import struct
+import sys
+import zlib
+
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+MAGIC = b"IRCB"
+FORMAT_VERSION = 1
+MAX_ITEMS = 65535
+MTS_MAGIC = b"MTSM"
+# param1 of .mts nodes is the probability of placing the node out of MTS_PROB_ALWAYS
+MTS_PROB_NEVER = 0
+MTS_PROB_ALWAYS = 127
+
+
+def _pad(n):
+    return -n % 4
+
+
+def _little_endian(values):
+    """array of values in little endian byte order ready for writing"""
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _read_array(data, typecode, offset, count):
+    values = array.array(typecode)
+    values.frombytes(data[offset:offset + count * values.itemsize])
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values, offset + count * values.itemsize
+
+
+def _check_items(palette_index):
+    if len(palette_index) > MAX_ITEMS:
+        raise ValueError(f"Too many different items to save. Maximum {MAX_ITEMS}")
+
+
+def save_building(path, node_dict, node_lists=None, palette=None):
+    """Save node_dict {(x, y, z): item} and optionally its node_lists of merged cuboids to file path
+
+    palette: nodebuilder.ItemPalette if the values of node_dict are its ids rather than items
+    """
+    # ids of a palette are written unchanged, so every item of the palette is saved even if no node uses it any more.
+    # Items only in node_lists get ids after them in a copy of the index, so the caller's palette is unchanged
+    palette_index = dict(palette.ids) if palette is not None else {}
+    for item in node_lists or ():
+        palette_index.setdefault(item, len(palette_index))
+    _check_items(palette_index)
+    if palette is not None:
+        items = array.array('H', node_dict.values())
+    else:
+        items = array.array('H')
+        for item in node_dict.values():
+            idx = palette_index.get(item)
+            if idx is None:
+                idx = palette_index[item] = len(palette_index)
+                _check_items(palette_index)
+            items.append(idx)
+    palette = list(palette_index)
+    header = bytearray(MAGIC)
+    header += struct.pack("<HH", FORMAT_VERSION, len(palette))
+    for item in palette:
+        encoded = item.encode('utf-8')
+        header += struct.pack("<H", len(encoded)) + encoded
+    header += struct.pack("<II", len(node_dict), len(node_lists or ()))
+    header += bytes(_pad(len(header)))
+    with open(path, "wb") as f:
+        f.write(header)
+        for axis in range(3):
+            f.write(_little_endian(array.array('i', (pos[axis] for pos in node_dict))).tobytes())
+        f.write(_little_endian(items).tobytes())
+        f.write(bytes(_pad(len(items) * items.itemsize)))
+        for item, list_pos in (node_lists or {}).items():
+            corners = array.array('i')
+            for pos in list_pos:
+                lo, hi = payload.cuboid_corners(pos)
+                corners.extend(lo)
+                corners.extend(hi)
+            f.write(struct.pack("<II", palette_index[item], len(list_pos)))
+            f.write(_little_endian(corners).tobytes())
+
+
+def _read_header(data):
+    if data[:4] != MAGIC:
+        raise ValueError("Not an ircbuilder building file")
+    version, count = struct.unpack_from("<HH", data, 4)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unsupported building file version {version}")
+    offset = 8
+    palette = []
+    for _ in range(count):
+        length, = struct.unpack_from("<H", data, offset)
+        palette.append(bytes(data[offset + 2:offset + 2 + length]).decode('utf-8'))
+        offset += 2 + length
+    nodes, sections = struct.unpack_from("<II", data, offset)
+    offset += 8
+    return palette, nodes, sections, offset + _pad(offset)
+
+
+def _open(path):
+    with open(path, "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def load_nodes(path):
+    """Load the nodes saved in file path as (palette, {(x, y, z): index}) where indexes are into the palette list"""
+    with _open(path) as data:
+        palette, nodes, _, offset = _read_header(data)
+        xs, offset = _read_array(data, 'i', offset, nodes)
+        ys, offset = _read_array(data, 'i', offset, nodes)
+        zs, offset = _read_array(data, 'i', offset, nodes)
+        items, _ = _read_array(data, 'H', offset, nodes)
+    return palette, dict(zip(zip(xs, ys, zs), items))
+
+
+def load_node_dict(path):
+    """Load the node dict {(x, y, z): item} saved in file path"""
+    palette, nodes = load_nodes(path)
+    return dict(zip(nodes, map(palette.__getitem__, nodes.values())))
+
+
+def load_node_lists(path):
+    """Load the merged node_lists saved in file path without reading its nodes. None if none were saved"""
+    with _open(path) as data:
+        palette, nodes, sections, offset = _read_header(data)
+        if not sections:
+            return None
+        offset += nodes * 14
+        offset += _pad(offset)
+        node_lists = {}
+        for _ in range(sections):
+            idx, count = struct.unpack_from("<II", data, offset)
+            corners, offset = _read_array(data, 'i', offset + 8, count * 6)
+            list_pos = []
+            for i in range(0, len(corners), 6):
+                lo, hi = tuple(corners[i:i + 3]), tuple(corners[i + 3:i + 6])
+                list_pos.append(lo if lo == hi else (lo, hi))
+            node_lists[palette[idx]] = list_pos
+    return node_lists
+
+
+def memmap_nodes(path):
+    """Memory map the nodes in file path as numpy arrays without reading them. Requires numpy
+
+    returns (palette, x, y, z, items) where items are indexes into palette
+    """
+    if nodebuilder.np is None:
+        raise ImportError("memmap_nodes requires numpy. Install it with 'pip install numpy'")
+    np = nodebuilder.np
+    with _open(path) as data:
+        palette, nodes, _, offset = _read_header(data)
+    arrays = [np.memmap(path, dtype='<i4', mode='r', offset=offset + axis * nodes * 4, shape=(nodes,)) for axis in range(3)]
+    items = np.memmap(path, dtype='<u2', mode='r', offset=offset + nodes * 12, shape=(nodes,))
+    return (palette, *arrays, items)
+
+
+def read_mts(path, origin=(0, 0, 0), include_air=True):
+    """Read a minetest .mts schematic into a node dict {(x, y, z): item} with its minimum corner at origin
+
+    Nodes with param2 are json items so they keep their rotation. Nodes with probability 0 are skipped and all other
+    nodes are included, so random placement and slice probabilities are not reproduced.
+    include_air: False skips air nodes, so the schematic doesn't clear whatever is already there
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != MTS_MAGIC:
+        raise ValueError("Not a minetest schematic file")
+    # .mts integers are big endian
+    version, size_x, size_y, size_z = struct.unpack_from(">Hhhh", data, 4)
+    offset = 12
+    if version >= 3:
+        # slice probability of each y layer
+        offset += size_y
+    count, = struct.unpack_from(">H", data, offset)
+    offset += 2
+    names = []
+    for _ in range(count):
+        length, = struct.unpack_from(">H", data, offset)
+        names.append(data[offset + 2:offset + 2 + length].decode('utf-8'))
+        offset += 2 + length
+    nodes = size_x * size_y * size_z
+    bulk = zlib.decompress(data[offset:])
+    param0 = array.array('H')
+    param0.frombytes(bulk[:nodes * 2])
+    if sys.byteorder == "little":
+        param0.byteswap()
+    param1 = bulk[nodes * 2:nodes * 3]
+    param2 = bulk[nodes * 3:nodes * 4]
+    ox, oy, oz = nodebuilder.int_tuple(*origin)
+    node_dict = {}
+    i = 0
+    for z in range(size_z):
+        for y in range(size_y):
+            for x in range(size_x):
+                name = names[param0[i]]
+                probability = param1[i]
+                if version < 2:
+                    # version 1 used "ignore" for nodes not placed and probability 0 for always
+                    probability = MTS_PROB_NEVER if name == "ignore" else 255 if probability == 0 else probability
+                if version < 4:
+                    probability >>= 1
+                # high bit of probability is force placement
+                if probability & 0x7f != MTS_PROB_NEVER and (include_air or name != "air"):
+                    node_dict[(ox + x, oy + y, oz + z)] = (
+                        name if param2[i] == 0 else nodebuilder.item_string({"name": name, "param2": param2[i]}))
+                i += 1
+    return node_dict
+
+
+def mts_node_lists(path, origin=(0, 0, 0), include_air=True, strategy="fast"):
+    """Read a minetest .mts schematic straight into node_lists ready for nodebuilder.send_node_lists"""
+    return nodebuilder.node_lists_from_node_dict(read_mts(path, origin, include_air), strategy)
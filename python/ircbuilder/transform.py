@@ -0,0 +1,98 @@
+"""Geometric transforms of node dicts and node_lists: translate, rotate by quarter turns, mirror and tile
+
+A transform is an integer 3x3 matrix and an offset applied to every position as matrix @ position + offset.
+Node dicts are transformed in bulk with numpy when it is installed. node_lists of already merged cuboids are
+transformed corner by corner, so a transformed building doesn't need merging again.
+param2 of json items is not changed, so eg stairs keep facing the same absolute direction after rotating.
+"""
+import itertools
+
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+AXES = {'x': 0, 'y': 1, 'z': 2}
+IDENTITY = ((1, 0, 0), (0, 1, 0), (0, 0, 1))
+
+
+def axis_index(axis):
+    """Axis as 0, 1, 2 from 'x', 'y', 'z' or 0, 1, 2"""
+    if axis in AXES:
+        return AXES[axis]
+    if axis in (0, 1, 2):
+        return axis
+    raise ValueError(f"Unknown axis {axis!r}. Use 'x', 'y' or 'z'")
+
+
+def rotation(axis, quarter_turns):
+    """Matrix rotating quarter_turns * 90 degrees about axis
+
+    One quarter turn takes +y to +z about x, +z to +x about y and +x to +y about z. Negative turns rotate the other way
+    """
+    a = axis_index(axis)
+    # the other two axes in right handed order, eg y => z, x
+    u, v = (a + 1) % 3, (a + 2) % 3
+    matrix = [list(row) for row in IDENTITY]
+    for _ in range(quarter_turns % 4):
+        # +u => +v and +v => -u
+        rotated = [list(row) for row in matrix]
+        rotated[u] = [-c for c in matrix[v]]
+        rotated[v] = list(matrix[u])
+        matrix = rotated
+    return tuple(tuple(row) for row in matrix)
+
+
+def mirror(axis):
+    """Matrix negating coordinates along axis"""
+    a = axis_index(axis)
+    return tuple(tuple(-c if i == a else c for c in row) for i, row in enumerate(IDENTITY))
+
+
+def apply(matrix, offset, pos):
+    return tuple(matrix[i][0] * pos[0] + matrix[i][1] * pos[1] + matrix[i][2] * pos[2] + offset[i] for i in range(3))
+
+
+def bounds(positions):
+    """(min corner, max corner) of an iterable of positions, or None if empty"""
+    columns = list(zip(*positions))
+    if not columns:
+        return None
+    return tuple(map(min, columns)), tuple(map(max, columns))
+
+
+def anchored_offset(matrix, lo, hi):
+    """Offset which makes matrix keep the minimum corner of bounding box lo, hi where it was"""
+    corners = [apply(matrix, (0, 0, 0), (x, y, z)) for x in (lo[0], hi[0]) for y in (lo[1], hi[1]) for z in (lo[2], hi[2])]
+    new_lo = bounds(corners)[0]
+    return tuple(lo[axis] - new_lo[axis] for axis in range(3))
+
+
+def transform_node_dict(node_dict, matrix, offset):
+    """Return new node dict with every position transformed"""
+    if not node_dict:
+        return {}
+    if matrix == IDENTITY:
+        # plain comprehension is faster than converting to and from numpy for a translation
+        dx, dy, dz = offset
+        return {(x + dx, y + dy, z + dz): item for (x, y, z), item in node_dict.items()}
+    np = nodebuilder.np
+    if np is not None:
+        positions = np.fromiter(itertools.chain.from_iterable(node_dict), dtype=np.int64, count=3 * len(node_dict))
+        positions = positions.reshape(-1, 3) @ np.array(matrix, dtype=np.int64).T + np.array(offset, dtype=np.int64)
+        # converting whole columns to lists is much faster than converting each row to a tuple
+        return dict(zip(zip(*(positions[:, axis].tolist() for axis in range(3))), node_dict.values()))
+    return {apply(matrix, offset, pos): item for pos, item in node_dict.items()}
+
+
+def transform_node_lists(node_lists, matrix, offset):
+    """Return new node_lists with every position and cuboid transformed, keeping cuboids merged"""
+    transformed = {}
+    for item, list_pos in node_lists.items():
+        new_list = []
+        for pos in list_pos:
+            if payload.is_cuboid(pos):
+                p1, p2 = apply(matrix, offset, pos[0]), apply(matrix, offset, pos[1])
+                new_list.append((tuple(map(min, p1, p2)), tuple(map(max, p1, p2))))
+            else:
+                new_list.append(apply(matrix, offset, pos))
+        transformed[item] = new_list
+    return transformed
@@ -38,4 +38,7 @@ setup(
     keywords='minetest irc',  
     packages=find_packages(exclude=['contrib', 'docs', 'tests']),
     python_requires='>=3.6',
+    extras_require={
+        'numpy': ['numpy'],
+    },
 )
@@ -0,0 +1,55 @@
+"""AsyncMinetestConnection against FakeIrcServer"""
+import asyncio
+import time
+
+import pytest
+
+from ircbuilder import asyncconnection
+from ircbuilder import fakeserver
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer().start()
+    yield server
+    server.stop()
+
+
+def run(server, test):
+    async def main():
+        async with asyncconnection.open_irc_async(server.host, "t", "t", port=server.port) as mc:
+            return await test(mc)
+    return asyncio.run(main())
+
+
+def test_commands(server):
+    async def test(mc):
+        assert await mc.set_nodes(0, 20, 0, 1, 21, 1, "default:stone") == "default:stone 8"
+        assert await mc.get_node(1, 21, 1) == "default:stone"
+        assert await mc.compare_nodes(0, 20, 0, 1, 21, 1, "default:stone") == "0"
+        assert await mc.get_ground_level(5, 5) == 0
+    run(server, test)
+
+
+def test_send_building(server):
+    async def test(mc):
+        mc.pipeline_window = 4
+        mc.build(range(10), 30, range(10), "default:glass")
+        mc.build(range(0, 10, 2), 31, 0, "default:dirt")
+        await mc.send_building(end_list=("default:dirt",))
+        assert mc.building == {}
+    run(server, test)
+    assert all(server.world.get_node((x, 30, z)) == "default:glass" for x in range(10) for z in range(10))
+    assert [server.world.get_node((x, 31, 0)) for x in range(4)] == ["default:dirt", "air", "default:dirt", "air"]
+
+
+def test_disconnect_fails_outstanding_commands(server):
+    async def test(mc):
+        server.world.drop_replies["get_node"] = 1
+        ticket = await mc.send_cmd("get_node (0,0,0)", wait=False)
+        # server closes the connection on QUIT
+        mc.send_string("QUIT")
+        start = time.monotonic()
+        assert await mc.wait_for_reply(ticket, timeout=5.0) is None
+        return time.monotonic() - start
+    assert run(server, test) < 2.0
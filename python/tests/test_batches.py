@@ -0,0 +1,75 @@
+"""node_list_commands packs every position into commands no longer than max_len"""
+import random
+
+import pytest
+
+from ircbuilder import payload
+
+VERSIONS = [payload.NODE_LIST_VERSION_1, payload.NODE_LIST_VERSION_2]
+
+
+def random_list_pos(seed, n):
+    rng = random.Random(seed)
+    list_pos = []
+    for _ in range(n):
+        p = tuple(rng.randint(-3000, 3000) for _ in range(3))
+        if rng.random() < 0.3:
+            list_pos.append((p, tuple(c + rng.randint(-20, 20) for c in p)))
+        else:
+            list_pos.append(p)
+    return list_pos
+
+
+def decode(command, version):
+    name, b64, item = command.split(" ", 2)
+    if version == payload.NODE_LIST_VERSION_1:
+        assert name == "set_node_list"
+        return payload.decode_node_list(b64), item
+    assert name == "set_node_list2"
+    return payload.decode_node_list2(b64), item
+
+
+@pytest.mark.parametrize("version", VERSIONS)
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("max_len", [120, payload.MAX_CMD_LEN])
+def test_commands_fit_and_decode_to_input(version, seed, max_len):
+    list_pos = random_list_pos(seed, 500)
+    batch_stats = []
+    commands = payload.node_list_commands(list_pos, "default:stone", max_len, version, batch_stats)
+    assert len(commands) == len(batch_stats) > 1
+    decoded = []
+    for command, (entries, raw_bytes, zipped_bytes) in zip(commands, batch_stats):
+        assert len(command) <= max_len
+        corners, item = decode(command, version)
+        assert item == "default:stone"
+        assert len(corners) == entries
+        decoded.extend(corners)
+    expected = [payload.cuboid_corners(pos) for pos in list_pos]
+    if version == payload.NODE_LIST_VERSION_2:
+        expected.sort()
+    assert decoded == expected
+
+
+@pytest.mark.parametrize("version", VERSIONS)
+def test_batches_are_full(version):
+    list_pos = random_list_pos(7, 2000)
+    commands = payload.node_list_commands(list_pos, "default:stone", version=version)
+    # every command except the last is packed close to the limit
+    assert all(len(command) > payload.MAX_CMD_LEN - 40 for command in commands[:-1])
+
+
+@pytest.mark.parametrize("version", VERSIONS)
+def test_empty_list_pos_gives_one_command(version):
+    commands = payload.node_list_commands([], "air", version=version)
+    assert len(commands) == 1
+    assert decode(commands[0], version) == ([], "air")
+
+
+def test_item_too_long():
+    with pytest.raises(ValueError):
+        payload.node_list_commands([(0, 0, 0)], "x" * payload.MAX_CMD_LEN)
+
+
+def test_unknown_version():
+    with pytest.raises(ValueError):
+        payload.node_list_commands([(0, 0, 0)], "air", version=3)
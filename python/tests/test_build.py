@@ -0,0 +1,52 @@
+"""Bulk build() rounds coordinates exactly as int_tuple does, and item_string converts items to json once"""
+import json
+
+import pytest
+
+from ircbuilder import nodebuilder
+
+
+def per_node(x, y, z, item):
+    return {nodebuilder.int_tuple(xi, yi, zi): item
+            for xi in nodebuilder.make_iter(x) for yi in nodebuilder.make_iter(y) for zi in nodebuilder.make_iter(z)}
+
+
+@pytest.mark.parametrize("x, y, z", [
+    (1, 2, 3),
+    (range(5), 7, range(-3, 3)),
+    ([0.5, 1.49, -0.5, -1.5, 2.5], range(2), (4.4, 4.6)),
+    (range(10, 0, -3), [1.0, 2.0], 0),
+])
+def test_build_matches_per_node_rounding(x, y, z):
+    assert nodebuilder.build(x, y, z, "default:stone") == per_node(x, y, z, "default:stone")
+
+
+def test_build_generators_reused_for_every_x():
+    built = nodebuilder.build(range(3), (y for y in range(2)), (z for z in [0.4, 5]), "default:stone")
+    assert built == per_node(range(3), range(2), [0, 5], "default:stone")
+
+
+def test_build_numpy_arrays():
+    np = pytest.importorskip("numpy")
+    x = np.array([0.5, 1.5, -0.5, -2.5, 3.2])
+    assert nodebuilder.build(x, np.arange(3), 0, "default:stone") == per_node(list(x), range(3), 0, "default:stone")
+
+
+def test_build_cuboid_either_corner_order():
+    assert nodebuilder.build_cuboid(2, 0, 1, 0, 1, 0, "air") == nodebuilder.build_cuboid(0, 0, 0, 2, 1, 1, "air")
+    assert len(nodebuilder.build_cuboid(0, 0, 0, 2, 1, 1, "air")) == 12
+
+
+@pytest.mark.parametrize("item", [
+    {"name": "default:torch", "param2": 1},
+    {"name": "default:torch", "param2": True},
+    {"a": (True,)},
+    {"a": (1,)},
+    {"a": [1, {"b": False}]},
+    {1: "x"},
+    {True: "x"},
+])
+def test_item_string_same_as_json(item):
+    # twice so the second call may come from the cache
+    assert nodebuilder.item_string(item) == json.dumps(item)
+    assert nodebuilder.item_string(item) == json.dumps(item)
@@ -0,0 +1,39 @@
+"""Building.building is a view of the building's nodes which reads and changes them like a dict"""
+from ircbuilder import building
+
+
+def test_building_view_reads_nodes():
+    b = building.Building()
+    b.build(0, range(3), 0, "default:stone")
+    view = b.building
+    assert len(view) == 3
+    assert view[(0, 1, 0)] == "default:stone"
+    assert (0, 3, 0) not in view
+    b.build(0, 3, 0, {"name": "default:torch", "param2": 1})
+    assert view[(0, 3, 0)] == '{"name": "default:torch", "param2": 1}'
+    assert dict(view) == b.palette.decode(b.nodes)
+
+
+def test_building_view_changes_nodes():
+    b = building.Building()
+    b.build(0, 0, 0, "default:stone")
+    b.building[(1, 0, 0)] = "default:dirt"
+    b.building.update({(2, 0, 0): {"name": "default:torch", "param2": 1}})
+    del b.building[(0, 0, 0)]
+    torch = '{"name": "default:torch", "param2": 1}'
+    assert b.nodes == {(1, 0, 0): b.palette.id("default:dirt"), (2, 0, 0): b.palette.id(torch)}
+    assert dict(b.building) == {(1, 0, 0): "default:dirt", (2, 0, 0): torch}
+
+
+def test_building_view_discards_saved_cuboids():
+    b = building.Building()
+    b.cuboids = {"default:stone": [(0, 0, 0)]}
+    b.building[(0, 0, 0)] = "default:stone"
+    assert b.cuboids is None
+
+
+def test_building_setter_replaces_nodes():
+    b = building.Building()
+    b.build(0, 0, 0, "default:stone")
+    b.building = {(1, 2, 3): "default:dirt"}
+    assert dict(b.building) == {(1, 2, 3): "default:dirt"}
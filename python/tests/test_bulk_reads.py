@@ -0,0 +1,71 @@
+"""get_heightmap and get_region read the same values as one command per column or node, across tile boundaries"""
+import itertools
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import fakeserver
+
+
+def make_world(chunked=True):
+    world = fakeserver.FakeMinetest(ground_level=2, chunked=chunked)
+    world.set_cuboid((0, 3, 0), (10, 5, 1), "default:stone")
+    world.set_cuboid((66, 3, 2), (66, 9, 2), "default:dirt")
+    world.set_cuboid((31, 1, 0), (33, 4, 0), "air")
+    world.set_cuboid((32, 2, 1), (32, 2, 1), "default:glass")
+    return world
+
+
+@pytest.fixture(params=[True, False], ids=["chunked", "fallback"])
+def server(request):
+    server = fakeserver.FakeIrcServer(world=make_world(request.param)).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mc(server):
+    mc = MinetestConnection.create(server.host, "t", "t", port=server.port)
+    yield mc
+    mc.close()
+
+
+def test_heightmap(server, mc):
+    # one get_ground_level per column without chunked replies so keep the rectangle small
+    x1 = -2 if server.world.chunked else 64
+    heights = mc.get_heightmap(70, 3, x1, 0)
+    columns = list(itertools.product(range(x1, 71), range(0, 4)))
+    assert heights == {(x, z): server.world.get_ground_level(x, z) for x, z in columns}
+    if server.world.chunked:
+        assert heights[(5, 1)] == 5
+    assert heights[(66, 2)] == 9
+
+
+def test_heightmap_as_array(server, mc):
+    np = pytest.importorskip("numpy")
+    heights = mc.get_heightmap(64, 0, 70, 3, as_array=True)
+    assert heights.shape == (7, 4)
+    assert heights.dtype == np.int32
+    assert heights[66 - 64, 2] == 9
+    assert heights[0, 0] == 2
+
+
+def test_region(server, mc):
+    if not server.world.chunked:
+        # one get_node per position so keep the region small
+        pos1, pos2 = (31, 1, 0), (33, 3, 2)
+    else:
+        pos1, pos2 = (30, 0, 0), (64, 4, 2)
+    nodes = mc.get_region(*pos2, *pos1)
+    positions = itertools.product(*(range(a, b + 1) for a, b in zip(pos1, pos2)))
+    assert nodes == {pos: server.world.get_node(pos) for pos in positions}
+    assert nodes[(32, 2, 1)] == "default:glass"
+    assert nodes[(32, 2, 0)] == "air"
+
+
+def test_region_fills_cache(server, mc):
+    mc.enable_cache()
+    mc.get_region(31, 1, 0, 33, 2, 1)
+    commands = server.world.commands
+    assert mc.get_node(32, 2, 1) == "default:glass"
+    assert server.world.commands == commands
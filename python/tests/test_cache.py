@@ -0,0 +1,123 @@
+"""ReadCache answers repeated reads without commands and is kept up to date by writes through the connection"""
+import time
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import cache
+from ircbuilder import fakeserver
+
+
+def test_lru_eviction_and_stats():
+    c = cache.ReadCache(max_size=2)
+    c.put_node((0, 0, 0), "a")
+    c.put_node((1, 0, 0), "b")
+    assert c.get_node((0, 0, 0)) == "a"
+    c.put_node((2, 0, 0), "c")
+    # (1, 0, 0) was least recently used
+    assert c.get_node((1, 0, 0)) is None
+    assert c.get_node((2, 0, 0)) == "c"
+    assert c.stats() == {'hits': 2, 'misses': 1, 'hit_ratio': 2 / 3, 'size': 2}
+
+
+def test_ttl_expiry():
+    c = cache.ReadCache(ttl=0.05)
+    c.put_node((0, 0, 0), "a")
+    c.put_ground_level(0, 0, 5)
+    assert c.get_node((0, 0, 0)) == "a"
+    time.sleep(0.1)
+    assert c.get_node((0, 0, 0)) is None
+    assert c.get_ground_level(0, 0) is None
+
+
+def test_written_updates_cached_entries_only():
+    c = cache.ReadCache()
+    c.put_node((0, 0, 0), "air")
+    c.put_ground_level(0, 0, 3)
+    c.put_ground_level(9, 9, 3)
+    c.written((0, 0, 0), (1, 1, 1), "default:stone")
+    assert c.get_node((0, 0, 0)) == "default:stone"
+    assert c.get_node((1, 1, 1)) is None
+    assert c.get_ground_level(0, 0) is None
+    assert c.get_ground_level(9, 9) == 3
+    c.written((0, 0, 0), (0, 0, 0), None)
+    assert c.get_node((0, 0, 0)) is None
+
+
+def test_compare_nodes_needs_every_node_cached():
+    c = cache.ReadCache()
+    for x in range(3):
+        c.put_node((x, 0, 0), "air" if x else "default:stone")
+    assert c.compare_nodes((0, 0, 0), (2, 0, 0), "air") == 1
+    assert c.compare_nodes((0, 0, 0), (3, 0, 0), "air") is None
+
+
+def test_invalidate():
+    c = cache.ReadCache()
+    c.put_node((0, 0, 0), "a")
+    c.put_node((5, 0, 0), "b")
+    c.invalidate((0, 0, 0))
+    assert c.get_node((0, 0, 0)) is None
+    assert c.get_node((5, 0, 0)) == "b"
+    c.invalidate()
+    assert len(c) == 0
+
+
+def test_item_name():
+    assert cache.item_name("default:stone") == "default:stone"
+    assert cache.item_name('{"name":"default:torch","param2":1}') == "default:torch"
+    assert cache.item_name("{bad json") is None
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mc(server):
+    mc = MinetestConnection.create(server.host, "t", "t", port=server.port)
+    mc.enable_cache()
+    yield mc
+    mc.close()
+
+
+def test_repeated_reads_use_cache(server, mc):
+    assert mc.get_node(1, 2, 3) == "air"
+    assert mc.get_ground_level(4, 4) == 0
+    commands = server.world.commands
+    assert mc.get_node(1, 2, 3) == "air"
+    assert mc.get_ground_level(4, 4) == 0
+    assert server.world.commands == commands
+    assert mc.cache.stats()['hits'] == 2
+
+
+def test_writes_through_connection_update_cache(server, mc):
+    for x in range(3):
+        mc.get_node(x, 10, 0)
+    mc.set_node(0, 10, 0, "default:stone")
+    mc.set_node_list([(1, 10, 0), (2, 10, 0)], "default:glass")
+    commands = server.world.commands
+    assert mc.get_node(0, 10, 0) == "default:stone"
+    assert mc.get_node(2, 10, 0) == "default:glass"
+    assert mc.compare_nodes(1, 10, 0, 2, 10, 0, "default:glass") == "0"
+    assert server.world.commands == commands
+
+
+def test_changes_by_others_seen_after_invalidate(server, mc):
+    assert mc.get_node(0, 20, 0) == "air"
+    server.world.set_cuboid((0, 20, 0), (0, 20, 0), "default:dirt")
+    assert mc.get_node(0, 20, 0) == "air"
+    mc.invalidate_cache((0, 20, 0))
+    assert mc.get_node(0, 20, 0) == "default:dirt"
+
+
+def test_failed_set_node_list_forgets_positions(server, mc):
+    mc.dispatcher.late_reply_grace = 0.0
+    mc.get_node(0, 30, 0)
+    server.world.drop_replies["set_node_list2"] = 1
+    mc.set_node_list([(0, 30, 0)], "default:stone")
+    assert mc.failed_batches == 1
+    assert mc.cache.get_node((0, 30, 0)) is None
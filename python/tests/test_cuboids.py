@@ -0,0 +1,27 @@
+"""cuboids_from_mask checked against node_lists_with_cuboids of the same cells"""
+import pytest
+
+from ircbuilder import nodebuilder
+
+np = pytest.importorskip("numpy")
+
+
+@pytest.mark.parametrize("strategy", nodebuilder.CUBOID_STRATEGIES)
+@pytest.mark.parametrize("seed", range(20))
+def test_cuboids_from_mask_matches_points(strategy, seed):
+    rng = np.random.default_rng(seed)
+    mask = rng.random((6, 5, 7)) < rng.uniform(0.2, 0.9)
+    origin = tuple(int(v) for v in rng.integers(-20, 20, 3))
+    points = [tuple(int(v) for v in p) for p in np.argwhere(mask) + origin]
+    expected = nodebuilder.node_lists_with_cuboids({"i": points}, strategy).get("i", [])
+    assert nodebuilder.cuboids_from_mask(mask, origin, strategy) == expected
+
+
+def test_cuboids_from_mask_leaves_mask_unchanged():
+    mask = np.ones((3, 3, 3), dtype=bool)
+    assert nodebuilder.cuboids_from_mask(mask) == [((0, 0, 0), (2, 2, 2))]
+    assert mask.all()
+
+
+def test_cuboids_from_mask_empty():
+    assert nodebuilder.cuboids_from_mask(np.zeros((4, 4, 4), dtype=bool)) == []
@@ -0,0 +1,71 @@
+"""ReplyDispatcher matches replies to commands in order and never hands a late reply to a later command"""
+import threading
+
+from ircbuilder import dispatch
+
+
+def test_replies_matched_in_order():
+    d = dispatch.ReplyDispatcher()
+    t1 = d.expect("cmd get_node")
+    t2 = d.expect("cmd get_node")
+    assert d.deliver("default:stone")
+    assert d.deliver("air")
+    assert d.wait(t1, 0) == "default:stone"
+    assert d.wait(t2, 0) == "air"
+    assert d.outstanding() == 0
+
+
+def test_unsolicited_reply():
+    d = dispatch.ReplyDispatcher()
+    assert not d.deliver("hello")
+
+
+def test_late_reply_discarded_then_next_command_answered():
+    d = dispatch.ReplyDispatcher()
+    t0 = d.expect("cmd set_node_list")
+    assert d.wait(t0, 0.01) is None
+    t1 = d.expect("cmd get_node")
+    assert d.deliver("default:stone 100")
+    assert d.deliver("air")
+    assert d.wait(t1, 0) == "air"
+    assert d.late_replies == 1
+
+
+def test_two_timeouts_in_a_row_never_shift_replies():
+    d = dispatch.ReplyDispatcher()
+    t0 = d.expect("cmd set_node_list")
+    assert d.wait(t0, 0.01) is None
+    t1 = d.expect("cmd set_node_list")
+    assert d.wait(t1, 0.01) is None
+    t2 = d.expect("cmd set_node_list")
+    assert d.deliver("default:stone 100")
+    assert d.deliver("default:glass 7")
+    assert d.deliver("default:dirt 3")
+    assert d.wait(t2, 0) == "default:dirt 3"
+    assert t1.reply is None
+    assert d.late_replies == 2
+
+
+def test_lost_reply_never_matched_to_next_command():
+    d = dispatch.ReplyDispatcher(late_reply_grace=0.05)
+    t0 = d.expect("cmd set_node_list")
+    assert d.wait(t0, 0.01) is None
+    # t0's reply never comes, so t1's reply is discarded as late to t0 rather than guessed to be t1's
+    t1 = d.expect("cmd set_node_list")
+    assert d.deliver("default:glass 7")
+    assert d.wait(t1, 0.01) is None
+    assert d.late_replies == 1
+    # once the grace has passed replies line up with commands again
+    threading.Event().wait(0.1)
+    t2 = d.expect("cmd get_node")
+    assert d.deliver("air")
+    assert d.wait(t2, 0) == "air"
+    assert d.lost_replies == 1
+
+
+def test_close_wakes_waiters():
+    d = dispatch.ReplyDispatcher()
+    t = d.expect("cmd get_node")
+    threading.Timer(0.05, d.close).start()
+    assert d.wait(t, 5) is None
+    assert d.outstanding() == 0
@@ -0,0 +1,73 @@
+"""FloodControl token bucket, SendScheduler ordering and shutdown, and estimate_send_time"""
+import threading
+import time
+
+from ircbuilder import floodcontrol
+
+
+def test_burst_sent_without_delay_then_throttled():
+    fc = floodcontrol.FloodControl(burst=3, rate=1.0)
+    for _ in range(3):
+        assert fc.delay(10) == 0.0
+        fc.consume(10)
+    assert 0.9 < fc.delay(10) <= 1.0
+
+
+def test_byte_penalty_capped_at_burst():
+    fc = floodcontrol.FloodControl(burst=5, rate=1.0, byte_penalty=1 / 100)
+    assert fc.cost(100) == 2.0
+    assert fc.cost(10000) == 5
+
+
+def test_priority_lines_sent_before_queued_lines():
+    sent = []
+    release = threading.Event()
+
+    def write(line):
+        release.wait(2)
+        sent.append(line)
+
+    s = floodcontrol.SendScheduler(write, floodcontrol.FloodControl(burst=100, rate=100.0))
+    s.put("first")
+    time.sleep(0.05)  # writer now blocked sending first
+    s.put("normal")
+    s.put("PONG", priority=True)
+    release.set()
+    assert s.flush(2)
+    s.close()
+    assert sent == ["first", "PONG", "normal"]
+    assert s.lines_sent == 3
+
+
+def test_close_sends_remaining_lines():
+    sent = []
+    s = floodcontrol.SendScheduler(sent.append, floodcontrol.FloodControl(burst=1, rate=50.0))
+    for i in range(5):
+        s.put(str(i))
+    s.close()
+    assert sent == ["0", "1", "2", "3", "4"]
+    s.put("late")
+    assert s.pending() == 0
+
+
+def test_close_after_flush_timeout_stops_writer_before_returning():
+    sent = []
+    s = floodcontrol.SendScheduler(sent.append, floodcontrol.FloodControl(burst=1, rate=2.0))
+    for i in range(10):
+        s.put(str(i))
+    s.close(timeout=0.1)
+    assert not s._thread.is_alive()
+    assert s.pending() == 0
+    n = len(sent)
+    assert n < 10
+    time.sleep(0.6)
+    assert len(sent) == n  # nothing written after close returned
+
+
+def test_estimate_send_time():
+    fc = floodcontrol.FloodControl(burst=2, rate=1.0)
+    assert floodcontrol.estimate_send_time([[10, 10]], fc) == 0.0
+    assert floodcontrol.estimate_send_time([[10, 10, 10]], fc) == 1.0
+    # window 1 waits for each reply before the next command
+    assert floodcontrol.estimate_send_time([[10, 10]], fc, rtt=0.5, window=1) == 1.0
+    assert floodcontrol.estimate_send_time([[10, 10]], fc, rtt=0.5, window=2) == 0.5
@@ -0,0 +1,60 @@
+"""Incremental sends of a Building only record nodes as sent once every batch has been acknowledged"""
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import building
+from ircbuilder import fakeserver
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mc(server):
+    mc = MinetestConnection.create(server.host, "t", "t", port=server.port)
+    # a dropped reply is then given up on without discarding the next command's reply as late to it
+    mc.dispatcher.late_reply_grace = 0.0
+    yield mc
+    mc.close()
+
+
+def test_dropped_batch_sent_again(server, mc):
+    b = building.Building(incremental=True)
+    b.build(range(3), 20, 0, "default:stone")
+    b.build(0, 21, range(2), "default:glass")
+    server.world.drop_replies["set_node_list2"] = 1
+    b.send(mc)
+    assert mc.failed_batches == 1
+    server.world.nodes.clear()
+    b.send(mc)
+    assert mc.failed_batches == 1
+    assert server.world.get_node((2, 20, 0)) == "default:stone"
+    assert server.world.get_node((0, 21, 1)) == "default:glass"
+    # everything acknowledged so nothing is sent again
+    commands = server.world.commands
+    b.send(mc)
+    assert server.world.commands == commands
+
+
+def test_removed_nodes_sent_as_air(server, mc):
+    b = building.Building(incremental=True)
+    b.build(range(3), 20, 0, "default:stone")
+    b.send(mc)
+    b.build_undo(1, 20, 0)
+    b.build(0, 20, 0, "default:glass")
+    assert b.snapshot.diff(b.nodes) == {(1, 20, 0): b.palette.id("air"), (0, 20, 0): b.palette.id("default:glass")}
+    b.send(mc)
+    assert [server.world.get_node((x, 20, 0)) for x in range(3)] == ["default:glass", "air", "default:stone"]
+
+
+def test_send_building_dropped_batch_sent_again(server, mc):
+    mc.build(range(3), 20, 0, "default:stone")
+    server.world.drop_replies["set_node_list2"] = 1
+    mc.send_building(incremental=True)
+    server.world.nodes.clear()
+    mc.send_building(incremental=True)
+    assert [server.world.get_node((x, 20, 0)) for x in range(3)] == ["default:stone"] * 3
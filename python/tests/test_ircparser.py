@@ -0,0 +1,78 @@
+"""IrcLineParser gives the same messages however the received bytes are split between feeds"""
+import random
+
+import pytest
+
+from ircbuilder import ircparser
+
+LINES = [
+    ":irc.example 001 pyt :Welcome to IRC",
+    "PING :irc.example",
+    ":mtserver!mt@host PRIVMSG pyt :default:stone 12",
+    ":mtserver!mt@host PRIVMSG pyt :Ünïcödé ☃ reply",
+    ":irc.example 353 pyt = #chan :pyt mtserver",
+    ":nick!u@h JOIN #chan",
+]
+
+
+def fields(messages):
+    return [(m.prefix, m.command, m.params, m.line) for m in messages]
+
+
+def expected():
+    return fields(ircparser.parse_line(line) for line in LINES)
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("wrap", [bytes, bytearray, memoryview])
+def test_split_anywhere(seed, wrap):
+    data = "".join(line + "\r\n" for line in LINES).encode("utf-8")
+    rng = random.Random(seed)
+    cuts = sorted(rng.sample(range(1, len(data)), rng.randint(1, 30)))
+    parser = ircparser.IrcLineParser()
+    messages = []
+    for beg, end in zip([0] + cuts, cuts + [len(data)]):
+        messages.extend(parser.feed(wrap(data[beg:end])))
+    assert fields(messages) == expected()
+    assert parser.pending() == 0
+    assert parser.lines == len(LINES)
+
+
+def test_byte_at_a_time():
+    data = "".join(line + "\r\n" for line in LINES).encode("utf-8")
+    parser = ircparser.IrcLineParser()
+    messages = []
+    for i in range(len(data)):
+        messages.extend(parser.feed(data[i:i + 1]))
+    assert fields(messages) == expected()
+
+
+def test_incomplete_line_pending():
+    parser = ircparser.IrcLineParser()
+    assert fields(parser.feed(b"PING :a\r\nPING :b")) == [(None, "PING", ["a"], "PING :a")]
+    assert parser.pending() == len(b"PING :b")
+    assert fields(parser.feed(b"\r\n")) == [(None, "PING", ["b"], "PING :b")]
+    assert parser.pending() == 0
+
+
+def test_bare_line_feeds_and_empty_lines():
+    parser = ircparser.IrcLineParser()
+    messages = parser.feed(b"PING :a\n\r\nPING :b\r\n\n")
+    assert [m.trailing for m in messages] == ["a", "b"]
+
+
+def test_invalid_utf8_replaced():
+    parser = ircparser.IrcLineParser()
+    (message,) = parser.feed(b":n!u@h PRIVMSG pyt :bad \xff byte\r\n")
+    assert message.trailing == "bad � byte"
+
+
+def test_parse_line():
+    m = ircparser.parse_line(":mtserver!mt@host PRIVMSG pyt :air 1")
+    assert (m.nick, m.command, m.params, m.trailing) == ("mtserver", "PRIVMSG", ["pyt", "air 1"], "air 1")
+    m = ircparser.parse_line(":irc.example MODE pyt +i")
+    assert (m.nick, m.command, m.params) == ("irc.example", "MODE", ["pyt", "+i"])
+    m = ircparser.parse_line("PRIVMSG #chan :text with : colon")
+    assert (m.prefix, m.nick, m.params) == (None, None, ["#chan", "text with : colon"])
+    assert ircparser.parse_line("QUIT").trailing == ""
+    assert ircparser.parse_line("") is None
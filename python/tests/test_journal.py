@@ -0,0 +1,111 @@
+"""Sends resumed from a SendJournal only send batches which were never acknowledged"""
+import random
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import fakeserver
+from ircbuilder import floodcontrol
+from ircbuilder import journal
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+
+def scattered_node_dict(n, item="default:stone"):
+    # random positions compress poorly so the send needs several batches
+    rng = random.Random(n)
+    positions = rng.sample([(x, y, z) for x in range(0, 200, 2) for y in range(10, 40, 2) for z in range(0, 40, 2)], n)
+    return dict.fromkeys(positions, item)
+
+
+def test_journal_survives_reopening(tmp_path):
+    path = str(tmp_path / "send.journal")
+    command = payload.node_list_commands([(1, 2, 3), ((0, 0, 0), (2, 2, 2))], "default:stone")[0]
+    other = payload.node_list_commands([(5, 5, 5)], "air")[0]
+    with journal.SendJournal(path) as j:
+        assert j.record(command, "default:stone 28") == 28
+        assert j.record(other, "Unknown command. Try 'help'") is None
+        assert j.unacknowledged == 1
+    with open(path, "a", encoding='utf-8') as f:
+        f.write('{"key": "incompl')
+    with journal.SendJournal(path) as j:
+        assert command in j and other not in j
+        assert j.reply(command) == "default:stone 28"
+        assert j.nodes_set() == 28
+        j.clear()
+    with journal.SendJournal(path) as j:
+        assert len(j) == 0
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer(flood_burst=1000, flood_rate=1000.0).start()
+    yield server
+    server.stop()
+
+
+def connector(server):
+    def connect():
+        mc = MinetestConnection.create(server.host, "t", "t", port=server.port,
+                                       flood_control=floodcontrol.FloodControl(burst=1000, rate=1000.0))
+        mc.dispatcher.late_reply_grace = 0.0
+        return mc
+    return connect
+
+
+def test_resume_skips_acknowledged_batches(tmp_path, server):
+    node_dict = scattered_node_dict(800)
+    node_lists = nodebuilder.node_lists_from_node_dict(node_dict)
+    mc = connector(server)()
+    try:
+        with journal.SendJournal(str(tmp_path / "send.journal")) as j:
+            server.world.drop_replies["set_node_list2"] = 1
+            assert not journal.resume(mc, node_lists, j)
+            assert j.unacknowledged == 1
+            batches = len(j) + 1
+            assert batches > 2
+            commands = server.world.commands
+            assert journal.resume(mc, node_lists, j)
+            # only the batch whose reply was lost is sent again
+            assert server.world.commands - commands == 1
+            assert len(j) == batches
+            assert j.nodes_set() == len(node_dict)
+            assert mc.journal is None
+    finally:
+        mc.close()
+    assert server.world.nodes == node_dict
+
+
+def test_verify_sends_everything_again_after_world_lost(tmp_path, server):
+    node_dict = scattered_node_dict(300)
+    node_lists = nodebuilder.node_lists_from_node_dict(node_dict)
+    mc = connector(server)()
+    try:
+        with journal.SendJournal(str(tmp_path / "send.journal")) as j:
+            assert journal.resume(mc, node_lists, j)
+            server.world.nodes.clear()
+            assert journal.resume(mc, node_lists, j, verify_sample=1)
+    finally:
+        mc.close()
+    assert server.world.nodes == node_dict
+
+
+def test_send_resumable_reconnects(tmp_path, server):
+    node_dict = scattered_node_dict(500)
+    path = str(tmp_path / "send.journal")
+    server.world.drop_replies["set_node_list2"] = 1
+    j = journal.send_resumable(connector(server), node_dict, path, delay=0.0)
+    assert j.unacknowledged == 0
+    assert server.world.nodes == node_dict
+    # everything is in the journal so running again sends nothing
+    nodes_set = server.world.nodes_set
+    journal.send_resumable(connector(server), node_dict, path, delay=0.0)
+    assert server.world.nodes_set == nodes_set
+
+
+def test_send_resumable_gives_up(tmp_path):
+    def connect():
+        raise ConnectionRefusedError("no server")
+
+    with pytest.raises(ConnectionError):
+        journal.send_resumable(connect, {(0, 0, 0): "air"}, str(tmp_path / "send.journal"), attempts=2, delay=0.0)
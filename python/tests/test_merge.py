@@ -0,0 +1,63 @@
+"""node_lists_with_cuboids covers exactly the input points with disjoint cuboids"""
+import itertools
+import random
+
+import pytest
+
+from ircbuilder import nodebuilder
+
+
+def covered(list_pos):
+    points = []
+    for pos in list_pos:
+        if isinstance(pos[0], tuple):
+            (x1, y1, z1), (x2, y2, z2) = pos
+            assert x1 <= x2 and y1 <= y2 and z1 <= z2
+            points.extend(itertools.product(range(x1, x2 + 1), range(y1, y2 + 1), range(z1, z2 + 1)))
+        else:
+            points.append(pos)
+    return points
+
+
+@pytest.mark.parametrize("strategy", nodebuilder.CUBOID_STRATEGIES)
+@pytest.mark.parametrize("seed", range(20))
+def test_cuboids_cover_exactly_the_input(strategy, seed):
+    rng = random.Random(seed)
+    density = rng.uniform(0.2, 0.9)
+    points = [p for p in itertools.product(range(-3, 4), range(5), range(6)) if rng.random() < density]
+    node_lists = nodebuilder.node_lists_with_cuboids({"default:stone": points}, strategy)
+    cells = covered(node_lists["default:stone"])
+    assert len(cells) == len(set(cells))  # cuboids never overlap
+    assert set(cells) == set(points)
+
+
+@pytest.mark.parametrize("strategy", nodebuilder.CUBOID_STRATEGIES)
+def test_single_points_stay_tuples(strategy):
+    node_lists = nodebuilder.node_lists_with_cuboids({"a": [(0, 0, 0), (5, 5, 5)], "b": [(1, 0, 0), (2, 0, 0)]},
+                                                     strategy)
+    assert node_lists["a"] == [(0, 0, 0), (5, 5, 5)]
+    assert node_lists["b"] == [((1, 0, 0), (2, 0, 0))]
+
+
+def test_solid_box_is_one_cuboid_and_fewest_never_worse():
+    box = list(itertools.product(range(4), range(3), range(5)))
+    for strategy in nodebuilder.CUBOID_STRATEGIES:
+        assert nodebuilder.node_lists_with_cuboids({"a": box}, strategy) == {"a": [((0, 0, 0), (3, 2, 4))]}
+    rng = random.Random(1)
+    points = [p for p in itertools.product(range(6), range(6), range(6)) if rng.random() < 0.6]
+    fast = nodebuilder.node_lists_with_cuboids({"a": points}, "fast")["a"]
+    fewest = nodebuilder.node_lists_with_cuboids({"a": points}, "fewest")["a"]
+    assert len(fewest) <= len(fast)
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        nodebuilder.node_lists_with_cuboids({"a": [(0, 0, 0)]}, "best")
+
+
+def test_node_lists_from_node_dict_with_palette():
+    palette = nodebuilder.ItemPalette()
+    node_dict = {(0, 0, 0): "a", (0, 0, 1): "a", (3, 3, 3): "b"}
+    expected = {"a": [((0, 0, 0), (0, 0, 1))], "b": [(3, 3, 3)]}
+    assert nodebuilder.node_lists_from_node_dict(node_dict) == expected
+    assert nodebuilder.node_lists_from_node_dict(palette.encode(node_dict), palette=palette) == expected
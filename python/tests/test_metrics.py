@@ -0,0 +1,86 @@
+"""Metrics histograms, listener events and the summary of a MinetestConnection"""
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import fakeserver
+from ircbuilder import metrics
+
+
+def test_latency_histogram():
+    h = metrics.LatencyHistogram()
+    assert h.percentile(0.5) is None
+    for seconds in (0.0005, 0.003, 0.003, 0.03, 20.0):
+        h.add(seconds)
+    d = h.as_dict()
+    assert d['count'] == 5
+    assert d['min'] == 0.0005
+    assert d['max'] == 20.0
+    assert d['p50'] == 0.005
+    assert d['p99'] == 20.0
+    assert d['buckets'] == {'<=0.001': 1, '<=0.005': 2, '<=0.05': 1, '>10.0': 1}
+
+
+def test_listener_events_and_summary():
+    m = metrics.Metrics()
+    events = []
+    m.add_listener(lambda event, data: events.append((event, data)))
+    m.command("get_node", 0.01)
+    m.command("set_node_list2", 5.0, timeout=True)
+    m.batch("default:stone", 10, 200, 50)
+    with m.stage("merge"):
+        pass
+    assert [event for event, data in events] == ["command", "command", "batch", "stage"]
+    assert events[2][1] == {'item': "default:stone", 'entries': 10, 'raw_bytes': 200, 'compressed_bytes': 50}
+    summary = m.summary()
+    assert summary['commands']['get_node']['count'] == 1
+    assert summary['timeouts'] == {'set_node_list2': 1}
+    assert summary['compression_ratio'] == 4.0
+    assert 'merge' in summary['stage_time']
+
+
+def test_failing_listener_does_not_stop_measurement():
+    m = metrics.Metrics()
+    seen = []
+
+    def failing(event, data):
+        raise RuntimeError("listener failed")
+
+    m.add_listener(failing)
+    m.add_listener(lambda event, data: seen.append(event))
+    m.batch("air", 1, 10, 10)
+    assert seen == ["batch"]
+    assert m.batches == 1
+    m.remove_listener(failing)
+    assert len(m.listeners) == 1
+
+
+def test_timed_without_metrics():
+    with metrics.timed(None, "merge"):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer().start()
+    yield server
+    server.stop()
+
+
+def test_connection_summary(server):
+    mc = MinetestConnection.create(server.host, "t", "t", port=server.port)
+    events = []
+    mc.metrics.add_listener(lambda event, data: events.append(event))
+    try:
+        mc.get_node(0, 0, 0)
+        mc.set_node_list([(0, 5, 0), ((1, 5, 0), (3, 5, 2))], "default:stone")
+        summary = mc.metrics_summary()
+    finally:
+        mc.close()
+    assert "batch" in events and "command" in events and "stage" in events
+    assert summary['batches'] == 1
+    assert summary['batch_entries'] == 2
+    assert summary['sender']['lines_sent'] > 0
+    assert summary['late_replies'] == summary['lost_replies'] == summary['outstanding_replies'] == 0
+    assert summary['commands']["cmd get_node"]['count'] == 1
+    text = metrics.format_summary(summary)
+    assert "set_node_list: 1 batches 2 entries" in text
@@ -0,0 +1,102 @@
+"""Fixed vectors of set_node_list2 payloads checked against the python encoder and decoder and the decoder in init.lua
+
+node_list2_vectors.json holds each payload as raw bytes in hex and as the zlib compressed base64 sent in commands,
+with the cuboids it encodes. The init.lua checks run the mod's decoder with lupa and are skipped if it isn't installed.
+"""
+import json
+import os
+
+import pytest
+
+from ircbuilder import payload
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+MOD_DIR = os.path.dirname(os.path.dirname(HERE))
+
+with open(os.path.join(HERE, "node_list2_vectors.json"), encoding='utf-8') as f:
+    VECTORS = json.load(f)
+
+
+def corners_of(vector):
+    return [(tuple(lo), tuple(hi)) for lo, hi in vector["corners"]]
+
+
+def vector_id(vector):
+    return vector["name"]
+
+
+@pytest.fixture(scope="module")
+def mod():
+    """init.lua loaded into lua with just enough of the minetest api stubbed to register its chat commands"""
+    lupa = pytest.importorskip("lupa")
+    lua = lupa.LuaRuntime()
+    lua.execute(f"""
+        chatcommands = {{}}
+        minetest = {{
+            get_modpath = function(name) return {json.dumps(MOD_DIR)} end,
+            get_current_modname = function() return "irc_builder" end,
+            register_privilege = function(name, def) end,
+            register_chatcommand = function(name, def) chatcommands[name] = def end,
+        }}
+    """)
+    lua.execute(f"dofile({json.dumps(os.path.join(MOD_DIR, 'init.lua'))})")
+    return lua
+
+
+def lua_corners(pos_list):
+    # lua numbers may be floats, which compare equal to the expected ints only if they are whole
+    return [(tuple(pair.pos1[axis] for axis in "xyz"), tuple(pair.pos2[axis] for axis in "xyz"))
+            for pair in pos_list.values()]
+
+
+def lua_decode(mod, raw):
+    """Results of irc_builder.decode_node_list2 as a tuple, even when it returns only one"""
+    result = mod.globals().irc_builder.decode_node_list2(mod.table(*raw))
+    return result if isinstance(result, tuple) else (result,)
+
+
+@pytest.mark.parametrize("vector", VECTORS["vectors"], ids=vector_id)
+def test_python_encoder(vector):
+    assert payload.encode_node_list2_raw(corners_of(vector)).hex() == vector["raw"]
+
+
+@pytest.mark.parametrize("vector", VECTORS["vectors"], ids=vector_id)
+def test_python_decoder(vector):
+    assert payload.decode_node_list2_raw(bytes.fromhex(vector["raw"])) == corners_of(vector)
+    assert payload.decode_node_list2(vector["b64"]) == corners_of(vector)
+
+
+@pytest.mark.parametrize("vector", VECTORS["errors"], ids=vector_id)
+def test_python_decoder_errors(vector):
+    with pytest.raises(ValueError, match=vector["error"]):
+        payload.decode_node_list2(vector["b64"])
+
+
+@pytest.mark.parametrize("vector", VECTORS["vectors"], ids=vector_id)
+def test_lua_decoder(mod, vector):
+    pos_list = lua_decode(mod, bytes.fromhex(vector["raw"]))[0]
+    assert lua_corners(pos_list) == corners_of(vector)
+
+
+@pytest.mark.parametrize("vector", VECTORS["vectors"], ids=vector_id)
+def test_lua_inflate_and_decode(mod, vector):
+    inflate = mod.execute(f"return dofile({json.dumps(os.path.join(MOD_DIR, 'inflate_nocrc.lua'))})")
+    raw = inflate.b64dec_inflate_zlib_bytes(vector["b64"])
+    assert bytes(raw.values()).hex() == vector["raw"]
+
+
+@pytest.mark.parametrize("vector", VECTORS["errors"], ids=vector_id)
+def test_lua_decoder_errors(mod, vector):
+    pos_list, error = lua_decode(mod, bytes.fromhex(vector["raw"]))
+    assert pos_list is None
+    assert error == vector["error"]
+
+
+@pytest.mark.parametrize("vector", VECTORS["errors"], ids=vector_id)
+def test_lua_error_reply_is_not_a_count(mod, vector):
+    item = "default:stone"
+    ok, reply = mod.globals().chatcommands.set_node_list2.func("player", f"{vector['b64']} {item}")
+    assert not ok
+    assert payload.reply_count(reply) is None
+    assert payload.reply_count(reply, item) is None
+    assert payload.set_node_list_result([reply], item) == f"0 [{reply}]"
@@ -0,0 +1,59 @@
+"""Merging and encoding in a process pool sends the same nodes as nodebuilder.send_node_dict"""
+import concurrent.futures
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import fakeserver
+from ircbuilder import nodebuilder
+from ircbuilder import parallel
+
+
+def sample_nodes():
+    node_dict = nodebuilder.build(range(0, 70), range(0, 3), range(0, 40), "default:stone")
+    node_dict.update(nodebuilder.build(range(10, 60), 1, range(5, 35), "air"))
+    node_dict.update(nodebuilder.build(range(0, 70, 7), 3, 0, "default:torch"))
+    return node_dict
+
+
+def test_partition_covers_nodes_with_end_list_last_in_each_group():
+    node_dict = sample_nodes()
+    parts = parallel.partition(node_dict, end_list=("air",), region_size=16, min_nodes=1000)
+    assert sorted((pos, item) for item, points in parts for pos in points) == sorted(
+        (pos, item) for pos, item in node_dict.items())
+    # a part of air is always followed by a different group, whose first part isn't air
+    groups = 0
+    for (item, _), (next_item, _) in zip(parts, parts[1:]):
+        if item == "air":
+            assert next_item != "air"
+            groups += 1
+    assert groups > 1
+
+
+def test_send_node_dict_in_worker_processes(monkeypatch):
+    contexts = []
+    real_executor = concurrent.futures.ProcessPoolExecutor
+
+    def executor(*args, **kwargs):
+        contexts.append(kwargs.get("mp_context"))
+        return real_executor(*args, **kwargs)
+    monkeypatch.setattr(concurrent.futures, "ProcessPoolExecutor", executor)
+    node_dict = sample_nodes()
+    with fakeserver.FakeIrcServer() as server:
+        mc = MinetestConnection.create(server.host, "t", "t", port=server.port)
+        try:
+            results = parallel.send_node_dict(mc, node_dict, end_list=("air",), workers=2, min_nodes=2000)
+        finally:
+            mc.close()
+        assert all(server.world.get_node(pos) == item for pos, item in node_dict.items())
+    assert len(results) > 3
+    assert [context.get_start_method() for context in contexts] == [parallel.START_METHOD]
+    assert parallel.START_METHOD != "fork"
+
+
+@pytest.mark.parametrize("strategy", nodebuilder.CUBOID_STRATEGIES)
+def test_merge_encode_matches_node_lists(strategy):
+    points = list(sample_nodes())
+    list_pos, commands, batch_stats = parallel.merge_encode("default:stone", points, strategy, 2)
+    assert list_pos == nodebuilder.node_lists_with_cuboids({"default:stone": points}, strategy)["default:stone"]
+    assert len(commands) == len(batch_stats)
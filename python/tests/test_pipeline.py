@@ -0,0 +1,64 @@
+"""set_node_list keeps up to window batches awaiting replies, so round trips overlap without losing any batch"""
+import random
+import time
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import fakeserver
+from ircbuilder import floodcontrol
+from ircbuilder import payload
+
+LATENCY = 0.2
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer(latency=LATENCY, flood_burst=1000, flood_rate=1000.0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mc(server):
+    mc = MinetestConnection.create(server.host, "t", "t", port=server.port,
+                                   flood_control=floodcontrol.FloodControl(burst=1000, rate=1000.0))
+    mc.negotiate_node_list_version()
+    yield mc
+    mc.close()
+
+
+def scattered(n):
+    # random distinct positions compress poorly so many batches are needed
+    rng = random.Random(n)
+    return rng.sample([(x, y, z) for x in range(0, 400, 2) for y in range(0, 40, 2) for z in range(0, 40, 2)], n)
+
+
+@pytest.mark.parametrize("window", [1, 4, 16])
+def test_every_batch_acknowledged(server, mc, window):
+    list_pos = scattered(600)
+    batches = len(payload.node_list_commands(list_pos, "default:stone", version=mc.node_list_version))
+    assert batches > 4
+    commands = server.world.commands
+    result = mc.set_node_list(list_pos, "default:stone", window=window)
+    assert result == "default:stone 600"
+    assert server.world.commands - commands == batches
+    assert all(server.world.get_node(pos) == "default:stone" for pos in list_pos)
+
+
+def test_window_overlaps_round_trips(mc):
+    list_pos = scattered(600)
+    batches = len(payload.node_list_commands(list_pos, "default:stone", version=mc.node_list_version))
+    start = time.monotonic()
+    mc.set_node_list(list_pos, "default:stone", window=1)
+    serial = time.monotonic() - start
+    start = time.monotonic()
+    mc.set_node_list(list_pos, "default:glass", window=batches)
+    pipelined = time.monotonic() - start
+    assert serial >= batches * LATENCY
+    assert pipelined < serial / 2
+
+
+def test_pipeline_window_default(server, mc):
+    mc.pipeline_window = 8
+    assert mc.set_node_list(scattered(300), "default:dirt") == "default:dirt 300"
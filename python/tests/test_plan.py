@@ -0,0 +1,108 @@
+"""SendPlan made offline matches what a real send does, and survives being saved and loaded"""
+import random
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import fakeserver
+from ircbuilder import floodcontrol
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+FAST = dict(burst=1000, rate=1000.0)
+
+
+def random_node_dict(seed):
+    rng = random.Random(seed)
+    node_dict = {}
+    for _ in range(30):
+        x, y, z = (rng.randint(-30, 30) for _ in range(3))
+        item = rng.choice(["default:stone", "default:glass", "air", '{"name":"default:torch","param2":1}'])
+        node_dict.update(nodebuilder.build(range(x, x + rng.randint(1, 6)), range(y, y + 3), z, item))
+    for _ in range(300):
+        node_dict[tuple(rng.randint(-60, 60) for _ in range(3))] = "default:dirt"
+    return node_dict
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer(world=fakeserver.FakeMinetest(ground_level=-100), flood_burst=1000,
+                                      flood_rate=1000.0).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def mc(server):
+    mc = MinetestConnection.create(server.host, "t", "t", port=server.port,
+                                   flood_control=floodcontrol.FloodControl(**FAST))
+    mc.negotiate_node_list_version()
+    sent = mc.sent_commands = []
+    send_cmd = mc.send_cmd
+
+    def recording_send_cmd(msg, *args, **kwargs):
+        sent.append(msg)
+        return send_cmd(msg, *args, **kwargs)
+
+    mc.send_cmd = recording_send_cmd
+    yield mc
+    mc.close()
+
+
+def test_plan_matches_real_send(server, mc):
+    node_dict = random_node_dict(1)
+    plan = nodebuilder.plan_node_dict(node_dict, end_list=("air",), mtbotnick=server.mtbotnick)
+    stats = plan.stats()
+    lines, sent_bytes = mc.sender.lines_sent, mc.sender.bytes_sent
+    nodebuilder.send_node_dict(mc, node_dict, end_list=("air",))
+    mc.sender.flush(5)
+    assert mc.sent_commands == plan.commands
+    assert mc.sender.lines_sent - lines == stats['lines']
+    # bytes_sent doesn't count the line feed of each line
+    assert mc.sender.bytes_sent - sent_bytes == stats['bytes'] - stats['lines']
+    assert stats['nodes'] == len(node_dict)
+    assert mc.metrics.batches == stats['lines']
+
+
+def test_send_plan(server, mc, tmp_path):
+    node_dict = random_node_dict(2)
+    plan = nodebuilder.plan_node_dict(node_dict, end_list=("air",), strategy="fewest")
+    path = str(tmp_path / "castle.plan")
+    plan.save(path)
+    loaded = nodebuilder.SendPlan.load(path)
+    assert loaded.steps == plan.steps
+    assert (loaded.version, loaded.mtbotnick) == (plan.version, plan.mtbotnick)
+    nodebuilder.send_plan(mc, loaded)
+    assert mc.sent_commands == plan.commands
+    expected = {pos: "default:torch" if item.startswith("{") else item for pos, item in node_dict.items()}
+    assert server.world.nodes == expected
+
+
+def test_send_plan_rejects_newer_version(server, mc):
+    mc.node_list_version = payload.NODE_LIST_VERSION_1
+    with pytest.raises(ValueError):
+        nodebuilder.send_plan(mc, nodebuilder.plan_node_dict({(0, 0, 0): "air"}))
+    nodebuilder.send_plan(mc, nodebuilder.plan_node_dict({(0, 0, 0): "air"}, version=payload.NODE_LIST_VERSION_1))
+    assert mc.sent_commands[-1].startswith("set_node_list ")
+
+
+def test_estimate_and_split():
+    plan = nodebuilder.plan_node_dict(random_node_dict(3), end_list=("air",))
+    fc = floodcontrol.FloodControl(burst=2, rate=1.0)
+    total = plan.estimate(fc, rtt=0.1)
+    assert total >= len(plan) - 2
+    parts = plan.split(total / 3, fc, rtt=0.1)
+    assert len(parts) > 1
+    assert [command for part in parts for command in part.commands] == plan.commands
+    assert all(part.estimate(fc, rtt=0.1) <= total / 3 or len(part.steps) == 1 for part in parts)
+
+
+def test_plan_stats_per_item():
+    node_dict = {**nodebuilder.build_cuboid(0, 0, 0, 2, 2, 2, "default:stone"), (9, 9, 9): "default:stone",
+                 (5, 5, 5): "air"}
+    stats = nodebuilder.plan_node_dict(node_dict, end_list=("air",)).stats()
+    assert stats['items'] == {
+        "default:stone": {'cuboids': 1, 'positions': 1, 'nodes': 28, 'commands': 1},
+        "air": {'cuboids': 0, 'positions': 1, 'nodes': 1, 'commands': 1},
+    }
+    assert stats['lines'] == 2
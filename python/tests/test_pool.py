@@ -0,0 +1,51 @@
+"""MinetestConnectionPool shares the commands of each item between its connections"""
+import random
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import fakeserver
+from ircbuilder import floodcontrol
+from ircbuilder import pool
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer().start()
+    yield server
+    server.stop()
+
+
+def test_single_item_uses_every_connection(server):
+    connections = [MinetestConnection.create(server.host, "t", "t", pybotnick=f"t{i}", port=server.port,
+                                             flood_control=floodcontrol.FloodControl(burst=100, rate=100.0))
+                   for i in range(3)]
+    p = pool.MinetestConnectionPool(connections)
+    rng = random.Random(1)
+    list_pos = list({(rng.randrange(-9999, 9999), rng.randrange(0, 99), rng.randrange(-9999, 9999)) for _ in range(3000)})
+    try:
+        results = p.send_node_lists({"default:stone": list_pos, "air": [((0, 100, 0), (1, 101, 1))]}, ("air",))
+        stats = p.stats()
+    finally:
+        p.close()
+    assert results == ["default:stone 3000", "air 8"]
+    assert all(st['commands'] > 0 for st in stats)
+    assert sum(st['nodes'] for st in stats) == 3008
+    assert all(st['lines'] >= st['commands'] for st in stats)
+    assert len(server.world.nodes) == 3008
+
+
+def test_pool_writes_update_every_cache(server):
+    connections = [MinetestConnection.create(server.host, "t", "t", pybotnick=f"t{i}", port=server.port)
+                   for i in range(2)]
+    p = pool.MinetestConnectionPool(connections)
+    try:
+        for mc in connections:
+            mc.enable_cache()
+            assert mc.get_node(0, 50, 0) == "air"
+        assert p.set_node_list([(0, 50, 0), ((1, 50, 0), (3, 50, 0))], "default:stone") == "default:stone 4"
+        assert [mc.get_node(0, 50, 0) for mc in connections] == ["default:stone"] * 2
+        p.send_node_lists({"default:glass": [(0, 50, 0)]})
+        assert [mc.get_node(0, 50, 0) for mc in connections] == ["default:glass"] * 2
+    finally:
+        p.close()
@@ -0,0 +1,85 @@
+"""schedule_node_lists sends every entry once, region by region, with end_list items after the walls around them"""
+import collections
+import itertools
+import random
+
+import pytest
+
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+
+SIZE = nodebuilder.MAPBLOCK_SIZE
+
+
+def random_node_lists(seed):
+    rng = random.Random(seed)
+    node_lists = {}
+    for item in ("default:stone", "default:glass", "air", "doors:door_wood"):
+        list_pos = []
+        for _ in range(rng.randint(20, 60)):
+            p = tuple(rng.randint(-40, 40) for _ in range(3))
+            if rng.random() < 0.5:
+                list_pos.append((p, tuple(c + rng.randint(0, 20) for c in p)))
+            else:
+                list_pos.append(p)
+        node_lists[item] = list_pos
+    return node_lists
+
+
+def blocks(pos):
+    lo, hi = payload.cuboid_corners(pos)
+    return set(itertools.product(*(range(lo[axis] // SIZE, hi[axis] // SIZE + 1) for axis in range(3))))
+
+
+def test_morton_never_decreases_along_an_axis():
+    for x, y, z in itertools.product(range(8), repeat=3):
+        code = nodebuilder.morton(x, y, z)
+        assert nodebuilder.morton(x + 1, y, z) > code
+        assert nodebuilder.morton(x, y + 1, z) > code
+        assert nodebuilder.morton(x, y, z + 1) > code
+    assert nodebuilder.region_morton((-1, 0, 0)) < nodebuilder.region_morton((0, 0, 0))
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("min_entries", [1, 30, nodebuilder.SCHEDULE_MIN_ENTRIES])
+def test_every_entry_sent_once(seed, min_entries):
+    node_lists = random_node_lists(seed)
+    schedule = nodebuilder.schedule_node_lists(node_lists, ("air", "doors:"), min_entries=min_entries)
+    sent = collections.Counter((item, pos) for item, list_pos in schedule for pos in list_pos)
+    assert sent == collections.Counter((item, pos) for item, list_pos in node_lists.items() for pos in list_pos)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_end_list_sent_after_walls_sharing_a_mapblock(seed):
+    node_lists = random_node_lists(seed)
+    end_list = ("air", "doors:")
+    schedule = nodebuilder.schedule_node_lists(node_lists, end_list, min_entries=1)
+    order = [(step, item, pos) for step, (item, list_pos) in enumerate(schedule) for pos in list_pos]
+    walls = [(step, blocks(pos)) for step, item, pos in order if not item.startswith(end_list)]
+    for step, item, pos in order:
+        if item.startswith(end_list):
+            covered = blocks(pos)
+            assert all(wall_step < step for wall_step, wall_blocks in walls if wall_blocks & covered)
+
+
+def test_regions_filled_to_min_entries():
+    node_lists = random_node_lists(1)
+    schedule = nodebuilder.schedule_node_lists(node_lists, ("air",), min_entries=40)
+    # consecutive steps of the same region have different items, so a repeated item starts a new region
+    regions = [[]]
+    for item, list_pos in schedule:
+        if any(item == seen for seen, n in regions[-1]):
+            regions.append([])
+        regions[-1].append((item, len(list_pos)))
+    assert len(regions) > 1
+    assert all(sum(n for item, n in region) >= 40 for region in regions[:-1])
+
+
+def test_without_regions_sends_each_item_once_in_ordered_items_order():
+    node_lists = {"air": [(0, 0, 0)], "default:stone": [(1, 0, 0)], "default:glass": [], "door:x": [(2, 0, 0)]}
+    schedule = nodebuilder.schedule_node_lists(node_lists, ("air", "door:"), region_size=None)
+    assert schedule == [("default:stone", [(1, 0, 0)]), ("air", [(0, 0, 0)]), ("door:x", [(2, 0, 0)])]
+
+
+def test_ordered_items_accepts_string():
+    assert nodebuilder.ordered_items({"air": [], "a": []}, "air") == ["a", "air"]
@@ -0,0 +1,102 @@
+"""Building files and .mts schematics read back exactly what was saved"""
+import struct
+import zlib
+
+import pytest
+
+from ircbuilder import building
+from ircbuilder import nodebuilder
+from ircbuilder import storage
+
+
+def sample():
+    b = building.Building()
+    b.build(range(-3, 4), range(2), 5, "default:stone")
+    b.build(0, 2, range(-2, 3), {"name": "default:torch", "param2": 1})
+    b.build(100000, -7, 3, "air")
+    return b
+
+
+@pytest.mark.parametrize("strategy", [None, "fast", "fewest"])
+def test_save_load_round_trip(tmp_path, strategy):
+    b = sample()
+    path = str(tmp_path / "b.ircb")
+    b.save(path, strategy)
+    loaded = building.Building.load(path)
+    assert dict(loaded.building) == dict(b.building)
+    if strategy is None:
+        assert loaded.cuboids is None
+    else:
+        assert loaded.cuboids == nodebuilder.node_lists_from_node_dict(b.nodes, strategy, b.palette)
+
+
+def test_save_node_dict_without_palette(tmp_path):
+    node_dict = dict(sample().building)
+    path = str(tmp_path / "b.ircb")
+    node_lists = {"default:glass": [((0, 0, 0), (1, 1, 1))]}
+    storage.save_building(path, node_dict, node_lists)
+    assert storage.load_node_dict(path) == node_dict
+    assert storage.load_node_lists(path) == node_lists
+
+
+def test_save_leaves_palette_unchanged(tmp_path):
+    b = sample()
+    palette_items = list(b.palette.items)
+    b.cuboids = {"default:glass": [(0, 0, 0)]}
+    path = str(tmp_path / "b.ircb")
+    b.save(path)
+    assert b.palette.items == palette_items
+    assert "default:glass" not in b.palette
+    assert building.Building.load(path).cuboids == {"default:glass": [(0, 0, 0)]}
+
+
+def test_save_too_many_items(tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "MAX_ITEMS", 2)
+    path = tmp_path / "b.ircb"
+    with pytest.raises(ValueError):
+        storage.save_building(str(path), {(i, 0, 0): f"item{i}" for i in range(3)})
+    assert not path.exists()
+
+
+def test_memmap_nodes(tmp_path):
+    pytest.importorskip("numpy")
+    b = sample()
+    path = str(tmp_path / "b.ircb")
+    b.save(path, "fast")
+    palette, xs, ys, zs, items = storage.memmap_nodes(path)
+    assert {(int(x), int(y), int(z)): palette[i] for x, y, z, i in zip(xs, ys, zs, items)} == dict(b.building)
+
+
+def test_not_a_building_file(tmp_path):
+    path = tmp_path / "x"
+    path.write_bytes(b"nope" + bytes(20))
+    with pytest.raises(ValueError):
+        storage.load_nodes(str(path))
+
+
+def write_mts(path, size, names, nodes):
+    """Write a version 4 .mts of nodes [(name index, probability, param2), ...] in z, y, x order"""
+    sx, sy, sz = size
+    data = b"MTSM" + struct.pack(">Hhhh", 4, sx, sy, sz) + bytes([127] * sy)
+    data += struct.pack(">H", len(names))
+    for name in names:
+        data += struct.pack(">H", len(name)) + name.encode('utf-8')
+    bulk = b"".join(struct.pack(">H", n) for n, _, _ in nodes)
+    bulk += bytes(p for _, p, _ in nodes) + bytes(p2 for _, _, p2 in nodes)
+    path.write_bytes(data + zlib.compress(bulk))
+
+
+def test_read_mts(tmp_path):
+    path = tmp_path / "s.mts"
+    names = ["air", "default:stone", "stairs:stair_wood"]
+    # 2 x 1 x 2 in z, y, x order: stone, air, stair with param2 3, stone never placed
+    write_mts(path, (2, 1, 2), names, [(1, 127, 0), (0, 127, 0), (2, 127, 3), (1, 0, 0)])
+    expected = {(10, 20, 30): "default:stone", (11, 20, 30): "air",
+                (10, 20, 31): nodebuilder.item_string({"name": "stairs:stair_wood", "param2": 3})}
+    assert storage.read_mts(str(path), (10, 20, 30)) == expected
+    del expected[(11, 20, 30)]
+    assert storage.read_mts(str(path), (10, 20, 30), include_air=False) == expected
+    b = building.Building.from_mts(str(path), (10, 20, 30), include_air=False)
+    assert dict(b.building) == expected
+    assert storage.mts_node_lists(str(path), (10, 20, 30), include_air=False) == \
+        nodebuilder.node_lists_from_node_dict(expected)
@@ -0,0 +1,82 @@
+"""StreamingBuilding spilled to disk holds and sends the same nodes as a node dict built the same way"""
+import random
+
+import pytest
+
+from ircbuilder import MinetestConnection
+from ircbuilder import building
+from ircbuilder import fakeserver
+from ircbuilder import floodcontrol
+
+ITEMS = ["default:stone", "default:glass", "default:dirt", "air"]
+
+
+def random_build(seed, max_nodes_in_memory):
+    """StreamingBuilding and the node dict it should hold after the same random builds and undos"""
+    rng = random.Random(seed)
+    b = building.StreamingBuilding(chunk_size=8, max_nodes_in_memory=max_nodes_in_memory)
+    expected = {}
+    for _ in range(40):
+        x, y, z = (rng.randint(-20, 20) for _ in range(3))
+        dx, dy, dz = (rng.randint(0, 5) for _ in range(3))
+        xs, ys, zs = range(x, x + dx + 1), range(y, y + dy + 1), range(z, z + dz + 1)
+        positions = [(px, py, pz) for px in xs for py in ys for pz in zs]
+        choice = rng.random()
+        if choice < 0.2:
+            b.build_undo(xs, ys, zs)
+            for pos in positions:
+                expected.pop(pos, None)
+        elif choice < 0.6:
+            item = rng.choice(ITEMS)
+            b.build(xs, ys, zs, item)
+            expected.update(dict.fromkeys(positions, item))
+        else:
+            nodes = [(*pos, rng.choice(ITEMS)) for pos in positions if rng.random() < 0.5]
+            b.add_nodes(nodes)
+            expected.update({(px, py, pz): item for px, py, pz, item in nodes})
+        assert b.nodes_in_memory <= max_nodes_in_memory
+    return b, expected
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_spilled_chunks_hold_every_node(seed):
+    b, expected = random_build(seed, 200)
+    assert b.nodes_spilled > 0
+    nodes = {}
+    for key in b.chunk_keys():
+        chunk = b.chunk_node_dict(key)
+        assert all(pos[axis] // 8 == key[axis] for pos in chunk for axis in range(3))
+        nodes.update(chunk)
+    assert nodes == expected
+    b.close()
+    assert b.spill_file is None
+
+
+def test_add_cuboids_across_chunks():
+    with building.StreamingBuilding(chunk_size=4, max_nodes_in_memory=10) as b:
+        b.add_cuboids([((5, 0, 0), (-2, 3, 1), "default:stone")])
+        nodes = {}
+        for key in b.chunk_keys():
+            nodes.update(b.chunk_node_dict(key))
+    assert nodes == {(x, y, z): "default:stone" for x in range(-2, 6) for y in range(4) for z in range(2)}
+
+
+@pytest.fixture
+def server():
+    server = fakeserver.FakeIrcServer(world=fakeserver.FakeMinetest(ground_level=-100), flood_burst=1000,
+                                   flood_rate=1000.0).start()
+    yield server
+    server.stop()
+
+
+def test_send_sets_every_node(server):
+    b, expected = random_build(7, 300)
+    mc = MinetestConnection.create(server.host, "t", "t", port=server.port,
+                                   flood_control=floodcontrol.FloodControl(burst=1000, rate=1000.0))
+    try:
+        b.send(mc, end_list=("air",))
+    finally:
+        mc.close()
+    assert server.world.nodes == expected
+    # send clears the building
+    assert b.chunk_keys() == []
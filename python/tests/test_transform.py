@@ -0,0 +1,91 @@
+"""Building transforms move nodes and their saved cuboids together"""
+import itertools
+
+import pytest
+
+from ircbuilder import building
+from ircbuilder import nodebuilder
+from ircbuilder import payload
+from ircbuilder import transform
+
+
+def expand(node_lists):
+    """node dict {(x, y, z): item} of every node in node_lists"""
+    nodes = {}
+    for item, list_pos in node_lists.items():
+        for pos in list_pos:
+            lo, hi = payload.cuboid_corners(pos)
+            nodes.update(dict.fromkeys(itertools.product(*(range(a, b + 1) for a, b in zip(lo, hi))), item))
+    return nodes
+
+
+def sample():
+    """L shaped building with saved cuboids"""
+    b = building.Building()
+    b.build(range(3), 0, 0, "default:stone")
+    b.build(0, range(1, 4), 0, "default:wood")
+    b.build(2, 0, 1, "default:glass")
+    b.cuboids = nodebuilder.node_lists_from_node_dict(b.nodes, palette=b.palette)
+    return b
+
+
+def test_rotation_quarter_turns():
+    assert transform.apply(transform.rotation("y", 1), (0, 0, 0), (0, 0, 1)) == (1, 0, 0)
+    assert transform.apply(transform.rotation("z", 1), (0, 0, 0), (1, 0, 0)) == (0, 1, 0)
+    assert transform.apply(transform.rotation("x", 1), (0, 0, 0), (0, 1, 0)) == (0, 0, 1)
+    assert transform.rotation("x", 4) == transform.IDENTITY
+    assert transform.rotation("y", -1) == transform.rotation("y", 3)
+    with pytest.raises(ValueError):
+        transform.axis_index("w")
+
+
+@pytest.mark.parametrize("make", [
+    lambda b: b.translated(5, -2, 7),
+    lambda b: b.rotated("y"),
+    lambda b: b.rotated("x", 2),
+    lambda b: b.rotated("z", -1),
+    lambda b: b.mirrored("x"),
+    lambda b: b.mirrored("z"),
+])
+def test_transforms_keep_cuboids_matching_nodes(make):
+    b = sample()
+    t = make(b)
+    assert len(t) == len(b)
+    assert expand(t.cuboids) == dict(t.building)
+    assert sorted(dict(t.building).values()) == sorted(dict(b.building).values())
+
+
+def test_rotated_and_mirrored_keep_minimum_corner():
+    b = sample()
+    for t in (b.rotated("y"), b.rotated("z", 3), b.mirrored("y")):
+        assert t.bounds()[0] == b.bounds()[0]
+
+
+def test_rotated_about_y():
+    b = building.Building()
+    b.build(0, 0, range(3), "default:stone")
+    assert sorted(b.rotated("y").nodes) == [(0, 0, 0), (1, 0, 0), (2, 0, 0)]
+
+
+def test_tiled_copies_keep_cuboids():
+    b = sample()
+    t = b.tiled(2, 1, 3)
+    assert len(t) == 6 * len(b)
+    assert t.cuboids is not None
+    assert expand(t.cuboids) == dict(t.building)
+    assert t.bounds() == ((0, 0, 0), (5, 3, 5))
+
+
+def test_tiled_single_copy_along_axis_with_small_spacing_keeps_cuboids():
+    b = sample()
+    t = b.tiled(nx=1, nz=2, spacing=(1, 1, 2))
+    assert t.cuboids is not None
+    assert expand(t.cuboids) == dict(t.building)
+
+
+def test_tiled_overlapping_copies_merge_again():
+    b = sample()
+    t = b.tiled(nx=2, spacing=(1, 0, 0))
+    assert t.cuboids is None
+    assert t.building[(1, 0, 0)] == "default:stone"
+    assert t.building[(3, 0, 1)] == "default:glass"